@@ -40,9 +40,15 @@ localhost
 """
 
 from __future__ import absolute_import
+import bisect
+import copy
+import hashlib
+import itertools
+import multiprocessing
 import os
 import re
 import subprocess
+import threading
 import time
 import getpass
 
@@ -69,7 +75,7 @@ pynag_directory = None
 
 # This is the config parser that we use internally, if cfg_file is changed, then config
 # will be recreated whenever a parse is called.
-config = pynag.Parsers.config_parser.Config(cfg_file=cfg_file)
+config = pynag.Parsers.config_parser.Config(cfg_file=cfg_file, incremental=True)
 
 
 #: eventhandlers -- A list of Model.EventHandlers object.
@@ -92,6 +98,47 @@ _UNRESOLVED_MACRO = ''
 # of the macro starts with this prefix:
 _CUSTOM_VARIABLE_PREFIX = '_'
 
+# Keys of ObjectDefinition that are not attributes, and how to look them up
+_COMPUTED_ATTRIBUTES = {
+    'id': lambda obj: obj.get_id(),
+    'description': lambda obj: obj.get_description(),
+    'shortname': lambda obj: obj.get_shortname(),
+    'effective_command_line': lambda obj: obj.get_effective_command_line(),
+    'meta': lambda obj: obj._meta,
+}
+
+# Keys that ObjectDefinition.keys() always returns
+_BUILTIN_KEYS = ('meta', 'id', 'shortname', 'effective_command_line')
+
+# Macros like $HOSTADDRESS$ in command lines
+_MACRO_REGEX = re.compile(r"(\$\w+\$)")
+
+# Command lines and arguments split by _split_macros(), by the original string
+_macro_tokens = {}
+_MAX_MACRO_TOKENS = 10000
+
+
+def _split_macros(string):
+    """ Split a string into plain text and macros
+
+    The result is cached, so every command_line is only split once.
+
+    Args:
+
+        string (str): A string with macros, like a command_line
+
+    Returns:
+
+        list, where every odd item is a macro. For example 'check_ping -H $HOSTADDRESS$'
+        gives ['check_ping -H ', '$HOSTADDRESS$', '']
+    """
+    tokens = _macro_tokens.get(string)
+    if tokens is None:
+        if len(_macro_tokens) >= _MAX_MACRO_TOKENS:
+            _macro_tokens.clear()
+        tokens = _macro_tokens[string] = _MACRO_REGEX.split(string)
+    return tokens
+
 
 class ModelError(pynag.errors.PynagError):
     """Base class for errors in this module."""
@@ -101,9 +148,189 @@ class InvalidMacro(ModelError):
     """Raised when a method is inputted with an invalid macro."""
 
 
+class ModelContext(object):
+
+    """ One Nagios configuration, with its own Config, object cache and relations
+
+    By default pynag.Model works with the configuration in the module
+    globals pynag.Model.cfg_file and pynag.Model.config. A ModelContext
+    lets one process work with several configurations at the same time.
+    Everything in pynag.Model that runs inside a ``with context:`` block,
+    in the same thread, uses the configuration of that context:
+
+    >>> context = ModelContext(cfg_file='/etc/nagios/nagios.cfg')
+    >>> with context:
+    ...     hosts = Host.objects.all # doctest: +SKIP
+
+    Contexts have their own pynag.Utils.ReadWriteLock, so threads that work
+    with different contexts do not wait for each other, and lookups in the
+    same context only wait for reload_cache() and save(). Objects must only
+    be used inside the context they were fetched from.
+
+    Args:
+
+        cfg_file: path to nagios.cfg
+
+        pynag_directory: where new objects are written by default
+
+        config: optional pynag.Parsers.config_parser.Config to use
+
+        watch: how a Config created by the context notices changed files,
+        see pynag.Parsers.config_parser.Config. With the default 'auto',
+        lookups do not stat() every configuration file.
+    """
+
+    def __init__(self, cfg_file=None, pynag_directory=None, config=None, watch='auto'):
+        if cfg_file is None and config is not None:
+            cfg_file = config.cfg_file
+        self.lock = pynag.Utils.ReadWriteLock()
+        self.cfg_file = cfg_file
+        self.pynag_directory = pynag_directory
+        self.config = config
+        self.watch = watch
+        self.eventhandlers = []
+        self._class_attributes = {}  # class -> {attribute name: value}, see _ContextType
+
+    def __enter__(self):
+        _active_contexts.stack += (self,)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_contexts.stack = _active_contexts.stack[:-1]
+
+    def get_config(self):
+        """ Returns the Config of this context, creates a new one if cfg_file has changed
+
+        With cfg_file None, the current Config is kept, whichever nagios.cfg
+        it found by itself.
+        """
+        if self._needs_new_config():
+            self.config = pynag.Parsers.config_parser.Config(
+                self.cfg_file, incremental=True, lock=self.lock, watch=self.watch)
+        return self.config
+
+    def _needs_new_config(self):
+        """ Returns True if there is no Config yet, or it reads another cfg_file than asked for """
+        config = self.config
+        if config is None:
+            return True
+        return self.cfg_file is not None and config.cfg_file != self.cfg_file
+
+
+class _GlobalModelContext(ModelContext):
+
+    """ The context used outside of any ``with ModelContext()`` block
+
+    It reads and writes the module globals, so code that sets
+    pynag.Model.cfg_file or pynag.Model.config keeps working.
+    """
+
+    def __init__(self):
+        self.lock = pynag.Utils.ReadWriteLock()
+        self._class_attributes = {}
+
+    def _get_config(self):
+        return config
+
+    def _set_config(self, value):
+        global config
+        config = value
+
+    def _get_cfg_file(self):
+        return cfg_file
+
+    def _set_cfg_file(self, value):
+        global cfg_file
+        cfg_file = value
+
+    def _get_pynag_directory(self):
+        return pynag_directory
+
+    def _set_pynag_directory(self, value):
+        global pynag_directory
+        pynag_directory = value
+
+    config = property(_get_config, _set_config)
+    cfg_file = property(_get_cfg_file, _set_cfg_file)
+    pynag_directory = property(_get_pynag_directory, _set_pynag_directory)
+    eventhandlers = property(lambda self: eventhandlers)
+
+    def get_config(self):
+        """ Returns the Config of this context, creates a new one if cfg_file has changed """
+        if self._needs_new_config():
+            self.config = pynag.Parsers.config_parser.Config(self.cfg_file, incremental=True)
+        return self.config
+
+
+class _ActiveContexts(threading.local):
+
+    """ Contexts entered with ``with context:``, per thread """
+
+    stack = ()
+
+
+_active_contexts = _ActiveContexts()
+_global_context = _GlobalModelContext()
+
+
+def get_context():
+    """ Returns the ModelContext that is active in this thread """
+    stack = _active_contexts.stack
+    return stack[-1] if stack else _global_context
+
+
+def _context_lock(*args, **kwargs):
+    """ Lock of the active ModelContext, for use with pynag.Utils.synchronized """
+    return get_context().lock
+
+
+class _ContextAttribute(object):
+
+    """ Class attribute that is kept in the active ModelContext, see _ContextType """
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def __get__(self, cls, metaclass=None):
+        attributes = get_context()._class_attributes.setdefault(cls, {})
+        try:
+            return attributes[self.name]
+        except KeyError:
+            value = attributes[self.name] = copy.copy(self.default)
+            return value
+
+    def __set__(self, cls, value):
+        get_context()._class_attributes.setdefault(cls, {})[self.name] = value
+
+
+class _ContextType(type):
+
+    """ Metaclass that keeps mutable class attributes in the active ModelContext
+
+    Every dict, list or set in the class body must be empty. Each
+    ModelContext gets its own copy, so ``Class.attribute`` reads and writes
+    the attribute of the context that is active in this thread.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        descriptors = {}
+        for attribute, value in list(namespace.items()):
+            if isinstance(value, (dict, list, set)):
+                descriptors[attribute] = _ContextAttribute(attribute, namespace.pop(attribute))
+        namespace['_context_defaults'] = tuple(descriptors)
+        # Descriptors for class attributes must live in the metaclass, so every class gets its own
+        metaclass = type(mcs)('%sType' % name, (mcs,), descriptors)
+        return type.__new__(metaclass, name, bases, namespace)
+
+
+@six.add_metaclass(_ContextType)
 class ObjectRelations(object):
 
-    """ Static container for objects and their respective neighbours """
+    """ Static container for objects and their respective neighbours
+
+    Relations are kept per ModelContext.
+    """
     # c['contact_name'] = [host1.get_id(),host2.get_id()]
     contact_hosts = defaultdict(set)
 
@@ -149,6 +376,15 @@ class ObjectRelations(object):
     # c['hostgroup_name'] = ['service1.get_id()','service2.get_id()']
     hostgroup_services = defaultdict(set)
 
+    # c['host_name'] = ['service1.get_id()','service2.get_id()'], services with host_name !host_name
+    excluded_host_services = defaultdict(set)
+
+    # c['hostgroup_name'] = ['service1.get_id()','service2.get_id()'], services with hostgroup_name !hostgroup_name
+    excluded_hostgroup_services = defaultdict(set)
+
+    # c['host_name'] = ['service1.get_id()','service2.get_id()'], with services from hostgroups, see resolve_host_services()
+    host_effective_services = defaultdict(set)
+
     # c['service.get_id()'] = '['contactgroup_name1','contactgroup_name2']
     service_contact_groups = defaultdict(set)
 
@@ -193,13 +429,58 @@ class ObjectRelations(object):
     # servicegroup_members['servicegroup_name'] = ['service1_shortname','service2_shortname']
     servicegroup_members = defaultdict(set)
 
+    # _regex_matchers['host'] = RegexMatcher(host_names), kept between reloads
+    _regex_matchers = {}
+
     @staticmethod
     def reset():
         """ Runs clear() on every member attribute in ObjectRelations """
-        for k, v in ObjectRelations.__dict__.items():
+        for k in ObjectRelations._context_defaults:
+            v = getattr(ObjectRelations, k)
             if isinstance(v, defaultdict):
                 v.clear()
 
+    @staticmethod
+    def collect(obj):
+        """ Returns a tuple of every relation that obj._do_relations() adds
+
+        Every relation is a tuple of (relation_name, key, value), and can be
+        added back with :py:meth:`replay` without calling _do_relations() again.
+        For example ('host_hostgroups', 'localhost', 'linux-servers').
+        Relations in ObjectRelations.use have (object_type, name) as key.
+        """
+        # Give _do_relations() empty relations to fill, see _ContextType
+        class_attributes = get_context()._class_attributes
+        originals = class_attributes.get(ObjectRelations, {})
+        class_attributes[ObjectRelations] = collected = {}
+        try:
+            obj._do_relations()
+        finally:
+            class_attributes[ObjectRelations] = originals
+        relations = []
+        for relation_name, dictionary in collected.items():
+            for key, values in dictionary.items():
+                if relation_name == 'use':
+                    for name, ids in values.items():
+                        relations += [(relation_name, (key, name), i) for i in ids]
+                else:
+                    relations += [(relation_name, key, i) for i in values]
+        return tuple(relations)
+
+    @staticmethod
+    def replay(relations):
+        """ Add relations, as returned by :py:meth:`collect`, to ObjectRelations """
+        self = ObjectRelations
+        dictionaries = {}
+        for relation_name, key, value in relations:
+            dictionary = dictionaries.get(relation_name)
+            if dictionary is None:
+                dictionary = dictionaries[relation_name] = getattr(self, relation_name)
+            if relation_name == 'use':
+                dictionary[key[0]][key[1]].add(value)
+            else:
+                dictionary[key].add(value)
+
     @staticmethod
     def _get_subgroups(group_name, dictname):
         """ Helper function that lets you get all sub-group members of a particular group
@@ -226,17 +507,30 @@ class ObjectRelations(object):
         expand = self._expand_regex
         shortnames = ObjectFetcher._cached_shortnames
 
-        host_names = list(shortnames['host'].keys())
-        hostgroup_names = list(shortnames['hostgroup'].keys())
+        matchers = {}
+        for object_type in ('host', 'hostgroup'):
+            matcher = self._regex_matchers.get(object_type)
+            if matcher is None:
+                matcher = self._regex_matchers[object_type] = RegexMatcher()
+            matcher.update(shortnames[object_type].keys())
+            matchers[object_type] = matcher
 
-        expand(self.hostgroup_hosts, host_names)
-        expand(self.host_hostgroups, hostgroup_names)
-        expand(self.service_hostgroups, hostgroup_names)
+        expand(self.hostgroup_hosts, matchers['host'].names, matchers['host'])
+        expand(self.host_hostgroups, matchers['hostgroup'].names, matchers['hostgroup'])
+        expand(self.service_hostgroups, matchers['hostgroup'].names, matchers['hostgroup'])
 
     @staticmethod
-    def _expand_regex(dictionary, full_list):
+    def _expand_regex(dictionary, full_list, matcher=None):
         """ Replaces any regex found in dictionary.values() or dictionary.keys() **INPLACE**
 
+        Args:
+
+            dictionary: dict of name -> set of names, e.g. ObjectRelations.hostgroup_hosts
+
+            full_list: every name that a regex in dictionary.values() can match
+
+            matcher: optional RegexMatcher for full_list, so results can be reused
+
         Example with ObjectRelations.hostgroup_hosts
         >>> hostnames = set(['localhost','remotehost', 'not_included'])
         >>> hostgroup_hosts = {'hostgroup1': set([ '.*host' ]), 'hostgroup2' : set(['localhost','remotehost']), }
@@ -246,6 +540,7 @@ class ObjectRelations(object):
         >>> hostgroup_hosts['hostgroup1'] == set(['localhost','remotehost'])
         True
         """
+        config = get_context().config
         if config.get_cfg_value('use_regexp_matching') == "0":
             return
 
@@ -255,8 +550,8 @@ class ObjectRelations(object):
             always_use_regex = False
         is_regex = lambda x: x is not None and (always_use_regex or '*' in x or '?' in x or '+' in x or '\.' in x)
 
-        # Strip None entries from full_list
-        full_list = [x for x in full_list if x is not None]
+        if matcher is None:
+            matcher = RegexMatcher(full_list)
 
         # Strip None entries from dictionary
 
@@ -293,42 +588,28 @@ class ObjectRelations(object):
                 value = set(value)
                 #new_value = value.copy()
             for i in regex_members:
-                if i == '*':  # Nagios allows * instead of a valid regex, lets adjust to that
-                    expanded_list = full_list
-                else:
-                    regex = re.compile(i)
-                    expanded_list = list(filter(regex.search, full_list))
                 value.remove(i)
-                value.update(expanded_list)
-                #dictionary[key] = new_value
+                value.update(matcher.match(i))
 
     @staticmethod
     def resolve_contactgroups():
         """ Update all contactgroup relations to take into account contactgroup.contactgroup_members """
-        groups = list(ObjectRelations.contactgroup_contactgroups.keys())
-        for group in groups:
-            subgroups = ObjectRelations._get_subgroups(group, ObjectRelations.contactgroup_contactgroups)
-            ObjectRelations.contactgroup_subgroups[group] = subgroups
-
-            # Loop through every subgroup and apply its attributes to ours
-            for subgroup in subgroups:
-                for i in ObjectRelations.contactgroup_contacts[subgroup]:
-                    ObjectRelations.contact_contactgroups[i].add(group)
-                ObjectRelations.contactgroup_contacts[group].update(ObjectRelations.contactgroup_contacts[subgroup])
+        ObjectRelations._resolve_groups(
+            ObjectRelations.contactgroup_contactgroups,
+            ObjectRelations.contactgroup_subgroups,
+            ObjectRelations.contactgroup_contacts,
+            ObjectRelations.contact_contactgroups,
+        )
 
     @staticmethod
     def resolve_hostgroups():
         """ Update all hostgroup relations to take into account hostgroup.hostgroup_members """
-        groups = list(ObjectRelations.hostgroup_hostgroups.keys())
-        for group in groups:
-            subgroups = ObjectRelations._get_subgroups(group, ObjectRelations.hostgroup_hostgroups)
-            ObjectRelations.hostgroup_subgroups[group] = subgroups
-
-            # Loop through every subgroup and apply its attributes to ours
-            for subgroup in subgroups:
-                for i in ObjectRelations.hostgroup_hosts[subgroup]:
-                    ObjectRelations.host_hostgroups[i].add(group)
-                ObjectRelations.hostgroup_hosts[group].update(ObjectRelations.hostgroup_hosts[subgroup])
+        ObjectRelations._resolve_groups(
+            ObjectRelations.hostgroup_hostgroups,
+            ObjectRelations.hostgroup_subgroups,
+            ObjectRelations.hostgroup_hosts,
+            ObjectRelations.host_hostgroups,
+        )
 
     @staticmethod
     def resolve_servicegroups():
@@ -337,16 +618,75 @@ class ObjectRelations(object):
         # Before we do anything, resolve servicegroup.members into actual services
         ObjectRelations._resolve_servicegroup_members()
 
-        groups = list(ObjectRelations.servicegroup_servicegroups.keys())
-        for group in groups:
-            subgroups = ObjectRelations._get_subgroups(group, ObjectRelations.servicegroup_servicegroups)
-            ObjectRelations.servicegroup_subgroups[group] = subgroups
+        ObjectRelations._resolve_groups(
+            ObjectRelations.servicegroup_servicegroups,
+            ObjectRelations.servicegroup_subgroups,
+            ObjectRelations.servicegroup_services,
+            ObjectRelations.service_servicegroups,
+        )
+
+    @staticmethod
+    def resolve_host_services():
+        """ Update host_effective_services with every service that applies to each host
+
+        Services apply to a host via host_name or hostgroup_name, where '*'
+        means every host. Hosts excluded with !host_name or !hostgroup_name
+        are left out. Run after hostgroups and regular expressions are resolved.
+        """
+        host_services = ObjectRelations.host_services
+        hostgroup_services = ObjectRelations.hostgroup_services
+        hostgroup_hosts = ObjectRelations.hostgroup_hosts
+        excluded = defaultdict(set)
+        for host_name, services in ObjectRelations.excluded_host_services.items():
+            excluded[host_name].update(services)
+        for group, services in ObjectRelations.excluded_hostgroup_services.items():
+            for host_name in hostgroup_hosts.get(group, ()):
+                excluded[host_name].update(services)
+        result = ObjectRelations.host_effective_services
+        result.clear()
+
+        for host_name, groups in ObjectRelations.host_hostgroups.items():
+            services = result[host_name]
+            for group in groups:
+                if group in hostgroup_services:
+                    services.update(hostgroup_services[group])
+        everywhere = set()
+        for host_name, services in host_services.items():
+            if host_name == '*':
+                everywhere.update(services)
+            else:
+                result[host_name].update(services)
+        everywhere.update(hostgroup_services.get('*', ()))
+        if everywhere:
+            for host in ObjectFetcher._cached_object_type['host']:
+                if host.host_name:
+                    result[host.host_name].update(everywhere)
+        for host_name, services in excluded.items():
+            if host_name in result:
+                result[host_name].difference_update(services)
+
+    @staticmethod
+    def _resolve_groups(group_groups, group_subgroups, group_members, member_groups):
+        """ Make members of subgroups members of every group above them
+
+        Args:
+
+            group_groups: dict of group -> groups listed in its *group_members
+
+            group_subgroups: dict where group -> every subgroup, direct or not, is stored
 
-            # Loop through every subgroup and apply its attributes to ours
-            for subgroup in subgroups:
-                for i in ObjectRelations.servicegroup_services[subgroup]:
-                    ObjectRelations.service_servicegroups[i].add(group)
-                ObjectRelations.servicegroup_services[group].update(ObjectRelations.servicegroup_services[subgroup])
+            group_members: dict of group -> members, updated with members of every subgroup
+
+            member_groups: dict of member -> groups, updated the same way
+        """
+        graph = RelationGraph(group_groups)
+        subgroups = graph.closure()
+        members = graph.propagate(group_members)
+        for group in list(group_groups.keys()):
+            group_subgroups[group] = subgroups[group]
+            for i in members[group]:
+                member_groups[i].add(group)
+            group_members[group].update(members[group])
 
     @staticmethod
     def _resolve_servicegroup_members():
@@ -371,12 +711,249 @@ class ObjectRelations(object):
                     pass
 
 
+class RelationGraph(object):
+
+    """ Directed graph of names, e.g. groups and the groups they have as members
+
+    Every name gets an integer id, and edges are kept as lists of ids.
+    closure() and propagate() first condense strongly connected components
+    (groups that are members of each other) with Tarjan's algorithm, and
+    then visit every component once, children before parents.
+
+    Example:
+        >>> graph = RelationGraph({'all': ['linux', 'windows'], 'linux': ['debian']})
+        >>> sorted(graph.closure()['all'])
+        ['debian', 'linux', 'windows']
+        >>> sorted(graph.propagate({'debian': set(['host1']), 'windows': set(['host2'])})['all'])
+        ['host1', 'host2']
+    """
+
+    def __init__(self, edges=None):
+        self.ids = {}  # name -> id
+        self.names = []  # id -> name
+        self.adjacency = []  # id -> list of ids
+        self._condensed = None
+        for source, targets in (edges or {}).items():
+            self.add_node(source)
+            for target in targets:
+                self.add_edge(source, target)
+
+    def add_node(self, name):
+        """ Add name to the graph if it is not there already, and return its id """
+        node = self.ids.get(name)
+        if node is None:
+            node = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.adjacency.append([])
+            self._condensed = None
+        return node
+
+    def add_edge(self, source, target):
+        """ Add an edge from source to target """
+        self.adjacency[self.add_node(source)].append(self.add_node(target))
+        self._condensed = None
+
+    def strongly_connected_components(self):
+        """ Returns a list of components, each a list of ids, children before parents
+
+        Iterative version of Tarjan's algorithm, so deep nesting does not
+        hit the recursion limit.
+        """
+        adjacency = self.adjacency
+        index = [None] * len(adjacency)
+        lowlink = [0] * len(adjacency)
+        on_stack = [False] * len(adjacency)
+        stack = []
+        components = []
+        counter = 0
+        for root in range(len(adjacency)):
+            if index[root] is not None:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, i = work.pop()
+                if i == 0:
+                    index[node] = lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                neighbours = adjacency[node]
+                while i < len(neighbours):
+                    child = neighbours[i]
+                    i += 1
+                    if index[child] is None:
+                        work.append((node, i))
+                        work.append((child, 0))
+                        break
+                    elif on_stack[child]:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = False
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+        return components
+
+    def _condense(self):
+        """ Returns components, children before parents, and a list of child components of every component """
+        if self._condensed is not None:
+            return self._condensed
+        components = self.strongly_connected_components()
+        component_of = [0] * len(self.adjacency)
+        for c, component in enumerate(components):
+            for node in component:
+                component_of[node] = c
+        children = []
+        for c, component in enumerate(components):
+            below = set()
+            for node in component:
+                for child in self.adjacency[node]:
+                    below.add(component_of[child])
+            # A component with a single node only reaches itself if it has an edge to itself
+            if len(component) > 1:
+                below.add(c)
+            children.append(below)
+        self._condensed = components, children
+        return self._condensed
+
+    @staticmethod
+    def _union(sets):
+        """ Returns a new set with the contents of every set in sets
+
+        Nested groups often share most of their members, so start with a copy
+        of the largest set instead of adding every member one by one.
+        """
+        sets = sorted(sets, key=len, reverse=True)
+        if not sets:
+            return set()
+        result = sets[0].copy()
+        for i in sets[1:]:
+            result.update(i)
+        return result
+
+    def closure(self):
+        """ Returns a dict of name -> set of every name that can be reached from it
+
+        A name is only reachable from itself if it is part of a cycle.
+        """
+        return self._propagate(lambda component: set(self.names[node] for node in component), include_self=False)
+
+    def propagate(self, values):
+        """ Returns a dict of name -> union of values of name and every name that can be reached from it
+
+        Args:
+
+            values: dict of name -> set of values
+        """
+        def own_values(component):
+            return self._union([values[self.names[node]] for node in component if self.names[node] in values])
+        return self._propagate(own_values, include_self=True)
+
+    def _propagate(self, own_values, include_self):
+        """ Shared implementation of closure() and propagate()
+
+        Args:
+
+            own_values: function that returns a new set of values for a component
+
+            include_self: if False, the values of a component are only included if it is part of a cycle
+        """
+        components, children = self._condense()
+        reached = []  # component -> result for every node in the component
+        full = []  # component -> own values and values of every component reachable from it
+        for c, component in enumerate(components):
+            below = [full[child] for child in children[c] if child != c]
+            if include_self or c in children[c]:
+                reached.append(self._union(below + [own_values(component)]))
+                full.append(reached[c])
+            else:
+                reached.append(self._union(below))
+                full.append(self._union([reached[c], own_values(component)]))
+        result = {}
+        for c, component in enumerate(components):
+            for i, node in enumerate(component):
+                # Every node gets its own set, so callers can modify them
+                result[self.names[node]] = reached[c] if i == 0 else reached[c].copy()
+        return result
+
+
+class RegexMatcher(object):
+
+    """ Matches regular expressions against a list of names, and remembers the results
+
+    Every pattern is compiled and run against the names only once. When
+    names change, update() only runs the known patterns against the
+    names that were added, so results can be kept between reloads.
+    Patterns that were not matched since the previous update() are
+    forgotten, so patterns removed from the configuration do not pile up.
+
+    Example:
+        >>> matcher = RegexMatcher(['localhost', 'remotehost', 'router'])
+        >>> sorted(matcher.match('.*host'))
+        ['localhost', 'remotehost']
+        >>> matcher.update(['localhost', 'otherhost'])
+        >>> sorted(matcher.match('.*host'))
+        ['localhost', 'otherhost']
+    """
+
+    def __init__(self, names=()):
+        self.names = set()
+        self._matches = {}  # pattern -> set of names
+        self._used = set()  # patterns matched since last update()
+        self.update(names)
+
+    def update(self, names):
+        """ Replace the names that patterns are matched against
+
+        Args:
+
+            names: iterable of names, None entries are ignored
+        """
+        names = set(names)
+        names.discard(None)
+        added = names - self.names
+        removed = self.names - names
+        for pattern in set(self._matches).difference(self._used):
+            del self._matches[pattern]
+        self._used = set()
+        if len(added) == len(names):
+            self._matches = {}
+        elif added or removed:
+            for pattern, matches in self._matches.items():
+                matches -= removed
+                matches.update(filter(re.compile(pattern).search, added))
+        self.names = names
+
+    def match(self, pattern):
+        """ Returns a set of every name where pattern is found
+
+        Nagios allows * on its own as a regex, it matches every name.
+        The returned set must not be modified.
+        """
+        if pattern == '*':
+            return self.names
+        self._used.add(pattern)
+        matches = self._matches.get(pattern)
+        if matches is None:
+            matches = self._matches[pattern] = set(filter(re.compile(pattern).search, self.names))
+        return matches
+
+
+@six.add_metaclass(_ContextType)
 class ObjectFetcher(object):
 
     """
     This class is a wrapper around pynag.Parsers.config. Is responsible for
     fetching dict objects from config.data and turning into high
-    ObjectDefinition objects
+    ObjectDefinition objects. The caches below are kept per ModelContext.
 
     Internal variables:
      * _cached_objects = List of every ObjectDefinition
@@ -384,73 +961,99 @@ class ObjectFetcher(object):
      * _cached_shortnames[o.object_type][o.get_shortname()] = o
      * _cached_names[o.object_type][o.name] = o
      * _cached_object_type[o.object_type].append( o )
+     * _cached_indexes[(o.object_type, kind, attribute)] = (objects, len(objects), index), used by filter()
     """
     _cached_objects = []
     _cached_ids = {}
     _cached_shortnames = defaultdict(dict)
     _cached_names = defaultdict(dict)
     _cached_object_type = defaultdict(list)
+    _cached_indexes = {}
     _cache_only = False
 
+    # Search suffixes that filter() can not answer from an index, from cheapest to most expensive
+    _scan_suffixes = (
+        '__exists', '__isnot', '__notin', '__endswith', '__notendswith', '__notstartswith',
+        '__contains', '__notcontains', '__regex',
+    )
+
     def __init__(self, object_type):
         self.object_type = object_type
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
     def get_all(self, cache_only=False):
         """ Return all object definitions of specified type"""
         if not cache_only and self.needs_reload():
             self.reload_cache()
-        if self.object_type is not None:
-            return ObjectFetcher._cached_object_type[self.object_type]
-        else:
-            return ObjectFetcher._cached_objects
+        with pynag.Utils.shared_lock(get_context().lock):
+            if self.object_type is not None:
+                return ObjectFetcher._cached_object_type[self.object_type]
+            else:
+                return ObjectFetcher._cached_objects
 
     all = property(get_all)
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @pynag.Utils.synchronized(_context_lock)
     def reload_cache(self):
-        """Reload configuration cache"""
-        # clear object list
-        ObjectFetcher._cached_objects = []
-        ObjectFetcher._cached_ids = {}
-        ObjectFetcher._cached_shortnames = defaultdict(dict)
-        ObjectFetcher._cached_names = defaultdict(dict)
-        ObjectFetcher._cached_object_type = defaultdict(list)
-        global config
-        # If global variable cfg_file has been changed, lets create a new ConfigParser object
-        if config is None or config.cfg_file != cfg_file:
-            config = pynag.Parsers.config_parser.Config(cfg_file)
+        """Reload configuration cache
+
+        Objects are only created for items in config.data that are new
+        since last reload. Unchanged items (config parses incrementally, so
+        items from files that did not change stay the same) keep their
+        ObjectDefinition and the relations it had to other objects.
+        """
+        # If cfg_file has been changed, get_config() creates a new ConfigParser object
+        config = get_context().get_config()
         if config.needs_reparse():
             config.parse()
 
-        # Reset our list of how objects are related to each other
-        ObjectRelations.reset()
+        # Objects from last reload that can be reused, by the item they were created from
+        previous_objects = {}
+        for i in ObjectFetcher._cached_objects:
+            if not i._changes and i._relations is not None:
+                previous_objects[id(i._original_attributes)] = i
+
+        # clear object list
+        ObjectFetcher._cached_objects = cached_objects = []
+        ObjectFetcher._cached_ids = cached_ids = {}
+        ObjectFetcher._cached_shortnames = cached_shortnames = defaultdict(dict)
+        ObjectFetcher._cached_names = cached_names = defaultdict(dict)
+        ObjectFetcher._cached_object_type = cached_object_type = defaultdict(list)
+        ObjectFetcher._cached_indexes = {}
 
         # Fetch all objects from config_parser.config
         for object_type, objects in config.data.items():
             # change "all_host" to just "host"
             object_type = object_type[len("all_"):]
             Class = string_to_class.get(object_type, ObjectDefinition)
-            for i in objects:
-                i = Class(item=i)
-                ObjectFetcher._cached_objects.append(i)
-                ObjectFetcher._cached_object_type[object_type].append(i)
-                ObjectFetcher._cached_ids[i.get_id()] = i
-                ObjectFetcher._cached_shortnames[i.object_type][i.get_shortname()] = i
+            for item in objects:
+                i = previous_objects.get(id(item))
+                if i is None or i._original_attributes is not item:
+                    i = Class(item=item)
+                    i._relations = ObjectRelations.collect(i)
+                cached_objects.append(i)
+                cached_object_type[object_type].append(i)
+                cached_ids[i.get_id()] = i
+                cached_shortnames[i.object_type][i.get_shortname()] = i
                 if i.name is not None:
-                    ObjectFetcher._cached_names[i.object_type][i.name] = i
-                i._do_relations()
+                    cached_names[i.object_type][i.name] = i
+
+        # Rebuild our list of how objects are related to each other. Groups
+        # and regular expressions depend on every object, so they are resolved again.
+        ObjectRelations.reset()
+        ObjectRelations.replay(itertools.chain.from_iterable(i._relations for i in cached_objects))
         ObjectRelations.resolve_contactgroups()
         ObjectRelations.resolve_hostgroups()
         ObjectRelations.resolve_servicegroups()
         ObjectRelations.resolve_regex()
+        ObjectRelations.resolve_host_services()
         return True
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @pynag.Utils.synchronized(_context_lock, shared=True)
     def needs_reload(self):
         """ Returns true if configuration files need to be reloaded/reparsed """
         if not ObjectFetcher._cached_objects:
             return True
+        config = get_context().config
         if config is None:
             return True
         if self._cache_only:
@@ -467,7 +1070,8 @@ class ObjectFetcher(object):
         if not cache_only and self.needs_reload():
             self.reload_cache()
         str_id = str(id).strip()
-        return ObjectFetcher._cached_ids[str_id]
+        with pynag.Utils.shared_lock(get_context().lock):
+            return ObjectFetcher._cached_ids[str_id]
 
     def get_by_shortname(self, shortname, cache_only=False):
         """ Get one specific object by its shortname (i.e. host_name for host, etc)
@@ -482,7 +1086,8 @@ class ObjectFetcher(object):
         if cache_only is False and self.needs_reload():
             self.reload_cache()
         shortname = str(shortname).strip()
-        return ObjectFetcher._cached_shortnames[self.object_type][shortname]
+        with pynag.Utils.shared_lock(get_context().lock):
+            return ObjectFetcher._cached_shortnames[self.object_type][shortname]
 
     def get_by_name(self, object_name, cache_only=False):
         """ Get one specific object by its object_name (i.e. name attribute)
@@ -493,12 +1098,15 @@ class ObjectFetcher(object):
         if not cache_only and self.needs_reload():
             self.reload_cache()
         object_name = str(object_name).strip()
-        return ObjectFetcher._cached_names[self.object_type][object_name]
+        with pynag.Utils.shared_lock(get_context().lock):
+            return ObjectFetcher._cached_names[self.object_type][object_name]
 
     def get_object_types(self):
         """ Returns a list of all discovered object types """
+        config = get_context().config
         if config is None or config.needs_reparse():
             self.reload_cache()
+            config = get_context().config
         return config.get_object_types()
 
     def filter(self, **kwargs):
@@ -535,8 +1143,319 @@ class ObjectFetcher(object):
         Get all hosts that have an address:
          >>> Host.objects.filter(address_exists=True) # doctest: +SKIP
 
+        Returns a list of matching objects. Use :py:meth:`query` for a
+        :py:class:`QuerySet` that is only searched as far as it is used.
+
+        Exact matches, __in, __has_field and __startswith are looked up in
+        indexes that are built the first time an attribute is searched.
+        Other searches only look at objects that matched the indexed ones.
         """
-        return pynag.Utils.grep(self.all, **kwargs)
+        return self.query(**kwargs)._get_results()
+
+    def query(self, **kwargs):
+        """ Returns a :py:class:`QuerySet` of objects that match **kwargs
+
+        Takes the same arguments as :py:meth:`filter`, but nothing is
+        searched until the QuerySet is used.
+
+        Get the first service of a host that is not a template
+         >>> Service.objects.query(host_name='localhost').exclude(register='0').first() # doctest: +SKIP
+        """
+        return QuerySet(self).filter(**kwargs)
+
+    def _search(self, search):
+        """ Plan how to find objects that match a list of (key, value) searches
+
+        Args:
+
+            search: list of (key, value) as returned by pynag.Utils.grep_search_terms()
+
+        Returns:
+
+            (candidates, scans). candidates is a list of objects that match
+            every search that could be looked up in an index, and scans is a
+            list of (key, value) searches that candidates still have to be
+            checked against, cheapest first.
+        """
+        objects = self.all
+
+        # Use the most selective index first, and scan only what it found
+        matches = []
+        scans = []
+        with pynag.Utils.shared_lock(get_context().lock):
+            for k, v in search:
+                positions = self._lookup_index(objects, k, v)
+                if positions is None:
+                    scans.append((k, v))
+                else:
+                    matches.append(positions)
+        if matches:
+            matches.sort(key=len)
+            positions = matches[0]
+            for other in matches[1:]:
+                other = set(other)
+                positions = [x for x in positions if x in other]
+            result = [objects[x] for x in positions]
+        else:
+            result = objects
+
+        scans.sort(key=self._get_scan_cost)
+        return result, scans
+
+    def _get_scan_cost(self, search):
+        """ Sort key for (key, value) searches that filter() has to scan for """
+        k, v = search
+        for i, suffix in enumerate(self._scan_suffixes):
+            if k.endswith(suffix):
+                return i + 1
+        if k in ('search', 'q'):
+            return len(self._scan_suffixes) + 1
+        return 0
+
+    def _lookup_index(self, objects, k, v):
+        """ Find objects matching a filter() search by looking it up in an index
+
+        Args:
+
+            objects: List of objects that filter() searches
+
+            k: Search key, e.g. 'host_name' or 'host_name__startswith'
+
+            v: Search value
+
+        Returns:
+
+            Sorted list of positions in objects that match, or None if the
+            search can not be answered from an index.
+        """
+        if k in ('search', 'q') or (k == 'register' and str(v) == '1'):
+            return None
+        for suffix in self._scan_suffixes:
+            if k.endswith(suffix):
+                return None
+        if k.endswith('__in'):
+            if not isinstance(v, (list, tuple, set, frozenset)):
+                return None
+            by_str, by_element = self._get_index(objects, 'exact', k[:-len('__in')])
+            positions = set()
+            for i in v:
+                if isinstance(i, six.string_types):
+                    positions.update(by_str.get(i, []))
+            return sorted(positions)
+        if k.endswith('__has_field'):
+            index = self._get_index(objects, 'has_field', k[:-len('__has_field')])
+            return index.get(str(v), [])
+        if k.endswith('__startswith'):
+            keys, key_positions = self._get_index(objects, 'sorted', k[:-len('__startswith')])
+            prefix = str(v)
+            start = bisect.bisect_left(keys, prefix)
+            end = start
+            while end < len(keys) and keys[end].startswith(prefix):
+                end += 1
+            return sorted(key_positions[start:end])
+
+        # Exact match, just like pynag.Utils.grep() does it
+        by_str, by_element = self._get_index(objects, 'exact', k)
+        positions = by_str.get(str(v), [])
+        if isinstance(v, str) and v in by_element:
+            positions = sorted(set(positions).union(by_element[v]))
+        return positions
+
+    def _get_index(self, objects, kind, attribute):
+        """ Returns an index of attribute for every object in objects
+
+        Indexes are kept in ObjectFetcher._cached_indexes until the cache is
+        reloaded or an object is changed.
+
+        Args:
+
+            objects: List of objects to index
+
+            kind: 'exact' for (str(value) -> positions, list element -> positions),
+            'has_field' for (field in value -> positions) or 'sorted' for
+            (sorted list of str(value), positions in the same order)
+
+            attribute: Name of the attribute to index, e.g. 'host_name'
+        """
+        key = (self.object_type, kind, attribute)
+        cached = ObjectFetcher._cached_indexes.get(key)
+        if cached is not None and cached[0] is objects and cached[1] == len(objects):
+            return cached[2]
+
+        if kind == 'exact':
+            by_str = defaultdict(list)
+            by_element = defaultdict(list)
+            for position, obj in enumerate(objects):
+                value = obj.get(attribute)
+                by_str[str(value)].append(position)
+                if isinstance(value, list):
+                    for i in set(i for i in value if isinstance(i, str)):
+                        by_element[i].append(position)
+            index = (dict(by_str), dict(by_element))
+        elif kind == 'has_field':
+            index = defaultdict(list)
+            for position, obj in enumerate(objects):
+                fields = pynag.Utils.AttributeList(obj.get(attribute)).fields
+                for field in sorted(set(fields)):
+                    index[field].append(position)
+            index = dict(index)
+        else:
+            pairs = sorted((str(obj.get(attribute)), position) for position, obj in enumerate(objects))
+            index = ([k for k, position in pairs], [position for k, position in pairs])
+        ObjectFetcher._cached_indexes[key] = (objects, len(objects), index)
+        return index
+
+
+class QuerySet(object):
+
+    """
+    Lazy list of objects, as returned by ObjectFetcher.query()
+
+    Nothing is searched until the QuerySet is used. Iterating over it, len()
+    and indexing work like they do on a list, and the result is kept for
+    next time. first(), exists(), count() and slicing stop searching as soon
+    as they know the answer, without making a list of every match.
+    list(queryset) gives the same list as ObjectFetcher.filter() does.
+
+    Example:
+         >>> services = Service.objects.query(host_name='localhost') # doctest: +SKIP
+         >>> services.exclude(register='0').count() # doctest: +SKIP
+    """
+
+    def __init__(self, fetcher, search=None, excludes=None):
+        self._fetcher = fetcher
+        self._search = search or []
+        self._excludes = excludes or []
+        self._result_cache = None
+
+    def filter(self, **kwargs):
+        """ Returns a new QuerySet with only objects that also match **kwargs
+
+        See :py:meth:`ObjectFetcher.filter` for search syntax.
+        """
+        search = self._search + pynag.Utils.grep_search_terms(**kwargs)
+        return QuerySet(self._fetcher, search, self._excludes)
+
+    def exclude(self, **kwargs):
+        """ Returns a new QuerySet without objects that match every one of **kwargs
+
+        See :py:meth:`ObjectFetcher.filter` for search syntax.
+        """
+        exclude = [pynag.Utils.grep_expression(k, v) for k, v in pynag.Utils.grep_search_terms(**kwargs)]
+        excludes = self._excludes
+        if exclude:
+            excludes = excludes + [exclude]
+        return QuerySet(self._fetcher, self._search, excludes)
+
+    def iterator(self):
+        """ Yields matching objects one by one, without keeping the result """
+        if self._result_cache is not None:
+            for obj in self._result_cache:
+                yield obj
+            return
+        candidates, scans = self._fetcher._search(self._search)
+        expressions = [pynag.Utils.grep_expression(k, v) for k, v in scans]
+        for obj in candidates:
+            if not all(expression(obj) for expression in expressions):
+                continue
+            if any(all(expression(obj) for expression in exclude) for exclude in self._excludes):
+                continue
+            yield obj
+
+    def _get_results(self):
+        """ Returns a list of every matching object """
+        if self._result_cache is None:
+            if self._excludes:
+                self._result_cache = list(self.iterator())
+            else:
+                candidates, scans = self._fetcher._search(self._search)
+                result = list(candidates)
+                for k, v in scans:
+                    result = list(filter(pynag.Utils.grep_expression(k, v), result))
+                self._result_cache = result
+        return self._result_cache
+
+    def count(self):
+        """ Returns the number of matching objects """
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return sum(1 for obj in self.iterator())
+
+    def first(self):
+        """ Returns the first matching object, or None if nothing matches """
+        for obj in self.iterator():
+            return obj
+        return None
+
+    def exists(self):
+        """ Returns True if any object matches """
+        return self.first() is not None
+
+    def __iter__(self):
+        return iter(self._get_results())
+
+    def __len__(self):
+        return len(self._get_results())
+
+    def __bool__(self):
+        return self.exists()
+
+    __nonzero__ = __bool__
+
+    def __getitem__(self, key):
+        if self._result_cache is not None:
+            return self._result_cache[key]
+        if isinstance(key, slice):
+            if (key.start or 0) < 0 or (key.stop is not None and key.stop < 0) or (key.step or 1) < 0:
+                return self._get_results()[key]
+            return list(itertools.islice(self.iterator(), key.start, key.stop, key.step))
+        if key < 0:
+            return self._get_results()[key]
+        for obj in itertools.islice(self.iterator(), key, None):
+            return obj
+        raise IndexError("QuerySet index out of range")
+
+    def __contains__(self, item):
+        return item in self._get_results()
+
+    def __eq__(self, other):
+        if isinstance(other, (QuerySet, list)):
+            return self._get_results() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return self._get_results() + list(other)
+
+    def __radd__(self, other):
+        return list(other) + self._get_results()
+
+    def __repr__(self):
+        return repr(self._get_results())
+
+
+class _ObjectType(object):
+
+    """ ObjectDefinition.object_type, for object types that have no class of their own
+
+    Returns None when looked up on the class, and the object_type of the
+    item an object was created from when looked up on an instance.
+    """
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return None
+        try:
+            return instance._meta['object_type']
+        except AttributeError:
+            return None
 
 
 class ObjectDefinition(object):
@@ -548,7 +1467,7 @@ class ObjectDefinition(object):
          >>> objects = ObjectDefinition.objects.all
          >>> my_object = ObjectDefinition( dict ) # doctest: +SKIP
     """
-    object_type = None
+    object_type = _ObjectType()
     objects = ObjectFetcher(None)
 
     def __init__(self, item=None, filename=None, **kwargs):
@@ -560,14 +1479,11 @@ class ObjectDefinition(object):
 
         # if item is empty, we are creating a new object
         if item is None:
-            item = config.get_new_item(object_type=self.object_type, filename=filename)
+            item = get_context().config.get_new_item(object_type=self.object_type, filename=filename)
             self.is_new = True
         else:
             self.is_new = False
 
-        # store the object_type (i.e. host,service,command, etc)
-        self.object_type = item['meta']['object_type']
-
         # self.data -- This dict stores all effective attributes of this objects
         self._original_attributes = item
 
@@ -583,11 +1499,15 @@ class ObjectDefinition(object):
         #: _meta - Various metadata about the object
         self._meta = item['meta']
 
-        #: _macros - A dict object that resolves any particular Nagios Macro (i.e. $HOSTADDR$)
-        self._macros = {}
+        #: _relations - What _do_relations() added to ObjectRelations, see ObjectRelations.collect()
+        self._relations = None
+
+        #: _attributes - Effective attributes (inherited, defined and changed), see _get_attributes()
+        self._attributes = None
+        self._attribute_keys = None
 
-        #: __argument_macros - A dict object that resolves $ARG* macros
-        self.__argument_macros = {}
+        #: _macros - Macros resolved from attributes of this object, see _get_cached_macro()
+        self._macros = None
 
         # Any kwargs provided will be added to changes:
         for k, v in kwargs.items():
@@ -659,74 +1579,82 @@ class ObjectDefinition(object):
             self.set_macro(key, item)
         elif self[key] != item:
             self._changes[key] = item
+            self._attributes = None
+            ObjectFetcher._cached_indexes = {}
             self._event(level="debug", message="attribute changed: %s = %s" % (key, item))
 
     def __getitem__(self, key):
-        if key == 'id':
-            return self.get_id()
-        elif key == 'description':
-            return self.get_description()
-        elif key == 'shortname':
-            return self.get_shortname()
-        elif key == 'effective_command_line':
-            return self.get_effective_command_line()
-        elif key == 'register' and key not in self:
-            return "1"
-        elif key == 'meta':
-            return self._meta
-        elif key in self._changes:
-            return self._changes[key]
-        elif key in self._defined_attributes:
-            return self._defined_attributes[key]
-        elif key in self._inherited_attributes:
-            return self._inherited_attributes[key]
+        if key in _COMPUTED_ATTRIBUTES:
+            return _COMPUTED_ATTRIBUTES[key](self)
+        attributes = self._attributes
+        if attributes is None:
+            attributes = self._get_attributes()
+        if key in attributes:
+            return attributes[key]
         elif key in self._meta:
             return self._meta[key]
+        elif key == 'register':
+            return "1"
         else:
             return None
 
     def __contains__(self, item):
         """ Returns true if item is in ObjectDefinition """
-        if item in list(self.keys()):
-            return True
-        if item in list(self._meta.keys()):
-            return True
-        return False
+        attributes = self._attributes
+        if attributes is None:
+            attributes = self._get_attributes()
+        return item in attributes or item in self._meta or item in _BUILTIN_KEYS
 
     def has_key(self, key):
         """ Same as key in self """
         return key in self
 
     def keys(self):
-        all_keys = ['meta', 'id', 'shortname', 'effective_command_line']
-        for k in self._changes.keys():
-            if k not in all_keys:
-                all_keys.append(k)
-        for k in self._defined_attributes.keys():
-            if k not in all_keys:
-                all_keys.append(k)
-        for k in self._inherited_attributes.keys():
-            if k not in all_keys:
-                all_keys.append(k)
-            # for k in self._meta.keys():
-        #    if k not in all_keys: all_keys.append(k)
-        return all_keys
+        if self._attributes is None:
+            self._get_attributes()
+        return list(self._attribute_keys)
+
+    def _get_attributes(self):
+        """ Returns a dict with the effective attributes of this object
+
+        The dict merges inherited, defined and changed attributes, and is
+        kept until one of them changes, so looking up attributes does not
+        have to search three dicts every time. Anything that modifies
+        _changes, _defined_attributes or _inherited_attributes must set
+        self._attributes to None.
+        """
+        attributes = dict(self._inherited_attributes)
+        attributes.update(self._defined_attributes)
+        attributes.update(self._changes)
+        # keys() lists changed attributes first, then defined, then inherited ones
+        keys = list(_BUILTIN_KEYS)
+        seen = set(keys)
+        for dictionary in (self._changes, self._defined_attributes, self._inherited_attributes):
+            for k in dictionary:
+                if k not in seen:
+                    seen.add(k)
+                    keys.append(k)
+        self._attribute_keys = keys
+        self._attributes = attributes
+        return attributes
 
     def items(self):
         return [(x, self[x]) for x in list(self.keys())]
 
     def get_id(self):
-        """ Return a unique ID for this object"""
-        #object_type = self['object_type']
-        #shortname = self.get_description()
-        #object_name = self['name']
+        """ Return a unique ID for this object
+
+        The ID is a sha1 digest of filename and defined attributes, so it is
+        the same every time the same configuration is parsed, even in
+        another process.
+        """
         if not self.__object_id__:
             filename = self._original_attributes['meta']['filename']
-
-            object_id = (filename, sorted(frozenset(list(self._defined_attributes.items()))))
-            object_id = str(object_id)
-
-            self.__object_id__ = str(hash(object_id))
+            attributes = sorted(self._defined_attributes.items())
+            object_id = '%s\0%s' % (filename, '\0'.join('%s\0%s' % (k, v) for k, v in attributes))
+            if isinstance(object_id, six.text_type):
+                object_id = object_id.encode('utf-8')
+            self.__object_id__ = hashlib.sha1(object_id).hexdigest()
 
             # this is good when troubleshooting ID issues:
             # definition = self._original_attributes['meta']['raw_definition']
@@ -747,10 +1675,11 @@ class ObjectDefinition(object):
         description = re.sub(invalid_chars, '', self.get_description())
 
         # if pynag_directory is undefined, use "/pynag" dir under nagios.cfg
+        pynag_directory = get_context().pynag_directory
         if pynag_directory:
             destination_directory = pynag_directory
         else:
-            main_config = config.cfg_file or paths.find_main_configuration_file()
+            main_config = get_context().config.cfg_file or paths.find_main_configuration_file()
             main_config = os.path.abspath(main_config)
             destination_directory = os.path.dirname(main_config)
 
@@ -777,7 +1706,7 @@ class ObjectDefinition(object):
 
         return path
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @pynag.Utils.synchronized(_context_lock)
     def save(self, filename=None):
         """Saves any changes to the current object to its configuration file
 
@@ -802,6 +1731,7 @@ class ObjectDefinition(object):
         self.set_filename(filename)
 
         # If this is a new object, we save it with config.item_add()
+        config = get_context().config
         if self.is_new is True or self._filename_has_changed:
             for k in list(self._changes.keys()):
                 v = self._changes.get(k, None)
@@ -809,6 +1739,7 @@ class ObjectDefinition(object):
                     self._defined_attributes[k] = v
                     self._original_attributes[k] = v
                 del self._changes[k]
+                self._attributes = None
             self.is_new = False
             self._filename_has_changed = False
             self._event(level='write', message="Added new %s: %s" % (self.object_type, self.get_description()))
@@ -826,6 +1757,7 @@ class ObjectDefinition(object):
                 )
                 if save_result is True:
                     del self._changes[field_name]
+                    self._attributes = None
                     self._event(level='write',
                                 message="%s changed from '%s' to '%s'" % (field_name, self[field_name], new_value))
                     # Setting new_value to None, is a signal to remove the attribute
@@ -836,6 +1768,7 @@ class ObjectDefinition(object):
                     else:
                         self._defined_attributes[field_name] = new_value
                         self._original_attributes[field_name] = new_value
+                    self._attributes = None
                     number_of_changes += 1
                 else:
                     raise Exception(
@@ -848,8 +1781,14 @@ class ObjectDefinition(object):
 
     def reload_object(self):
         """ Re-applies templates to this object (handy when you have changed the use attribute """
+        ObjectFetcher._cached_indexes = {}
+        config = get_context().config
         old_me = config.get_new_item(self.object_type, self.get_filename())
         old_me['meta']['defined_attributes'] = self._defined_attributes
+        # Keep line numbers, so that config does not have to search for us next time we are saved
+        for k in ('line_start', 'line_end'):
+            if k in self._meta:
+                old_me['meta'][k] = self._meta[k]
         for k, v in self._defined_attributes.items():
             old_me[k] = v
         for k, v in self._changes.items():
@@ -860,9 +1799,10 @@ class ObjectDefinition(object):
         self._original_attributes = new_me._original_attributes
         self._inherited_attributes = new_me._inherited_attributes
         self._meta = new_me._meta
+        self._attributes = None
         self.__object_id__ = None
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @pynag.Utils.synchronized(_context_lock)
     def rewrite(self, str_new_definition=None):
         """Rewrites this Object Definition in its configuration files.
 
@@ -877,6 +1817,7 @@ class ObjectDefinition(object):
             self.save()
         if str_new_definition is None:
             str_new_definition = str(self)
+        config = get_context().config
         config.item_rewrite(self._original_attributes, str_new_definition)
         self['meta']['raw_definition'] = str_new_definition
         self._event(level='write', message="Object definition rewritten")
@@ -886,6 +1827,7 @@ class ObjectDefinition(object):
         if new_me:
             new_me = new_me[0]
         self._defined_attributes = new_me['meta']['defined_attributes']
+        self._attributes = None
         self.reload_object()
 
         self._event(level='save', message="Object definition was rewritten")
@@ -906,7 +1848,7 @@ class ObjectDefinition(object):
         if recursive is True:
             # Recursive does not have any meaning for a generic object, this should subclassed.
             pass
-        result = config.item_remove(self._original_attributes)
+        result = get_context().config.item_remove(self._original_attributes)
         self._event(level="write", message="%s '%s' was deleted." % (self.object_type, self.get_shortname()))
         self._event(level="save", message="%s '%s' was deleted." % (self.object_type, self.get_shortname()))
         return result
@@ -1095,13 +2037,16 @@ class ObjectDefinition(object):
         # custom variable attribute names are all prefixed
         variable_name = _CUSTOM_VARIABLE_PREFIX + variable_name
 
-        for attribute_name in self.keys():
+        attributes = self._attributes
+        if attributes is None:
+            attributes = self._get_attributes()
+        for attribute_name in attributes:
             if attribute_name.upper() == variable_name:
                 return self.get(attribute_name)
         else:
             return _UNRESOLVED_MACRO
 
-    def get_macro(self, macroname, host_name=None, contact_name=None):
+    def get_macro(self, macroname, host_name=None, contact_name=None, cache_only=False):
         """ Take macroname (e.g. $USER1$) and return its actual value
 
         Arguments:
@@ -1109,6 +2054,8 @@ class ObjectDefinition(object):
           host_name -- Optionally specify host (use this for services that
                     -- don't define host specifically for example ones that only
                     -- define hostgroups
+          cache_only -- Look up related objects without checking if
+                     -- configuration needs to be reloaded
         Returns:
           (str) Actual value of the macro. For example "$HOSTADDRESS$" becomes "127.0.0.1"
         """
@@ -1116,18 +2063,35 @@ class ObjectDefinition(object):
             return _UNRESOLVED_MACRO
         if macroname.startswith('$ARG'):
             # Command macros handled in a special function
-            return self._get_command_macro(macroname, host_name=host_name)
+            return self._get_command_macro(macroname, host_name=host_name, cache_only=cache_only)
         if macroname.startswith('$USER'):
             # $USERx$ macros are supposed to be private, but we will display them anyway
-            return config.get_resource(macroname)
+            return get_context().config.get_resource(macroname)
         if macroname.startswith('$HOST') or macroname.startswith('$_HOST'):
-            return self._get_host_macro(macroname, host_name=host_name)
+            return self._get_host_macro(macroname, host_name=host_name, cache_only=cache_only)
         if macroname.startswith('$SERVICE') or macroname.startswith('$_SERVICE'):
             return self._get_service_macro(macroname)
         if macroname.startswith('$CONTACT') or macroname.startswith('$_CONTACT'):
-            return self._get_contact_macro(macroname, contact_name=contact_name)
+            return self._get_contact_macro(macroname, contact_name=contact_name, cache_only=cache_only)
         return _UNRESOLVED_MACRO
 
+    def _get_cached_macro(self, macroname, resolve):
+        """ Returns resolve(macroname), remembered until attributes of this object change
+
+        Only for macros that depend on nothing but the attributes of this object.
+        """
+        attributes = self._attributes
+        if attributes is None:
+            attributes = self._get_attributes()
+        macros = self._macros
+        if macros is None or macros[0] is not attributes:
+            macros = self._macros = (attributes, {})
+        table = macros[1]
+        if macroname in table:
+            return table[macroname]
+        value = table[macroname] = resolve(macroname)
+        return value
+
     def set_macro(self, macroname, new_value):
         """ Update a macro (custom variable) like $ARG1$ intelligently
 
@@ -1184,8 +2148,7 @@ class ObjectDefinition(object):
         c = self._split_check_command_and_arguments(c)
         command_name = c.pop(0)
         command = Command.objects.get_by_shortname(command_name)
-        regex = re.compile("(\$\w+\$)")
-        macronames = regex.findall(command['command_line'])
+        macronames = _MACRO_REGEX.findall(command['command_line'])
 
         # Add all custom macros to our list:
         for i in self.keys():
@@ -1217,7 +2180,7 @@ class ObjectDefinition(object):
             command = Command.objects.get_by_shortname(command_name, cache_only=True)
         except ValueError:
             return None
-        return self._resolve_macros(command.command_line, host_name=host_name)
+        return self._resolve_macros(command.command_line, host_name=host_name, cache_only=True)
 
     def get_effective_notification_command_line(self, host_name=None, contact_name=None):
         """Get this objects notifications with all macros (i.e. $HOSTADDR$) resolved
@@ -1247,11 +2210,12 @@ class ObjectDefinition(object):
             return None
         return self._resolve_macros(command.command_line, host_name=host_name)
 
-    def _resolve_macros(self, string, host_name=None):
+    def _resolve_macros(self, string, host_name=None, cache_only=False):
         """Resolves every $NAGIOSMACRO$ within the string
 
         :param string:    Arbitary string that contains macros
         :param host_name: Optionally supply host_name if this service does not define it
+        :param cache_only: Look up related objects without checking if configuration needs to be reloaded
 
         :returns: string with every $NAGIOSMACRO$ resolved to actual value
 
@@ -1263,10 +2227,14 @@ class ObjectDefinition(object):
         """
         if not string:
             return _UNRESOLVED_MACRO
-        regex = re.compile("(\$\w+\$)")
-        get_macro = lambda x: self.get_macro(x.group(), host_name=host_name)
-        result = regex.sub(get_macro, string)
-        return result
+        tokens = _split_macros(string)
+        if len(tokens) == 1:
+            return string
+        result = list(tokens)
+        for i in range(1, len(tokens), 2):
+            value = self.get_macro(tokens[i], host_name=host_name, cache_only=cache_only)
+            result[i] = _UNRESOLVED_MACRO if value is None else value
+        return ''.join(result)
 
     def run_check_command(self, host_name=None):
         """Run the check_command defined by this service. Returns return_code,stdout,stderr"""
@@ -1299,10 +2267,21 @@ class ObjectDefinition(object):
         result = [x.replace('ESCAPE_EXCL_MARK', '\!') for x in tmp]
         return result
 
-    def _get_command_macro(self, macroname, check_command=None, host_name=None):
+    def _get_command_macro(self, macroname, check_command=None, host_name=None, cache_only=False):
         """Resolve any command argument ($ARG1$) macros from check_command"""
         if not pynag.Utils.is_macro(macroname):
             return _UNRESOLVED_MACRO
+        if check_command is None:
+            # Arguments of our own check_command only change with our attributes
+            result = self._get_cached_macro(macroname, self._resolve_command_macro)
+        else:
+            result = self._resolve_command_macro(macroname, check_command)
+        # Our $ARGx$ might contain macros on its own, so lets resolve macros in it:
+        result = self._resolve_macros(result, host_name=host_name, cache_only=cache_only)
+        return result
+
+    def _resolve_command_macro(self, macroname, check_command=None):
+        """ Returns the $ARGx$ argument in check_command, without resolving macros in it """
         if check_command is None:
             check_command = self.check_command
         if check_command is None:
@@ -1313,14 +2292,14 @@ class ObjectDefinition(object):
         for i, v in enumerate(c):
             name = '$ARG%s$' % str(i + 1)
             all_args[name] = v
-        result = all_args.get(macroname, _UNRESOLVED_MACRO)
-        # Our $ARGx$ might contain macros on its own, so lets resolve macros in it:
-        result = self._resolve_macros(result, host_name=host_name)
-        return result
+        return all_args.get(macroname, _UNRESOLVED_MACRO)
 
     def _get_service_macro(self, macroname):
         if not pynag.Utils.is_macro(macroname):
             return _UNRESOLVED_MACRO
+        return self._get_cached_macro(macroname, self._resolve_service_macro)
+
+    def _resolve_service_macro(self, macroname):
         if macroname.startswith('$_SERVICE'):
             return self._get_custom_variable_macro(macroname)
         elif macroname in macros.STANDARD_SERVICE_MACROS:
@@ -1331,15 +2310,18 @@ class ObjectDefinition(object):
             return self.get(name, _UNRESOLVED_MACRO)
         return _UNRESOLVED_MACRO
 
-    def _get_host_macro(self, macroname, host_name=None):
+    def _get_host_macro(self, macroname, host_name=None, cache_only=False):
         if not pynag.Utils.is_macro(macroname):
             return _UNRESOLVED_MACRO
+        return self._get_cached_macro(macroname, self._resolve_host_macro)
+
+    def _resolve_host_macro(self, macroname):
         if macroname.startswith('$_HOST'):
             return self._get_custom_variable_macro(macroname)
         elif macroname == '$HOSTADDRESS$' and not self.address:
-            return self._get_host_macro('$HOSTNAME$')
+            return self._resolve_host_macro('$HOSTNAME$')
         elif macroname == '$HOSTDISPLAYNAME$' and not self.display_name:
-            return self._get_host_macro('$HOSTNAME$')
+            return self._resolve_host_macro('$HOSTNAME$')
         elif macroname in macros.STANDARD_HOST_MACROS:
             attr = macros.STANDARD_HOST_MACROS[macroname]
             return self.get(attr, _UNRESOLVED_MACRO)
@@ -1348,7 +2330,7 @@ class ObjectDefinition(object):
             return self.get(name, _UNRESOLVED_MACRO)
         return _UNRESOLVED_MACRO
 
-    def _get_contact_macro(self, macroname, contact_name=None):
+    def _get_contact_macro(self, macroname, contact_name=None, cache_only=False):
         if not pynag.Utils.is_macro(macroname):
             return _UNRESOLVED_MACRO
         # If contact_name is not specified, get first effective contact and resolve macro for that contact
@@ -1358,7 +2340,7 @@ class ObjectDefinition(object):
                 return _UNRESOLVED_MACRO
             contact = contacts[0]
         else:
-            contact = Contact.objects.get_by_shortname(contact_name)
+            contact = Contact.objects.get_by_shortname(contact_name, cache_only=cache_only)
         return contact._get_contact_macro(macroname)
 
     def get_effective_children(self, recursive=False):
@@ -1525,7 +2507,7 @@ class ObjectDefinition(object):
 
     def _event(self, level=None, message=None):
         """ Pass informational message about something that has happened within the Model """
-        for i in eventhandlers:
+        for i in get_context().eventhandlers:
             if level == 'write':
                 i.write(object_definition=self, message=message)
             elif level == 'save':
@@ -1562,7 +2544,7 @@ class Host(ObjectDefinition):
                                                        author=author,
                                                        comment=comment,
                                                        timestamp=timestamp,
-                                                       command_file=config.get_cfg_value('command_file')
+                                                       command_file=get_context().config.get_cfg_value('command_file')
                                                        )
 
     def downtime(self, start_time=None, end_time=None, trigger_id=0, duration=7200, author=None,
@@ -1613,14 +2595,12 @@ class Host(ObjectDefinition):
             pynag.Control.Command.schedule_host_downtime(**arguments)
 
     def get_effective_services(self):
-        """ Returns a list of all Service that belong to this Host """
-        get_object = lambda x: Service.objects.get_by_id(x, cache_only=True)
-        list_of_shortnames = sorted(ObjectRelations.host_services[self.host_name])
-        services = list(map(get_object, list_of_shortnames))
-        # Look for services that define hostgroup_name that we belong to
-        for hg in self.get_effective_hostgroups():
-            services += hg.get_effective_services()
-        return services
+        """ Returns a list of all Service that belong to this Host, directly or via hostgroups """
+        list_of_ids = sorted(ObjectRelations.host_effective_services.get(self.host_name, ()))
+        # Same as Service.objects.get_by_id(i, cache_only=True) for every id, with one lock
+        with pynag.Utils.shared_lock(get_context().lock):
+            cached_ids = ObjectFetcher._cached_ids
+            return [cached_ids[i] for i in list_of_ids]
 
     def get_effective_contacts(self):
         """ Returns a list of all Contact that belong to this Host """
@@ -1757,7 +2737,7 @@ class Host(ObjectDefinition):
         :param status: pynag.Parsers.status_dat.StatusDat instance
         """
         if not status:
-            status = pynag.Parsers.status_dat.StatusDat(cfg_file=cfg_file)
+            status = pynag.Parsers.status_dat.StatusDat(cfg_file=get_context().cfg_file)
         host = status.get_hoststatus(self.host_name)
         return host
 
@@ -1832,7 +2812,7 @@ class Service(ObjectDefinition):
         else:
             return None
 
-    def _get_host_macro(self, macroname, host_name=None):
+    def _get_host_macro(self, macroname, host_name=None, cache_only=False):
         if not pynag.Utils.is_macro(macroname):
             return _UNRESOLVED_MACRO
         if not host_name:
@@ -1840,7 +2820,7 @@ class Service(ObjectDefinition):
         if not host_name:
             return _UNRESOLVED_MACRO
         try:
-            myhost = Host.objects.get_by_shortname(host_name)
+            myhost = Host.objects.get_by_shortname(host_name, cache_only=cache_only)
             return myhost._get_host_macro(macroname)
         except Exception:
             return _UNRESOLVED_MACRO
@@ -1848,8 +2828,10 @@ class Service(ObjectDefinition):
     def _do_relations(self):
         super(self.__class__, self)._do_relations()
         # Do hostgroups
-        hg = AttributeList(self.hostgroup_name)
-        for i in hg.fields:
+        for i in _get_fields_with_exclusions(self.hostgroup_name):
+            if i.startswith('!'):
+                ObjectRelations.excluded_hostgroup_services[i[1:]].add(self.get_id())
+                continue
             ObjectRelations.service_hostgroups[self.get_id()].add(i)
             ObjectRelations.hostgroup_services[i].add(self.get_id())
             # Contactgroups
@@ -1868,8 +2850,10 @@ class Service(ObjectDefinition):
         if self.check_command:
             command_name = self.check_command.split('!')[0]
             ObjectRelations.command_service[self.get_id()].add(command_name)
-        hosts = AttributeList(self.host_name)
-        for i in hosts.fields:
+        for i in _get_fields_with_exclusions(self.host_name):
+            if i.startswith('!'):
+                ObjectRelations.excluded_host_services[i[1:]].add(self.get_id())
+                continue
             ObjectRelations.service_hosts[self.get_id()].add(i)
             ObjectRelations.host_services[i].add(self.get_id())
 
@@ -1885,7 +2869,7 @@ class Service(ObjectDefinition):
                                                       author=author,
                                                       comment=comment,
                                                       timestamp=timestamp,
-                                                      command_file=config.get_cfg_value('command_file')
+                                                      command_file=get_context().config.get_cfg_value('command_file')
                                                       )
 
     def downtime(self, start_time=None, end_time=None, trigger_id=0, duration=7200, author=None,
@@ -1986,7 +2970,7 @@ class Service(ObjectDefinition):
         :param status: pynag.Parsers.status_dat.StatusDat instance
         """
         if not status:
-            status = pynag.Parsers.status_dat.StatusDat(cfg_file=cfg_file)
+            status = pynag.Parsers.status_dat.StatusDat(cfg_file=get_context().cfg_file)
         service = status.get_servicestatus(self.host_name, service_description=self.service_description)
         return service
 
@@ -2078,9 +3062,12 @@ class Contact(ObjectDefinition):
         result.update(list(map(get_object, list_of_shortnames)))
         return result
 
-    def _get_contact_macro(self, macroname, contact_name=None):
+    def _get_contact_macro(self, macroname, contact_name=None, cache_only=False):
         if not pynag.Utils.is_macro(macroname):
             return _UNRESOLVED_MACRO
+        return self._get_cached_macro(macroname, self._resolve_contact_macro)
+
+    def _resolve_contact_macro(self, macroname):
         if macroname in macros.STANDARD_CONTACT_MACROS:
             attribute_name = macros.STANDARD_CONTACT_MACROS[macroname]
         elif macroname.startswith('$_CONTACT'):
@@ -2649,6 +3636,173 @@ def _remove_from_contactgroup(my_object, contactgroup):
         return False
 
 
+def iter_effective_command_lines(processes=None):
+    """ Yields the effective check command of every service on every host it applies to
+
+    This is the same as calling Service.get_effective_command_line(host_name)
+    for every host of every service, including hosts that a service applies
+    to via hostgroup_name, but in one pass: commands are only looked up
+    once, and macros of a host are resolved once for all of its services.
+
+    Args:
+
+        processes (int): If set, spread the work over this many worker
+        processes. Workers are forked, so the configuration is not loaded
+        again in every worker. Ignored where fork() is not available.
+
+    Returns:
+
+        Iterator of (host_name, service_description, command_line) tuples,
+        in the same order as Service.objects.all. command_line is None
+        if the service has no check_command, or its command does not exist.
+
+    Example:
+
+        >>> for host_name, service_description, command_line in iter_effective_command_lines(): # doctest: +SKIP
+        ...     print(host_name, service_description, command_line)
+    """
+    services = [i for i in Service.objects.all if i.is_registered()]
+    jobs = list(range(len(services)))
+    state = _CommandLineExport(services)
+
+    pool = None
+    if processes and len(jobs) > 1:
+        try:
+            get_pool = multiprocessing.get_context('fork').Pool
+        except AttributeError:
+            get_pool = multiprocessing.Pool  # python2 always forks on posix
+        except ValueError:
+            get_pool = None  # No fork() on this platform
+        if get_pool is not None:
+            _command_line_exports.append(state)
+            try:
+                pool = get_pool(processes)
+            finally:
+                _command_line_exports.remove(state)
+
+    if pool is None:
+        for i in jobs:
+            for result in state.get_command_lines(i):
+                yield result
+        return
+
+    chunksize = max(1, len(jobs) // (processes * 4))
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    try:
+        for results in pool.imap(_command_lines_worker, chunks):
+            for result in results:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class _CommandLineExport(object):
+
+    """ What iter_effective_command_lines() needs to resolve command lines of many services """
+
+    def __init__(self, services):
+        self.services = services
+        self.hosts = dict((i.host_name, i) for i in Host.objects.get_all(cache_only=True) if i.is_registered())
+        self.commands = dict((i.command_name, i) for i in Command.objects.get_all(cache_only=True))
+
+    def get_host_names(self, service):
+        """ Returns a sorted list of every host_name service applies to """
+        hostgroup_hosts = ObjectRelations.hostgroup_hosts
+        host_names = set()
+        excluded = set()
+        for name in _get_fields_with_exclusions(service.host_name):
+            if name == '*':
+                host_names.update(self.hosts)
+            elif name.startswith('!'):
+                excluded.add(name[1:])
+            else:
+                host_names.add(name)
+        for name in _get_fields_with_exclusions(service.hostgroup_name):
+            if name == '*':
+                host_names.update(self.hosts)
+            elif name.startswith('!'):
+                excluded.update(hostgroup_hosts.get(name[1:], ()))
+            else:
+                host_names.update(hostgroup_hosts.get(name, ()))
+        return sorted(i for i in host_names.difference(excluded) if i in self.hosts)
+
+    def get_command_lines(self, index):
+        """ Returns (host_name, service_description, command_line) for every host of service number index """
+        service = self.services[index]
+        service_description = service.service_description
+        host_names = self.get_host_names(service)
+        check_command = service.check_command
+        command = None
+        if check_command:
+            command = self.commands.get(service._split_check_command_and_arguments(check_command)[0])
+        if command is None or not host_names:
+            return [(host_name, service_description, None) for host_name in host_names]
+
+        # Macros that do not depend on the host are resolved once for all hosts
+        tokens = _split_macros(command.command_line or '')
+        template = list(tokens)
+        host_macros = []
+        first_host = self.hosts[host_names[0]]
+        for i in range(1, len(tokens), 2):
+            if self.depends_on_host(service, tokens[i]):
+                host_macros.append((i, tokens[i]))
+            else:
+                template[i] = self.resolve_macros(service, first_host, tokens[i])
+        results = []
+        for host_name in host_names:
+            host = self.hosts[host_name]
+            command_line = template
+            if host_macros:
+                command_line = list(template)
+                for i, macroname in host_macros:
+                    command_line[i] = self.resolve_macros(service, host, macroname)
+            results.append((host_name, service_description, ''.join(command_line)))
+        return results
+
+    def depends_on_host(self, service, macroname):
+        """ Returns True if the value of macroname for service can be different on every host """
+        if macroname.startswith('$HOST') or macroname.startswith('$_HOST'):
+            return True
+        if macroname.startswith('$ARG'):
+            value = service._get_cached_macro(macroname, service._resolve_command_macro) or ''
+            return any(self.depends_on_host(service, i) for i in _split_macros(value)[1::2])
+        return False
+
+    def resolve_macros(self, service, host, string):
+        """ Same as service._resolve_macros(string, host.host_name), without looking up host """
+        if not string:
+            return _UNRESOLVED_MACRO
+        tokens = _split_macros(string)
+        if len(tokens) == 1:
+            return string
+        result = list(tokens)
+        for i in range(1, len(tokens), 2):
+            macroname = tokens[i]
+            if macroname.startswith('$HOST') or macroname.startswith('$_HOST'):
+                value = host._get_host_macro(macroname)
+            elif macroname.startswith('$ARG'):
+                value = service._get_cached_macro(macroname, service._resolve_command_macro)
+                value = self.resolve_macros(service, host, value)
+            else:
+                value = service.get_macro(macroname, host_name=host.host_name, cache_only=True)
+            result[i] = _UNRESOLVED_MACRO if value is None else value
+        return ''.join(result)
+
+
+# State of iter_effective_command_lines() for worker processes, which inherit it when they fork
+_command_line_exports = []
+
+
+def _command_lines_worker(jobs):
+    """ Returns command lines of the services in jobs, run in a worker process by iter_effective_command_lines() """
+    state = _command_line_exports[-1]
+    results = []
+    for i in jobs:
+        results += state.get_command_lines(i)
+    return results
+
+
 string_to_class = {}
 string_to_class['contact'] = Contact
 string_to_class['service'] = Service
@@ -2668,6 +3822,20 @@ string_to_class['command'] = Command
 AttributeList = pynag.Utils.AttributeList
 
 
+def _get_fields_with_exclusions(value):
+    """ Returns AttributeList(value).fields, where excluded names keep their leading '!'
+
+    AttributeList reads a leading '!' as an operator, but in host_name and
+    hostgroup_name of a service it excludes the first name, just like it
+    does for any other name in the list.
+    """
+    attribute_list = AttributeList(value)
+    fields = attribute_list.fields
+    if attribute_list.operator == '!' and fields:
+        fields = ['!' + fields[0]] + fields[1:]
+    return fields
+
+
 def _add_property(ClassType, name):
     """ Create a dynamic property specific ClassType
 
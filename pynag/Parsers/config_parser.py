@@ -2,8 +2,13 @@
 """Module for low-level parsing of nagios-style configuration files."""
 
 from __future__ import absolute_import
+import collections
+import contextlib
+import errno
+import multiprocessing
 import os
 import re
+import stat
 import sys
 import time
 
@@ -13,15 +18,44 @@ from pynag.Utils import bytes2str
 
 # TODO: Raise more specific errors in this module.
 from pynag.Parsers.errors import ParserError
+from pynag.Parsers import watchers
 import six
 from six.moves import map
 from six.moves import range
+from six.moves import cPickle as pickle
 
 
 class ConfigFileNotFound(ParserError):
     """ This exception is thrown if we cannot locate any nagios.cfg-style config file. """
 
 
+if six.PY2:
+    def _intern(string):
+        """ Returns an interned copy of string, so that equal attribute names and values share memory """
+        if not isinstance(string, str):
+            return string
+        return intern(string)
+else:
+    _intern = sys.intern
+
+
+def _parse_string_worker(job):
+    """ Run Config.parse_string() in a worker process. Used by Config._parse_files()
+
+    Args:
+
+        job: tuple of (cfg_file, strict, string, filename)
+
+    Returns:
+
+        tuple of (parsed items, list of ParserErrors)
+    """
+    cfg_file, strict, string, filename = job
+    config = Config(cfg_file=cfg_file, strict=strict)
+    items = config.parse_string(string, filename=filename)
+    return items, config.errors
+
+
 class Config(object):
 
     """ Parse and write nagios config files """
@@ -30,7 +64,20 @@ class Config(object):
     # define <object_type> {
     __beginning_of_object = re.compile("^\s*define\s+(\w+)\s*\{?(.*)$")
 
-    def __init__(self, cfg_file=None, strict=False):
+    # Used by the fast path of parse_string() to find a whole object
+    # definition, from "define" down to the first line that starts with "}"
+    _define_block = re.compile(
+        r'^[ \t]*(define[ \t]+(\w+)[^\n]*)\n((?:[ \t]*[^\s}][^\n]*\n|[ \t]*\n)*)[ \t]*(\}[^\n]*)', re.M)
+    _line_continuation = re.compile(r'\\\s*$', re.M)
+    # Line boundaries that str.splitlines() knows about, except for \n
+    _line_breaks = ('\r', '\x0b', '\x0c', '\x1c', '\x1d', '\x1e', u'\x85', u'\u2028', u'\u2029')
+
+    # Bump this whenever the layout of parsed items changes, so that
+    # parse caches written by older versions are ignored.
+    _parse_cache_version = 2
+
+    def __init__(self, cfg_file=None, strict=False, incremental=False, cache_file=None, processes=None,
+                 atomic_writes=False, fsync=False, lock=None, watch=None, poll_interval=1.0):
         """ Constructor for :py:class:`pynag.Parsers.config` class
 
         Args:
@@ -40,10 +87,47 @@ class Config(object):
 
             strict (bool): if True, use stricter parsing which is more prone to
             raising exceptions
+
+            incremental (bool): if True, subsequent calls to parse() will only
+            re-read configuration files that have changed since last parse()
+
+            cache_file (str): If set, parse() stores a snapshot of parsed
+            objects in this file and loads from it next time, as long as no
+            configuration file has changed in the meantime.
+
+            processes (int): If set, parse() will spread parsing of object
+            configuration files across this many worker processes.
+
+            atomic_writes (bool): if True, write() replaces files by writing
+            to a temporary file and renaming it, so nobody ever reads a half
+            written configuration file. Files with more than one hard link,
+            and files in directories we may not create files in, are still
+            written in place.
+
+            fsync (bool): if True, write() flushes files to disk before
+            returning, at the cost of speed.
+
+            lock (threading.RLock): Lock held while parsing and writing. If
+            None, pynag.Utils.rlock which is shared by every Config.
+
+            watch (str): How needs_reparse() notices changed files. None
+            stats every file on every call. 'inotify' asks the kernel to
+            tell us about changes, 'poll' stats every file at most once
+            every poll_interval seconds, 'auto' uses inotify where
+            available and polling elsewhere.
+
+            poll_interval (float): Seconds between checks with watch='poll'
         """
 
         self.cfg_file = cfg_file  # Main configuration file
         self.strict = strict  # Use strict parsing or not
+        self.incremental = incremental  # Only reparse changed files
+        self.cache_file = cache_file  # Snapshot of parsed objects
+        self.processes = processes  # Number of processes used by parse()
+        self.atomic_writes = atomic_writes  # Replace files with rename() instead of truncating them
+        self.fsync = fsync  # Flush written files to disk
+        self.lock = lock or pynag.Utils.rlock  # Held by parse(), write() and transactions
+        self._watcher = watchers.get_watcher(watch, poll_interval) if watch else None
 
         # If nagios.cfg is not set, lets do some minor autodiscover.
         if self.cfg_file is None:
@@ -52,6 +136,11 @@ class Config(object):
         self.data = {}
         self.maincfg_values = []
         self._is_dirty = False
+        self._dirty_files = set()  # Files we have written to since last parse()
+        self._transaction_depth = 0  # How many transactions are currently open
+        self._transaction_operations = []  # (filename, operation) queued by transaction()
+        self._write_buffer = None  # normpath -> (filename, string) held back by write_behind()
+        self._transaction_owns_write_buffer = False  # Discard the write buffer on rollback
         self.reset()  # Initilize misc member variables
 
     def guess_nagios_directory(self):
@@ -131,7 +220,13 @@ class Config(object):
         self.item_cache = None
         self.maincfg_values = []  # The contents of main nagios.cfg
         self._resource_values = []  # The contents of any resource_files
-        self.item_apply_cache = {}  # This is performance tweak used by _apply_template
+        self._resources = None  # ((mtime, size) of resource files, dict of their values), used by get_resource()
+        self.item_apply_cache = {}  # Flattened template attributes, used by _apply_template
+        self._circular_use = False  # True if _apply_template() found circular use=
+        self._file_items = {}  # Items of pre_object_list, grouped by filename
+        self._lookup_indexes = {}  # Used by get_object() and get_service()
+        self._file_index = None  # Used by _get_items_in_file()
+        self._file_signatures = {}  # filename -> (mtime, size) when line numbers in it were last known to be right
 
         # This is a pure listof all the key/values in the config files.  It
         # shouldn't be useful until the items in it are parsed through with the proper
@@ -245,6 +340,12 @@ class Config(object):
 
         Applies all of the attributes of parents (from the 'use' field) to item.
 
+        Templates are only resolved once per parse. The first time a template
+        is needed, every template it inherits from is resolved in
+        topological order, parents before children, and its flattened
+        attributes are stored in :py:attr:`item_apply_cache`. Circular use=
+        is reported as a :py:class:`ParserError`.
+
         Args:
 
             original_item: Item 'use'-ing a parent item. The parent's attributes
@@ -255,53 +356,125 @@ class Config(object):
             original_item to which have been added all the attributes defined
             in parent items.
         """
-
-        # TODO: There is space for more performance tweaks here
         # If item does not inherit from anyone else, lets just return item as is.
         if 'use' not in original_item:
             return original_item
         object_type = original_item['meta']['object_type']
-        raw_definition = original_item['meta']['raw_definition']
-        my_cache = self.item_apply_cache.get(object_type, {})
-
-        # Performance tweak, if item has been parsed. Lets not do it again
-        if raw_definition in my_cache:
-            return my_cache[raw_definition]
-
-        parent_names = original_item['use'].split(',')
-        parent_items = []
-        for parent_name in parent_names:
-            parent_item = self._get_item(parent_name, object_type)
-            if parent_item is None:
-                error_string = "Can not find any %s named %s\n" % (object_type, parent_name)
-                self.errors.append(ParserError(error_string, item=original_item))
-                continue
+        my_cache = self.item_apply_cache.setdefault(object_type, {})
 
-            try:
-                # Parent item probably has use flags on its own. So lets apply to parent first
-                parent_item = self._apply_template(parent_item)
-            except RuntimeError:
-                t, e = sys.exc_info()[:2]
-                self.errors.append(ParserError("Error while parsing item: %s (it might have circular use=)" % str(e),
-                                               item=original_item))
-            parent_items.append(parent_item)
-
-        inherited_attributes = original_item['meta']['inherited_attributes']
-        template_fields = original_item['meta']['template_fields']
-        for parent_item in parent_items:
-            for k, v in six.iteritems(parent_item):
-                if k in ('use', 'register', 'meta', 'name'):
-                    continue
-                if k not in inherited_attributes:
-                    inherited_attributes[k] = v
-                if k not in original_item:
-                    original_item[k] = v
-                    template_fields.append(k)
-        if 'name' in original_item:
-            my_cache[raw_definition] = original_item
+        # Templates are resolved together with everything they use
+        name = original_item.get('name')
+        if name is not None and self._get_item(name, object_type) is original_item:
+            if name not in my_cache:
+                self._resolve_template(name, object_type)
+            return original_item
 
+        for parent_name in original_item['use'].split(','):
+            if parent_name not in my_cache:
+                self._resolve_template(parent_name, object_type)
+        self._inherit_attributes(original_item, my_cache)
         return original_item
 
+    def _resolve_template(self, template_name, object_type):
+        """ Apply templates to the template named template_name and every template it uses
+
+        Templates are visited depth first, and each one is resolved after
+        all of its parents. Flattened attributes of every resolved template
+        are stored in :py:attr:`item_apply_cache`.
+
+        Args:
+
+            template_name: Name of the template to resolve (string)
+
+            object_type: Type of the template, e.g. "host" (string)
+        """
+        my_cache = self.item_apply_cache.setdefault(object_type, {})
+        template = self._get_item(template_name, object_type)
+        if template is None:
+            return
+        path = [template_name]
+        stack = [(template, iter(self._get_parent_names(template)))]
+        while stack:
+            item, parent_names = stack[-1]
+            for parent_name in parent_names:
+                if parent_name in my_cache:
+                    continue
+                if parent_name in path:
+                    cycle = path[path.index(parent_name):] + [parent_name]
+                    error_string = "Circular use= in %s templates: %s" % (object_type, ' -> '.join(cycle))
+                    self.errors.append(ParserError(error_string, item=item))
+                    self._circular_use = True
+                    continue
+                parent_item = self._get_item(parent_name, object_type)
+                if parent_item is None:
+                    continue
+                path.append(parent_name)
+                stack.append((parent_item, iter(self._get_parent_names(parent_item))))
+                break
+            else:
+                stack.pop()
+                name = path.pop()
+                self._inherit_attributes(item, my_cache)
+                my_cache[name] = dict(
+                    (k, v) for k, v in six.iteritems(item) if k not in ('use', 'register', 'meta', 'name')
+                )
+
+    def _count_templates(self, items):
+        """ Returns a dict of (object_type, name) -> how many of items define that template """
+        templates = {}
+        for item in items:
+            if 'name' in item:
+                key = (item['meta']['object_type'], item['name'])
+                templates[key] = templates.get(key, 0) + 1
+        return templates
+
+    def _get_parent_names(self, item):
+        """ Returns a list of template names in the 'use' attribute of item """
+        if 'use' not in item:
+            return []
+        return item['use'].split(',')
+
+    def _inherit_attributes(self, item, my_cache):
+        """ Copy attributes from already resolved templates into item
+
+        Attributes from the first template in 'use' take precedence, and
+        attributes defined in item itself are never overwritten.
+
+        Args:
+
+            item: Item to apply templates to
+
+            my_cache: Flattened template attributes of item's object_type, as
+            stored in :py:attr:`item_apply_cache`
+        """
+        object_type = item['meta']['object_type']
+        parents = []
+        for parent_name in self._get_parent_names(item):
+            if parent_name in my_cache:
+                parents.append(my_cache[parent_name])
+            elif self._get_item(parent_name, object_type) is None:
+                error_string = "Can not find any %s named %s\n" % (object_type, parent_name)
+                self.errors.append(ParserError(error_string, item=item))
+            # Otherwise parent is part of circular use=, which has already been reported
+
+        if len(parents) == 1:
+            attributes = parents[0]
+        else:
+            attributes = {}
+            for parent in reversed(parents):
+                attributes.update(parent)
+
+        # attributes may be the dict in item_apply_cache, so every item
+        # gets a copy of its own that callers are free to modify
+        inherited_attributes = attributes.copy()
+        inherited_attributes.update(item['meta']['inherited_attributes'])
+        item['meta']['inherited_attributes'] = inherited_attributes
+        template_fields = item['meta']['template_fields']
+        for k, v in six.iteritems(attributes):
+            if k not in item:
+                item[k] = v
+                template_fields.append(k)
+
     def _get_items_in_file(self, filename):
         """ Return all items in the given file
 
@@ -318,13 +491,26 @@ class Config(object):
             A list containing all the items in self.data that were defined in
             filename
         """
-        return_list = []
+        return list(self._get_file_index().get(filename, []))
 
-        for k in self.data.keys():
-            for item in self[k]:
-                if item['meta']['filename'] == filename:
-                    return_list.append(item)
-        return return_list
+    def _get_file_index(self):
+        """ Returns a dict of filename -> list of items in self.data
+
+        The index is rebuilt whenever a list in self.data has been replaced
+        or has changed size. Items within each file are in the same order as
+        they are in self.data.
+        """
+        signature = [(k, id(v), len(v)) for k, v in six.iteritems(self.data)]
+        if self._file_index is None or self._file_index[0] != signature:
+            index = {}
+            for k in self.data.keys():
+                for item in self[k]:
+                    filename = item['meta']['filename']
+                    if filename not in index:
+                        index[filename] = []
+                    index[filename].append(item)
+            self._file_index = (signature, index)
+        return self._file_index[1]
 
     def get_new_item(self, object_type, filename):
         """ Returns an empty item with all necessary metadata
@@ -373,7 +559,9 @@ class Config(object):
 
             filename: the file to be parsed. This is supposed to a nagios object definition file
         """
-        for i in self.parse_file(filename):
+        items = self.parse_file(filename)
+        self._file_items[filename] = items
+        for i in items:
             self.pre_object_list.append(i)
 
     def parse_file(self, filename):
@@ -400,6 +588,56 @@ class Config(object):
             self.errors.append(parser_error)
             return []
 
+    def _parse_files(self, filenames):
+        """ Parses a list of nagios object configuration files
+
+        If self.processes is set, files are read here and parse_string() is
+        spread over a pool of worker processes. Otherwise this is the same
+        as calling :py:meth:`parse_file` on every file.
+
+        Args:
+
+            filenames: List of paths to parse
+
+        Returns:
+
+            A list with one list of parsed items per file, in the same order
+            as filenames.
+        """
+        # Stat files before reading them, if they change while we read we
+        # will notice next time line numbers are used
+        for filename in filenames:
+            self._file_signatures[filename] = self._get_file_signature(filename)
+
+        if not self.processes or len(filenames) < 2:
+            return [self.parse_file(filename) for filename in filenames]
+
+        jobs = []
+        for filename in filenames:
+            try:
+                raw_string = self.open(filename, 'rb').read()
+            except IOError:
+                t, e = sys.exc_info()[:2]
+                parser_error = ParserError(e.strerror)
+                parser_error.filename = e.filename
+                self.errors.append(parser_error)
+                raw_string = ''
+            jobs.append((self.cfg_file, self.strict, raw_string, filename))
+
+        chunksize = max(1, len(jobs) // (self.processes * 4))
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            results = pool.map(_parse_string_worker, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+        file_items = []
+        for items, errors in results:
+            self.errors += errors
+            file_items.append(items)
+        return file_items
+
     def parse_string(self, string, filename='None'):
         """ Parses a string, and returns all object definitions in that string
 
@@ -429,14 +667,162 @@ class Config(object):
             :py:class:`ParserError`
 
         """
+        string = bytes2str(string)
+        result = self._parse_string_regex(string, filename)
+        if result is None:
+            result = self._parse_string_lines(string, filename)
+        return result
+
+    def _parse_string_regex(self, string, filename='None'):
+        """ Fast path of :py:meth:`parse_string`, works on the whole string at once
+
+        Object definitions are located with a single regular expression over
+        the whole string, and their attributes are parsed with string methods.
+        Output is identical to :py:meth:`_parse_string_lines`.
+
+        Only well-formed input is handled. Line continuations, text outside
+        object definitions, unterminated definitions, strict mode and
+        anything else unusual are left to the line based parser.
+
+        Args:
+
+            string: A string containing one or more object definitions
+
+            filename (optional): Filename to store in the meta of every item
+
+        Returns:
+
+            A list of dictionaries, like :py:meth:`parse_string`
+
+            None if string must be parsed with :py:meth:`_parse_string_lines`
+        """
+        if self.strict:
+            return None
+        for line_break in self._line_breaks:
+            if line_break in string:
+                return None
+        if '\\' in string and self._line_continuation.search(string):
+            return None
+
+        result = []
+        line_num = 1
+        position = 0
+        for block in self._define_block.finditer(string):
+            define_line, object_type, body, end_line = block.groups()
+            start = block.start()
+            if not self._is_blank(string[position:start]):
+                return None
+            line_num += string.count('\n', position, start)
+
+            lines = [line.strip() for line in body.split('\n')]
+            if '#' in body or ';' in body or '}' in body or 'define' in body:
+                lines = [line for line in lines if line and line[0] not in '#;']
+                for line in lines:
+                    if line.startswith('}') or line.startswith('define'):
+                        return None
+            else:
+                lines = [line for line in lines if line]
+
+            current = self.get_new_item(object_type, filename)
+            meta = current['meta']
+            defined_attributes = meta['defined_attributes']
+            pairs = [tuple(map(_intern, line.split(None, 1))) for line in lines]
+            try:
+                # Most objects have no inline comments and nothing that
+                # needs special treatment, so dict.update() does the job
+                if object_type in ('timeperiod', 'hostgroup') or ';' in body:
+                    raise ValueError
+                current.update(pairs)
+                if 'description' in current and object_type == 'service':
+                    raise ValueError
+                defined_attributes.update(pairs)
+            except ValueError:
+                for key in list(current.keys()):
+                    if key != 'meta':
+                        del current[key]
+                self._add_attributes(current, lines)
+
+            lines.insert(0, define_line.strip())
+            position = block.end()
+            meta['line_start'] = line_num
+            meta['line_end'] = line_num + string.count('\n', start, position)
+            meta['raw_definition'] = '\n    '.join(lines) + '\n' + end_line.strip()
+            line_num = meta['line_end']
+            result.append(current)
+
+        if not self._is_blank(string[position:]):
+            return None
+        return result
+
+    def _add_attributes(self, item, lines):
+        """ Add attributes to item, as defined by lines
+
+        Args:
+
+            item: item (dict) created by :py:meth:`get_new_item`
+
+            lines: list of "key value" strings, stripped and without comments
+        """
+        object_type = item['meta']['object_type']
+        defined_attributes = item['meta']['defined_attributes']
+        for line in lines:
+            tmp = line.split(None, 1)
+            if len(tmp) > 1:
+                key, value = tmp
+                if ';' in value:
+                    value = value.split(';', 1)[0].strip()
+            else:
+                key = line
+                value = ''
+            if object_type == 'service' and key == 'description':
+                key = 'service_description'
+            elif object_type == 'timeperiod' and key not in ('timeperiod_name', 'alias'):
+                key = line
+                value = ''
+            elif object_type == 'hostgroup' and key == 'members' and key in item:
+                value = '%s,%s' % (item[key], value)
+            key = _intern(key)
+            value = _intern(value)
+            item[key] = value
+            defined_attributes[key] = value
+
+    def _is_blank(self, string):
+        """ Returns True if string only contains empty lines and comments """
+        if not string.strip():
+            return True
+        for line in string.split('\n'):
+            line = line.strip()
+            if line and not line.startswith('#') and not line.startswith(';'):
+                return False
+        return True
+
+    def _parse_string_lines(self, string, filename='None'):
+        """ Line based implementation of :py:meth:`parse_string`
+
+        This is slower than :py:meth:`_parse_string_regex` but handles
+        everything, including broken configuration.
+
+        Args:
+
+            string: A string containing one or more object definitions
+
+            filename (optional): If filename is provided, it will be referenced
+            when raising exceptions
+
+        Returns:
+
+            A list of dictionaries, like :py:meth:`parse_string`
+
+        Raises:
+
+            :py:class:`ParserError`
+        """
         append = ""
         current = None
         in_definition = {}
         tmp_buffer = []
         result = []
 
-        string = bytes2str(string)
-
         for sequence_no, line in enumerate(string.splitlines(False)):
             line_num = sequence_no + 1
 
@@ -542,6 +928,8 @@ class Config(object):
                     value = ''
                 if (current['meta']['object_type'] == 'hostgroup') and key == 'members' and key in current:
                     value = '%s,%s' % (current[key], value)
+                key = _intern(key)
+                value = _intern(value)
                 current[key] = value
                 current['meta']['defined_attributes'][key] = value
             # Something is wrong in the config
@@ -574,36 +962,144 @@ class Config(object):
             :py:class:`ValueError` if object was not found in "filename"
 
         """
+        all_lines, start, end, filename = self._locate_item_lines(item)
+        everything_before = all_lines[:start]
+        object_definition = all_lines[start:end]
+        everything_after = all_lines[end:]
+
+        # If there happen to be line continuations in the object we will edit
+        # We will remove them from object_definition
+        object_definition = self._clean_backslashes(object_definition)
+        return everything_before, object_definition, everything_after, filename
+
+    def _locate_item_lines(self, item):
+        """ Locates the lines in a config file that define item. Helper function for :py:meth:`_locate_item`
+
+        Returns:
+
+            (all_lines, start, end, filename) where all_lines is every line in
+            filename and all_lines[start:end] are the lines that define item.
+
+        Raises:
+
+            :py:class:`ValueError` if object was not found in "filename"
+        """
         if "filename" in item['meta']:
             filename = item['meta']['filename']
         else:
             raise ValueError("item does not have a filename")
 
-        # Look for our item, store it as my_item
-        for i in self.parse_file(filename):
-            if self.compareObjects(item, i):
-                my_item = i
-                break
-        else:
-            raise ValueError("We could not find object in %s\n%s" % (filename, item))
+        # If the file has not changed since line numbers of item were
+        # recorded, we can go straight to the right lines.
+        start, end, all_lines = self._locate_item_by_line_numbers(item, filename)
+
+        if all_lines is None:
+            # Look for our item, store it as my_item
+            for i in self.parse_file(filename):
+                if self.compareObjects(item, i):
+                    my_item = i
+                    break
+            else:
+                raise ValueError("We could not find object in %s\n%s" % (filename, item))
+
+            # Caller of this method expects to be returned
+            # several lists that describe the lines in our file.
+            # The splitting logic starts here.
+            my_file = self.open(filename)
+            all_lines = my_file.readlines()
+            my_file.close()
+
+            start = my_item['meta']['line_start'] - 1
+            end = my_item['meta']['line_end']
+        return all_lines, start, end, filename
+
+    def _locate_item_by_line_numbers(self, item, filename):
+        """ Find the lines that define item via the line numbers in its meta
+
+        Line numbers are only trusted if filename has not been modified
+        since they were recorded, and if the lines in question still define
+        exactly the same object.
+
+        Args:
+
+            item: Item to locate
+
+            filename: File that item is defined in
+
+        Returns:
+
+            (start, end, all_lines) where all_lines[start:end] defines item.
+
+            (None, None, None) if item has to be located by parsing the file
+        """
+        line_start = item['meta'].get('line_start')
+        line_end = item['meta'].get('line_end')
+        signature = self._file_signatures.get(filename)
+        if not line_start or not line_end or signature is None:
+            return None, None, None
+        if signature != self._get_file_signature(filename):
+            return None, None, None
 
-        # Caller of this method expects to be returned
-        # several lists that describe the lines in our file.
-        # The splitting logic starts here.
         my_file = self.open(filename)
         all_lines = my_file.readlines()
         my_file.close()
+        start = line_start - 1
+        end = line_end
+        object_definition = ''.join(all_lines[start:end])
 
-        start = my_item['meta']['line_start'] - 1
-        end = my_item['meta']['line_end']
-        everything_before = all_lines[:start]
-        object_definition = all_lines[start:end]
-        everything_after = all_lines[end:]
+        # Make sure these lines define our object, and nothing else
+        number_of_errors = len(self.errors)
+        try:
+            items = self.parse_string(object_definition, filename=filename)
+        except ParserError:
+            items = []
+        del self.errors[number_of_errors:]
+        if len(items) != 1 or not self.compareObjects(item, items[0]):
+            return None, None, None
+        if items[0]['meta']['line_start'] != 1 or items[0]['meta']['line_end'] != end - start:
+            return None, None, None
+        return start, end, all_lines
+
+    def _update_line_numbers(self, item, filename, start, end, new_lines):
+        """ Update line numbers of items in filename after we rewrote some of its lines
+
+        Helper function for :py:meth:`_modify_object`. Line numbers of every
+        item in self.data that is defined after the modified lines are
+        shifted, so later edits to the same file do not have to parse it.
 
-        # If there happen to be line continuations in the object we will edit
-        # We will remove them from object_definition
-        object_definition = self._clean_backslashes(object_definition)
-        return everything_before, object_definition, everything_after, filename
+        Args:
+
+            item: The item that was modified
+
+            filename: File that was written to
+
+            start, end: The lines all_lines[start:end] were replaced
+
+            new_lines: list of lines that replaced them
+        """
+        new_string = ''.join(new_lines)
+        if new_string and not new_string.endswith('\n'):
+            # New lines were merged with the line after them
+            return
+        number_of_lines = new_string.count('\n')
+        offset = number_of_lines - (end - start)
+
+        for other in self._get_file_index().get(filename, []):
+            meta = other['meta']
+            if other is item or meta.get('line_start') is None or meta.get('line_end') is None:
+                continue
+            if meta['line_start'] > end:
+                meta['line_start'] += offset
+                meta['line_end'] += offset
+            elif meta['line_start'] == start + 1:
+                # Another copy of our item
+                meta['line_end'] = start + number_of_lines
+
+        # Line numbers are verified before they are used, so if item was
+        # rewritten or removed these will simply be ignored.
+        item['meta']['line_start'] = start + 1
+        item['meta']['line_end'] = start + number_of_lines
+        self._file_signatures[filename] = self._get_file_signature(filename)
 
     def _clean_backslashes(self, list_of_strings):
         """ Returns list_of_strings with all all strings joined that ended with backslashes
@@ -665,80 +1161,147 @@ class Config(object):
             raise ValueError("either field_name or new_item must be set")
         if '\n' in str(new_value):
             raise ValueError("Invalid character \\n used as an attribute value.")
-        everything_before, object_definition, everything_after, filename = self._locate_item(item)
-        if new_item is not None:
-            # We have instruction on how to write new object, so we dont need to parse it
-            object_definition = [new_item]
-        else:
-            change = None
-            value = None
-            i = 0
-            for i in range(len(object_definition)):
-                tmp = object_definition[i].split(None, 1)
-                if len(tmp) == 0:
-                    continue
-                # Hack for timeperiods, they dont work like other objects
-                elif item['meta']['object_type'] == 'timeperiod' and field_name not in ('alias', 'timeperiod_name'):
-                    tmp = [object_definition[i]]
-                    # we can't change timeperiod, so we fake a field rename
-                    if new_value is not None:
-                        new_field_name = new_value
-                        new_value = None
-                        value = ''
-                elif len(tmp) == 1:
-                    value = ''
-                else:
-                    value = tmp[1]
-                k = tmp[0].strip()
-                if k == field_name:
-                    # Attribute was found, lets change this line
-                    if new_field_name is None and new_value is None:
-                        # We take it that we are supposed to remove this attribute
-                        change = object_definition.pop(i)
-                        break
-                    elif new_field_name:
-                        # Field name has changed
-                        k = new_field_name
-                    if new_value is not None:
-                        # value has changed
-                        value = new_value
-                        # Here we do the actual change
-                    change = "\t%-30s%s\n" % (k, value)
-                    if item['meta']['object_type'] == 'timeperiod' and field_name not in ('alias', 'timeperiod_name'):
-                        change = "\t%s\n" % new_field_name
-                    object_definition[i] = change
-                    break
-            if not change and new_value is not None:
-                # Attribute was not found. Lets add it
-                change = "\t%-30s%s\n" % (field_name, new_value)
-                object_definition.insert(i, change)
-            # Lets put a banner in front of our item
+        if self._transaction_depth > 0:
+            if "filename" not in item['meta']:
+                raise ValueError("item does not have a filename")
+            operation = {
+                'action': 'modify',
+                'key': self._get_compare_key(item),
+                'item': item.copy(),
+                'field_name': field_name,
+                'new_value': new_value,
+                'new_field_name': new_field_name,
+                'new_item': new_item,
+                'make_comments': make_comments,
+            }
+            self._transaction_operations.append((item['meta']['filename'], operation))
+            return True
+        all_lines, start, end, filename = self._locate_item_lines(item)
+        line_numbers_known = self._file_signatures.get(filename) == self._get_file_signature(filename)
+        everything_before = all_lines[:start]
+        object_definition = self._clean_backslashes(all_lines[start:end])
+        everything_after = all_lines[end:]
+        object_definition = self._modify_object_definition(
+            item, object_definition, field_name, new_value, new_field_name, new_item)
         if make_comments:
-            comment = '# Edited by PyNag on %s\n' % time.ctime()
-            if len(everything_before) > 0:
-                last_line_before = everything_before[-1]
-                if last_line_before.startswith('# Edited by PyNag on'):
-                    everything_before.pop()  # remove this line
-            object_definition.insert(0, comment)
+            self._add_edit_comment(everything_before, object_definition)
+            line_numbers_known = False
             # Here we overwrite the config-file, hoping not to ruin anything
         str_buffer = "%s%s%s" % (''.join(everything_before), ''.join(object_definition), ''.join(everything_after))
         self.write(filename, str_buffer)
+        if line_numbers_known:
+            self._update_line_numbers(item, filename, start, end, object_definition)
         return True
 
+    def _modify_object_definition(self, item, object_definition, field_name=None, new_value=None,
+                                  new_field_name=None, new_item=None):
+        """ Changes the lines that define "item". Helper function for :py:meth:`_modify_object`
+
+        Args:
+
+            item(dict): The item to be modified
+
+            object_definition(list): Lines from the config file that define item
+
+            field_name, new_value, new_field_name, new_item: See :py:meth:`_modify_object`
+
+        Returns:
+
+            A list of lines that should replace object_definition
+        """
+        if new_item is not None:
+            # We have instruction on how to write new object, so we dont need to parse it
+            return [new_item]
+        change = None
+        value = None
+        i = 0
+        for i in range(len(object_definition)):
+            tmp = object_definition[i].split(None, 1)
+            if len(tmp) == 0:
+                continue
+            # Hack for timeperiods, they dont work like other objects
+            elif item['meta']['object_type'] == 'timeperiod' and field_name not in ('alias', 'timeperiod_name'):
+                tmp = [object_definition[i]]
+                # we can't change timeperiod, so we fake a field rename
+                if new_value is not None:
+                    new_field_name = new_value
+                    new_value = None
+                    value = ''
+            elif len(tmp) == 1:
+                value = ''
+            else:
+                value = tmp[1]
+            k = tmp[0].strip()
+            if k == field_name:
+                # Attribute was found, lets change this line
+                if new_field_name is None and new_value is None:
+                    # We take it that we are supposed to remove this attribute
+                    change = object_definition.pop(i)
+                    break
+                elif new_field_name:
+                    # Field name has changed
+                    k = new_field_name
+                if new_value is not None:
+                    # value has changed
+                    value = new_value
+                    # Here we do the actual change
+                change = "\t%-30s%s\n" % (k, value)
+                if item['meta']['object_type'] == 'timeperiod' and field_name not in ('alias', 'timeperiod_name'):
+                    change = "\t%s\n" % new_field_name
+                object_definition[i] = change
+                break
+        if not change and new_value is not None:
+            # Attribute was not found. Lets add it
+            change = "\t%-30s%s\n" % (field_name, new_value)
+            object_definition.insert(i, change)
+        return object_definition
+
+    def _add_edit_comment(self, everything_before, object_definition):
+        """ Puts a pynag banner in front of object_definition, replacing any previous one
+
+        Args:
+
+            everything_before(list): Lines in the file before object_definition
+
+            object_definition(list): Lines that define the object that was edited
+        """
+        comment = '# Edited by PyNag on %s\n' % time.ctime()
+        if len(everything_before) > 0:
+            last_line_before = everything_before[-1]
+            if last_line_before.startswith('# Edited by PyNag on'):
+                everything_before.pop()  # remove this line
+        object_definition.insert(0, comment)
+
     def open(self, filename, *args, **kwargs):
         """ Wrapper around global open()
 
         Simply calls global open(filename, *args, **kwargs) and passes all arguments
         as they are received. See global open() function for more details.
+
+        If filename has pending changes in the :py:meth:`write_behind` buffer,
+        reading returns the pending contents, and writing to it writes the
+        pending contents to disk first.
         """
+        if self._write_buffer and os.path.normpath(filename) in self._write_buffer:
+            mode = args[0] if args else kwargs.get('mode', 'r')
+            if 'r' in mode and '+' not in mode:
+                string = self._write_buffer[os.path.normpath(filename)][1]
+                if 'b' in mode:
+                    return six.BytesIO(string.encode('utf-8'))
+                return six.StringIO(string)
+            self._write_file(*self._write_buffer.pop(os.path.normpath(filename)))
         return open(filename, *args, **kwargs)
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @pynag.Utils.synchronized(lambda self, *args, **kwargs: self.lock)
     def write(self, filename, string):
         """ Wrapper around open(filename).write()
 
-        Writes string to filename and closes the file handler. File handler is
-        openned in `'w'` mode.
+        Writes string to filename and closes the file handler. With
+        atomic_writes the string is written to a temporary file which then
+        replaces filename, otherwise filename is openned in `'w'` mode.
+
+        Inside :py:meth:`write_behind` nothing is written until the batch
+        ends, and only the last string written to each file is kept.
 
         Args:
 
@@ -749,17 +1312,426 @@ class Config(object):
 
         Returns:
 
-            Return code as returned by :py:meth:`os.write`
+            Return code as returned by :py:meth:`os.write`, or None if the
+            write was buffered.
 
         """
-        fh = self.open(filename, 'w')
-        return_code = fh.write(string)
-        fh.flush()
-        # os.fsync(fh)
-        fh.close()
+        if self._write_buffer is not None:
+            self._write_buffer[os.path.normpath(filename)] = (filename, string)
+            return_code = None
+        else:
+            return_code = self._write_file(filename, string)
         self._is_dirty = True
+        self._dirty_files.add(os.path.normpath(filename))
+        self._file_signatures.pop(filename, None)
+        self._resources = None
+        return return_code
+
+    def _write_file(self, filename, string):
+        """ Write string to filename, see :py:meth:`write`
+
+        Returns:
+
+            Return code as returned by :py:meth:`os.write`
+        """
+        if not self.atomic_writes:
+            return self._write_in_place(filename, string)
+
+        # Replace the file the symlink points to, not the symlink itself
+        if self.islink(filename):
+            filename = os.path.realpath(filename)
+        st = self.stat(filename) if self.exists(filename) else None
+        if st is not None and st.st_nlink > 1:
+            # rename() would split the file from its other hard links
+            return self._write_in_place(filename, string)
+        tmp_file = "%s.%s.tmp" % (filename, os.getpid())
+        try:
+            try:
+                fh = self.open(tmp_file, 'w')
+            except (IOError, OSError) as e:
+                if e.errno in (errno.EACCES, errno.EPERM) and st is not None:
+                    # We may write to the file, but not create files next to it
+                    return self._write_in_place(filename, string)
+                raise
+            try:
+                return_code = fh.write(string)
+                fh.flush()
+                if self.fsync:
+                    os.fsync(fh.fileno())
+            finally:
+                fh.close()
+            # Keep permissions and ownership of the file we are replacing
+            if st is not None:
+                os.chmod(tmp_file, stat.S_IMODE(st.st_mode))
+                try:
+                    os.chown(tmp_file, st.st_uid, st.st_gid)
+                except OSError:
+                    pass
+            os.rename(tmp_file, filename)
+        finally:
+            if self.exists(tmp_file):
+                self.remove(tmp_file)
+        if self.fsync:
+            self._fsync_directory(os.path.dirname(filename))
         return return_code
 
+    def _write_in_place(self, filename, string):
+        """ Truncate filename and write string to it, see :py:meth:`write` """
+        fh = self.open(filename, 'w')
+        try:
+            return_code = fh.write(string)
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+        finally:
+            fh.close()
+        return return_code
+
+    def _fsync_directory(self, dirname):
+        """ Flush a directory to disk so that a rename() in it is durable """
+        try:
+            fd = os.open(dirname or '.', os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def write_behind(self):
+        """ Context manager that holds back writes to configuration files
+
+        Inside the block, :py:meth:`write` only remembers what should be
+        written, and reading a file through :py:meth:`open` returns what was
+        last written to it. When the outermost block ends, every file is
+        written once with its final contents.
+
+        Example::
+
+            with config.write_behind():
+                for host in hosts:
+                    config.item_edit_field(host, 'notes', 'new notes')
+        """
+        if self._write_buffer is not None:
+            yield
+            return
+        self._write_buffer = collections.OrderedDict()
+        try:
+            yield
+        finally:
+            self._flush_write_buffer()
+
+    def _flush_write_buffer(self):
+        """ Write everything held back by :py:meth:`write_behind` to disk
+
+        Line numbers that were known to be right for the buffered contents
+        stay known after the file has been written.
+        """
+        write_buffer = self._write_buffer
+        self._write_buffer = None
+        for filename, string in write_buffer.values():
+            signature = self._file_signatures.get(filename)
+            line_numbers_known = signature is not None and signature == self._get_file_signature(filename)
+            self._write_file(filename, string)
+            if line_numbers_known:
+                self._file_signatures[filename] = self._get_file_signature(filename)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Context manager that batches changes to configuration files
+
+        Inside a transaction item_add(), item_edit_field(), item_remove_field(),
+        item_rename_field(), item_rewrite() and item_remove() do not touch
+        the disk, they only queue up changes. When the outermost transaction
+        ends, every affected file is read, parsed and written exactly once.
+        Other calls to :py:meth:`write` are held back like in
+        :py:meth:`write_behind`.
+
+        If an exception is raised inside the transaction, all queued changes
+        are discarded.
+
+        Example::
+
+            with config.transaction():
+                for service in services:
+                    config.item_edit_field(service, 'notes', 'bulk update')
+        """
+        self.begin_transaction()
+        try:
+            yield self
+        except Exception:
+            self.rollback_transaction()
+            raise
+        self.commit_transaction()
+
+    def begin_transaction(self):
+        """ Start queuing up changes to configuration files. See :py:meth:`transaction`
+
+        Transactions can be nested, changes are only written when the
+        outermost transaction is committed. The transaction holds
+        self.lock until it is committed or rolled back.
+        """
+        self.lock.acquire()
+        if self._transaction_depth == 0 and self._write_buffer is None:
+            self._write_buffer = collections.OrderedDict()
+            self._transaction_owns_write_buffer = True
+        self._transaction_depth += 1
+
+    def commit_transaction(self):
+        """ Write all changes queued since :py:meth:`begin_transaction`
+
+        Raises:
+
+            :py:class:`ParserError` if no transaction is in progress
+
+            :py:class:`ValueError` if an object to modify is not found
+
+            :py:class:`IOError` if save fails
+        """
+        if self._transaction_depth < 1:
+            raise ParserError("commit_transaction() called without a transaction in progress")
+        try:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                operations = self._transaction_operations
+                self._transaction_operations = []
+                try:
+                    self._apply_operations(operations)
+                finally:
+                    if self._transaction_owns_write_buffer:
+                        self._transaction_owns_write_buffer = False
+                        self._flush_write_buffer()
+        finally:
+            self.lock.release()
+
+    def rollback_transaction(self):
+        """ Discard all changes queued since the outermost :py:meth:`begin_transaction`
+
+        Raises:
+
+            :py:class:`ParserError` if no transaction is in progress
+        """
+        if self._transaction_depth < 1:
+            raise ParserError("rollback_transaction() called without a transaction in progress")
+        self._transaction_depth -= 1
+        self._transaction_operations = []
+        if self._transaction_owns_write_buffer:
+            if self._transaction_depth == 0:
+                self._transaction_owns_write_buffer = False
+                self._write_buffer = None
+            else:
+                self._write_buffer = collections.OrderedDict()
+        self.lock.release()
+
+    def _apply_operations(self, operations):
+        """ Apply changes queued up by a transaction, writing each file once
+
+        Every file is changed in memory before anything is written, so that
+        an object that can not be found does not leave us with half of
+        the files written.
+
+        Args:
+
+            operations: list of (filename, operation) as queued by
+            :py:meth:`_modify_object` and :py:meth:`item_add`
+        """
+        files = {}
+        order = []
+        for filename, operation in operations:
+            key = os.path.normpath(filename)
+            if key not in files:
+                files[key] = (filename, [])
+                order.append(key)
+            files[key][1].append(operation)
+
+        new_contents = []
+        for key in order:
+            filename, file_operations = files[key]
+            new_contents.append((filename, self._apply_file_operations(filename, file_operations)))
+
+        for filename, string in new_contents:
+            # Create directory if it does not already exist
+            dirname = os.path.dirname(filename)
+            if not self.isdir(dirname):
+                os.makedirs(dirname)
+            self.write(filename, string)
+
+    def _apply_file_operations(self, filename, operations):
+        """ Apply queued changes to one file and return its new contents
+
+        The file is read and parsed once, and split into chunks of lines that
+        each contain either one object definition or anything in between.
+        Every change is applied to the chunk of the object it refers to,
+        and only that chunk is parsed again.
+
+        Args:
+
+            filename: File to change
+
+            operations: list of operations queued for filename
+
+        Returns:
+
+            The new contents of filename as a string
+
+        Raises:
+
+            :py:class:`ValueError` if an object to modify is not found
+        """
+        if self.isfile(filename):
+            fh = self.open(filename)
+            lines = fh.readlines()
+            fh.close()
+        else:
+            lines = []
+
+        index = {}
+        segments = self._split_definitions(lines, filename, index)
+        for operation in operations:
+            if operation['action'] == 'add':
+                position = (len(segments),)
+                lines = operation['string'].splitlines(True)
+                segments.append({'lines': None, 'key': None, 'position': position,
+                                 'children': self._split_definitions(lines, filename, index, position)})
+                continue
+
+            # Look for the first object in the file that matches our item
+            key = operation['key']
+            candidates = [x for x in index.get(key, []) if x['key'] == key]
+            if not candidates:
+                raise ValueError("We could not find object in %s\n%s" % (filename, operation['item']))
+            segment = min(candidates, key=lambda x: x['position'])
+            index[key].remove(segment)
+
+            item = operation['item']
+            object_definition = self._clean_backslashes(segment['lines'])
+            object_definition = self._modify_object_definition(
+                item, object_definition, operation['field_name'], operation['new_value'],
+                operation['new_field_name'], operation['new_item'])
+            if operation['make_comments']:
+                everything_before = self._get_previous_lines(segments, segment)
+                self._add_edit_comment(everything_before, object_definition)
+            object_definition = ''.join(object_definition).splitlines(True)
+            children = self._split_definitions(object_definition, filename, index, segment['position'])
+            segment['lines'] = None
+            segment['key'] = None
+            segment['children'] = children
+
+        result = []
+        self._flatten_segments(segments, result)
+        return ''.join(result)
+
+    def _split_definitions(self, lines, filename, index, position=()):
+        """ Split lines into chunks of object definitions and whatever is between them
+
+        Helper function for :py:meth:`_apply_file_operations`
+
+        Args:
+
+            lines: list of lines, as returned by readlines()
+
+            filename: Filename used when parsing lines
+
+            index: dict of compare key -> list of chunks. New chunks are added here.
+
+            position: Position of lines within the file, as a tuple.
+
+        Returns:
+
+            A list of chunks (dicts) with the keys 'lines', 'key', 'position'
+            and 'children'.
+        """
+        if position:
+            # Lines were changed by us, if they don't parse anymore we just keep them as they are
+            try:
+                items = self.parse_string(''.join(lines), filename=filename)
+            except ParserError:
+                items = []
+        else:
+            items = self.parse_string(''.join(lines), filename=filename)
+
+        result = []
+        start = 0
+        for item in items + [None]:
+            if item is None:
+                item_start = item_end = len(lines)
+            else:
+                item_start = item['meta']['line_start'] - 1
+                item_end = item['meta']['line_end']
+            if item_start > start:
+                result.append({'lines': lines[start:item_start], 'key': None,
+                               'position': position + (len(result),), 'children': None})
+            if item is None:
+                break
+            key = self._get_compare_key(item)
+            segment = {'lines': lines[item_start:item_end], 'key': key,
+                       'position': position + (len(result),), 'children': None}
+            if key not in index:
+                index[key] = []
+            index[key].append(segment)
+            result.append(segment)
+            start = item_end
+        return result
+
+    def _flatten_segments(self, segments, result):
+        """ Appends all lines from a list of nested chunks to result """
+        for segment in segments:
+            if segment['children'] is None:
+                result += segment['lines']
+            else:
+                self._flatten_segments(segment['children'], result)
+
+    def _get_previous_lines(self, segments, segment):
+        """ Returns the lines of the chunk right before segment, or an empty list
+
+        The list is returned by reference, so it can be changed in place.
+        """
+        flat = []
+
+        def walk(segments):
+            for x in segments:
+                if x['children'] is None:
+                    flat.append(x)
+                else:
+                    walk(x['children'])
+        walk(segments)
+        everything_before = []
+        for x in flat:
+            if x is segment:
+                break
+            if x['lines']:
+                everything_before = x['lines']
+        return everything_before
+
+    def _get_compare_key(self, item):
+        """ Returns a hashable key that is equal for items that compareObjects() considers equal
+
+        Args:
+
+            item: Item to create a key for
+
+        Returns:
+
+            tuple of (attribute, value) pairs, sorted by attribute
+        """
+        result = []
+        for key in item['meta']['defined_attributes']:
+            if key == 'meta':
+                continue
+            value = item[key]
+            # For our purpose, 30 is equal to 30.000
+            if key == 'check_interval':
+                try:
+                    value = int(float(value))
+                except ValueError:
+                    pass
+            result.append((key, str(value)))
+        result.sort()
+        return tuple(result)
+
     def item_rewrite(self, item, str_new_item):
         """ Completely rewrites item with string provided.
 
@@ -918,15 +1890,26 @@ class Config(object):
             item['meta'] = {}
         item['meta']['filename'] = filename
 
+        str_buffer = self.print_conf(item)
+        if self._transaction_depth > 0:
+            self._transaction_operations.append((filename, {'action': 'add', 'string': str_buffer}))
+            return True
+
         # Create directory if it does not already exist
         dirname = os.path.dirname(filename)
         if not self.isdir(dirname):
             os.makedirs(dirname)
 
-        str_buffer = self.print_conf(item)
+        # Appending does not move other objects around
+        signature = self._file_signatures.get(filename)
+        line_numbers_known = signature is not None and signature == self._get_file_signature(filename)
+
         fh = self.open(filename, 'a')
         fh.write(str_buffer)
         fh.close()
+        if line_numbers_known:
+            self._file_signatures[filename] = self._get_file_signature(filename)
+        self._dirty_files.add(os.path.normpath(filename))
         return True
 
     def edit_object(self, item, field_name, new_value):
@@ -1163,8 +2146,14 @@ class Config(object):
 
         """
         object_key = self._get_key(object_type, user_key)
+        item = self._get_lookup_index(object_type, object_key).get(object_name)
+        if item is not None and item.get(object_key, None) == object_name:
+            return item
+
+        # Not in the index, or the item changed, maybe an item was renamed after our index was built
         for item in self.data['all_%s' % object_type]:
             if item.get(object_key, None) == object_name:
+                self._lookup_indexes.pop((object_type, object_key), None)
                 return item
         return None
 
@@ -1338,8 +2327,15 @@ class Config(object):
             The item found to match all the criterias.
 
         """
+        key = ('host_name', 'service_description')
+        item = self._get_lookup_index('service', key).get((target_host, service_description))
+        if item is not None and (item.get('host_name'), item.get('service_description')) == (target_host, service_description):
+            return item
+
+        # Not in the index, or the item changed, maybe an item was renamed after our index was built
         for item in self.data['all_service']:
             if item.get('service_description') == service_description and item.get('host_name') == target_host:
+                self._lookup_indexes.pop(('service', key), None)
                 return item
         return None
 
@@ -1390,17 +2386,16 @@ class Config(object):
 
         """
         self.item_list = None
-        self.item_apply_cache = {}  # This is performance tweak used by _apply_template
+        self.item_apply_cache = {}  # Flattened template attributes, used by _apply_template
         for raw_item in self.pre_object_list:
-            # Performance tweak, make sure hashmap exists for this object_type
-            object_type = raw_item['meta']['object_type']
-            if not object_type in self.item_apply_cache:
-                self.item_apply_cache[object_type] = {}
-                # Tweak ends
             if "use" in raw_item:
                 raw_item = self._apply_template(raw_item)
             self.post_object_list.append(raw_item)
-            # Add the items to the class lists.
+        self._build_data()
+
+    def _build_data(self):
+        """ Fills the all_object item lists in self.data from self.post_object_list """
+        self.data = {}
         for list_item in self.post_object_list:
             type_list_name = "all_%s" % list_item['meta']['object_type']
             if not type_list_name in self.data:
@@ -1408,40 +2403,117 @@ class Config(object):
 
             self.data[type_list_name].append(list_item)
 
+        # Build lookup indexes for the most common queries up front
+        self._lookup_indexes = {}
+        for object_type, key in six.iteritems(self.object_type_keys):
+            if 'all_%s' % object_type in self.data:
+                self._get_lookup_index(object_type, key)
+        if 'all_service' in self.data:
+            self._get_lookup_index('service', ('host_name', 'service_description'))
+
+    def _get_lookup_index(self, object_type, key):
+        """ Returns a dict that maps values of key to items of object_type
+
+        Indexes are built on demand and rebuilt whenever the list in
+        self.data['all_<object_type>'] has been replaced or has changed size.
+        Items can also be changed in place, so callers must check that the
+        item they find still matches, and fall back to a linear search
+        when nothing is found.
+        If more than one item has the same value, the first one wins, just
+        like a linear search through self.data would.
+
+        Args:
+
+            object_type: Object type to index (i.e. 'host')
+
+            key: Attribute to index on (i.e. 'host_name'), or a tuple of
+            attributes for a compound index.
+
+        Returns:
+
+            dict of value -> item. For compound keys the value is a tuple.
+
+        Raises:
+
+            :py:class:`KeyError` if there are no objects of object_type
+        """
+        items = self.data['all_%s' % object_type]
+        index = self._lookup_indexes.get((object_type, key))
+        if index is None or index[0] is not items or index[1] != len(items):
+            lookup = {}
+            for item in items:
+                if isinstance(key, tuple):
+                    value = tuple(item.get(x) for x in key)
+                else:
+                    value = item.get(key)
+                if value not in lookup:
+                    lookup[value] = item
+            index = (items, len(items), lookup)
+            self._lookup_indexes[(object_type, key)] = index
+        return index[2]
+
+    def _copy_without_templates(self, item):
+        """ Returns a copy of item, stripped of every attribute it inherited via 'use'
+
+        Used by incremental parsing when templates of an item have changed. A
+        new dict is created so that anyone holding on to the old item (for
+        example pynag.Model) can tell that it has changed.
+
+        Args:
+
+            item: Item (dict) as returned by :py:meth:`_post_parse`
+
+        Returns:
+
+            A new item with only its own attributes, ready for
+            :py:meth:`_apply_template`
+        """
+        meta = item['meta'].copy()
+        meta['defined_attributes'] = meta['defined_attributes'].copy()
+        meta['inherited_attributes'] = {}
+        meta['template_fields'] = []
+        new_item = {'meta': meta}
+        template_fields = item['meta']['template_fields']
+        for k, v in six.iteritems(item):
+            if k != 'meta' and k not in template_fields:
+                new_item[k] = v
+        return new_item
+
     def commit(self):
-        """ Write any changes that have been made to it's appropriate file """
-        # Loops through ALL items
+        """ Write any changes that have been made to it's appropriate file
+
+        Every file that contains at least one item that needs commit is
+        rewritten once, with all the items from self.data that belong to it.
+        """
+        # Find the last item that needs commit in every file
+        files_to_commit = {}
         for k in self.data.keys():
             for item in self[k]:
-
-                # If the object needs committing, commit it!
                 if item['meta']['needs_commit']:
-                    # Create file contents as an empty string
-                    file_contents = ""
-
-                    # find any other items that may share this config file
-                    extra_items = self._get_items_in_file(item['meta']['filename'])
-                    if len(extra_items) > 0:
-                        for commit_item in extra_items:
-                            # Ignore files that are already set to be deleted:w
-                            if commit_item['meta']['delete_me']:
-                                continue
-                                # Make sure we aren't adding this thing twice
-                            if item != commit_item:
-                                file_contents += self.print_conf(commit_item)
-
-                    # This is the actual item that needs commiting
-                    if not item['meta']['delete_me']:
-                        file_contents += self.print_conf(item)
-
-                    # Write the file
-                    filename = item['meta']['filename']
-                    self.write(filename, file_contents)
+                    files_to_commit[item['meta']['filename']] = item
+
+        file_index = self._get_file_index()
+        for filename, item in six.iteritems(files_to_commit):
+            file_contents = []
+
+            items_in_file = file_index.get(filename, [])
+            for commit_item in items_in_file:
+                # Ignore files that are already set to be deleted
+                if commit_item['meta']['delete_me']:
+                    continue
+                # Make sure we aren't adding this thing twice
+                if item != commit_item:
+                    file_contents.append(self.print_conf(commit_item))
+
+            # This is the actual item that needs commiting
+            if not item['meta']['delete_me']:
+                file_contents.append(self.print_conf(item))
 
-                    # Recreate the item entry without the commit flag
-                    self.data[k].remove(item)
-                    item['meta']['needs_commit'] = None
-                    self.data[k].append(item)
+            for commit_item in items_in_file:
+                commit_item['meta']['needs_commit'] = None
+
+            # Write the file
+            self.write(filename, ''.join(file_contents))
 
     def flag_all_commit(self):
         """ Flag every item in the configuration to be committed
@@ -1642,16 +2714,22 @@ class Config(object):
         if self._is_dirty is True:
             return True
 
+        watcher = self._watcher
+        if watcher is not None:
+            if not watcher.has_changed():
+                return False
+            # Forget about the change before looking, so none are lost while we look
+            watcher.reset()
+
         # If we get here, we check the timestamps of the configs
         new_timestamps = self.get_timestamps()
-        if len(new_timestamps) != len(self.timestamps):
-            return True
-        for k, v in new_timestamps.items():
-            if self.timestamps.get(k, None) != v:
-                return True
-        return False
+        changed = len(new_timestamps) != len(self.timestamps) or any(
+            self.timestamps.get(k, None) != v for k, v in new_timestamps.items())
+        if changed and watcher is not None:
+            watcher.changed = True
+        return changed
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @pynag.Utils.synchronized(lambda self, *args, **kwargs: self.lock)
     def parse_maincfg(self):
         """ Parses your main configuration (nagios.cfg) and stores it as key/value pairs in self.maincfg_values
 
@@ -1669,7 +2747,7 @@ class Config(object):
 
         self.maincfg_values = self._load_static_file(self.cfg_file)
 
-    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @pynag.Utils.synchronized(lambda self, *args, **kwargs: self.lock)
     def parse(self):
         """ Parse all objects in your nagios configuration
 
@@ -1687,6 +2765,12 @@ class Config(object):
           problems
         """
 
+        if self.incremental and self._parse_incremental():
+            self._save_parse_cache()
+            self._is_dirty = False
+            self._dirty_files = set()
+            return
+
         # reset
         self.reset()
 
@@ -1703,19 +2787,274 @@ class Config(object):
             t, e = sys.exc_info()[:2]
             self.errors.append(str(e))
 
+        self._watch(self.cfg_files)
         self.timestamps = self.get_timestamps()
 
-        # This loads everything into
-        for cfg_file in self.cfg_files:
-            self._load_file(cfg_file)
+        if not self._load_parse_cache():
+            # This loads everything into
+            for cfg_file, items in zip(self.cfg_files, self._parse_files(self.cfg_files)):
+                self._file_items[cfg_file] = items
+                self.pre_object_list += items
 
-        self._post_parse()
+            self._post_parse()
+            self._save_parse_cache()
 
         self._is_dirty = False
+        self._dirty_files = set()
+
+    def _parse_incremental(self):
+        """ Reparse only configuration files that have changed since last parse()
+
+        Items of changed, new and removed files are spliced in and out of
+        self.pre_object_list and self.data. Templates are only re-applied to
+        items from those files, and to items whose 'use' chain touches a
+        template that was defined in one of them.
+
+        Returns:
+
+            True if configuration was successfully reparsed
+
+            False if a full parse is needed. This happens if nothing has been
+            parsed yet, if nagios.cfg itself has changed, if a changed
+            template has the same name as another one, or if there is
+            circular use=.
+        """
+        if not self.data or not self.maincfg_values:
+            return False
+        if os.path.normpath(self.cfg_file) in self._dirty_files:
+            return False
+        if self._circular_use:
+            return False
+        cfg_files = self.get_cfg_files()
+        self._watch(cfg_files)
+        old_timestamps = self.timestamps
+        new_timestamps = self.get_timestamps()
+        if old_timestamps.get(self.cfg_file) != new_timestamps.get(self.cfg_file):
+            return False
+
+        changed_files = []
+        for filename in cfg_files:
+            if filename not in self._file_items:
+                changed_files.append(filename)
+            elif old_timestamps.get(filename) != new_timestamps.get(filename):
+                changed_files.append(filename)
+            elif os.path.normpath(filename) in self._dirty_files:
+                changed_files.append(filename)
+        stale_files = set(changed_files)
+        stale_files.update(set(self._file_items).difference(cfg_files))
+
+        # Parse changed files before touching anything else, so that a
+        # ParserError leaves us with the configuration we had before.
+        new_file_items = dict(zip(changed_files, self._parse_files(changed_files)))
+
+        # Every template defined in a stale file, before or after the change
+        old_templates = self._count_templates(
+            item for filename in stale_files for item in self._file_items.get(filename, []))
+        new_templates = self._count_templates(
+            item for items in new_file_items.values() for item in items)
+        changed_templates = set(old_templates).union(new_templates)
+
+        # Find every unchanged item that inherits from one of those templates
+        children = {}
+        unchanged_templates = {}
+        for filename, items in six.iteritems(self._file_items):
+            if filename in stale_files:
+                continue
+            for item in items:
+                if 'name' in item:
+                    key = (item['meta']['object_type'], item['name'])
+                    unchanged_templates[key] = unchanged_templates.get(key, 0) + 1
+                if 'use' not in item:
+                    continue
+                object_type = item['meta']['object_type']
+                for parent_name in item['use'].split(','):
+                    key = (object_type, parent_name)
+                    if key not in children:
+                        children[key] = []
+                    children[key].append((filename, item))
+
+        # Which one of several templates with the same name is used depends
+        # on the order of every file, so leave those to a full parse
+        for key in changed_templates:
+            count = unchanged_templates.get(key, 0)
+            if count + old_templates.get(key, 0) > 1 or count + new_templates.get(key, 0) > 1:
+                return False
+
+        affected = {}
+        queue = list(changed_templates)
+        while queue:
+            for filename, item in children.pop(queue.pop(), []):
+                if id(item) in affected:
+                    continue
+                affected[id(item)] = (filename, item)
+                if 'name' in item:
+                    queue.append((item['meta']['object_type'], item['name']))
+
+        # Errors from stale items will be rediscovered while we reparse
+        errors = []
+        for error in self.errors:
+            if not isinstance(error, ParserError):
+                continue
+            if error.filename in stale_files:
+                continue
+            if id(getattr(error, 'item', None)) in affected:
+                continue
+            errors.append(error)
+        self.errors = errors
+
+        # Splice new items into our per-file item lists
+        items_to_apply = []
+        replaced = {}
+        for filename, item in affected.values():
+            new_item = self._copy_without_templates(item)
+            replaced[id(item)] = new_item
+            items_to_apply.append(new_item)
+        for filename in set(filename for filename, item in affected.values()):
+            self._file_items[filename] = [replaced.get(id(i), i) for i in self._file_items[filename]]
+        for filename in stale_files:
+            self._file_items.pop(filename, None)
+        for filename, items in six.iteritems(new_file_items):
+            self._file_items[filename] = items
+            items_to_apply += items
+
+        self.cfg_files = cfg_files
+        self.pre_object_list = []
+        for filename in cfg_files:
+            self.pre_object_list += self._file_items[filename]
+
+        self.item_list = None
+        self.item_apply_cache = {}
+        errors = self.errors
+        self.errors = []
+        for item in items_to_apply:
+            if 'use' in item:
+                self._apply_template(item)
+        if self._circular_use:
+            # Items outside the cycle may depend on where it was entered
+            return False
+
+        # Templates from unchanged files that were resolved again have
+        # reported their errors again
+        resolved = set()
+        for object_type, templates in six.iteritems(self.item_apply_cache):
+            for name in templates:
+                resolved.add(id(self._get_item(name, object_type)))
+        errors = [error for error in errors if id(error.item) not in resolved]
+        self.errors = errors + self.errors
+        self.post_object_list = list(self.pre_object_list)
+        self._build_data()
+
+        try:
+            self._resource_values = self.get_resources()
+        except IOError:
+            t, e = sys.exc_info()[:2]
+            self.errors.append(str(e))
+        self.timestamps = new_timestamps
+        return True
+
+    def _get_file_signature(self, filename):
+        """ Returns (mtime, size) of filename, or None if it does not exist """
+        try:
+            st = self.stat(filename)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def _get_parse_cache_header(self):
+        """ Returns a dict describing the current configuration for the parse cache
+
+        A parse cache is only valid if its header is equal to this one. It
+        contains the (mtime, size) of nagios.cfg and every cfg file.
+        """
+        signature = {}
+        for filename in [self.cfg_file] + self.cfg_files:
+            signature[filename] = self._get_file_signature(filename)
+        return {
+            'version': self._parse_cache_version,
+            'pynag_version': pynag.__version__,
+            'cfg_file': self.cfg_file,
+            'strict': self.strict,
+            'cfg_files': self.cfg_files,
+            'signature': signature,
+        }
+
+    def _load_parse_cache(self):
+        """ Load parsed objects from self.cache_file if it is still valid
+
+        self.cfg_files must be populated before this is called.
+
+        Returns:
+
+            True if objects were loaded from cache
+
+            False if there is no cache, or if it is outdated or unreadable
+        """
+        if not self.cache_file or self._dirty_files:
+            return False
+        if not self.isfile(self.cache_file):
+            return False
+        try:
+            fh = self.open(self.cache_file, 'rb')
+            try:
+                header = self._get_parse_cache_header()
+                if pickle.load(fh) != header:
+                    return False
+                snapshot = pickle.load(fh)
+            finally:
+                fh.close()
+            file_items = snapshot['file_items']
+            pre_object_list = snapshot['pre_object_list']
+            post_object_list = snapshot['post_object_list']
+            errors = snapshot['errors']
+            circular_use = snapshot['circular_use']
+        except Exception:
+            # Corrupt or incompatible cache, just parse everything
+            return False
+        self._file_items = file_items
+        self._file_signatures = header['signature']
+        self.pre_object_list = pre_object_list
+        self.post_object_list = post_object_list
+        self.errors += errors
+        self._circular_use = circular_use
+        self.item_list = None
+        self.item_apply_cache = {}
+        self._build_data()
+        return True
+
+    def _save_parse_cache(self):
+        """ Write a snapshot of parsed objects to self.cache_file
+
+        The snapshot is written to a temporary file which is then renamed, so
+        that concurrent readers never see a half written cache. Failures
+        are silently ignored, the cache is only an optimization.
+        """
+        if not self.cache_file:
+            return
+        snapshot = {
+            'file_items': self._file_items,
+            'pre_object_list': self.pre_object_list,
+            'post_object_list': self.post_object_list,
+            'errors': [x for x in self.errors if isinstance(x, ParserError)],
+            'circular_use': self._circular_use,
+        }
+        tmp_file = "%s.%s.tmp" % (self.cache_file, os.getpid())
+        try:
+            fh = self.open(tmp_file, 'wb')
+            try:
+                pickle.dump(self._get_parse_cache_header(), fh, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(snapshot, fh, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            os.rename(tmp_file, self.cache_file)
+        except Exception:
+            if self.exists(tmp_file):
+                self.remove(tmp_file)
 
     def get_resource(self, resource_name):
         """ Get a single resource value which can be located in any resource.cfg file
 
+        Values are read once, and read again when a resource file changes.
+
          Arguments:
 
             resource_name: Name as it appears in resource file (i.e. $USER1$)
@@ -1732,20 +3071,38 @@ class Config(object):
             permissions
 
         """
-        resources = self.get_resources()
-        for k, v in resources:
-            if k == resource_name:
-                return v
+        signature = [
+            (v, self._get_file_signature(v)) for k, v in self.maincfg_values if k == 'resource_file'
+        ]
+        resources = self._resources
+        if resources is None or resources[0] != signature:
+            values = {}
+            for k, v in self.get_resources():
+                values.setdefault(k, v)
+            resources = self._resources = (signature, values)
+        return resources[1].get(resource_name)
+
+    def _get_timestamp_files(self, cfg_files=None):
+        """ Returns a list of every file that get_timestamps() looks at """
+        files = [self.cfg_file]
+        for k, v in self.maincfg_values:
+            if k in ('resource_file', 'lock_file', 'object_cache_file'):
+                files.append(v)
+        if cfg_files is None:
+            cfg_files = self.get_cfg_files()
+        return files + cfg_files
+
+    def _watch(self, cfg_files):
+        """ Let the watcher know which files to watch, before their timestamps are read """
+        if self._watcher is not None:
+            files = self._get_timestamp_files(cfg_files)
+            # get_cfg_files() leaves out cfg_file that do not exist yet
+            files += [self.abspath(v) for k, v in self.maincfg_values if k == 'cfg_file']
+            self._watcher.watch(files, self._get_watched_cfg_dirs())
 
     def get_timestamps(self):
         """ Returns hash map of all nagios related files and their timestamps"""
-        files = {}
-        files[self.cfg_file] = None
-        for k, v in self.maincfg_values:
-            if k in ('resource_file', 'lock_file', 'object_cache_file'):
-                files[v] = None
-        for i in self.get_cfg_files():
-            files[i] = None
+        files = dict.fromkeys(self._get_timestamp_files())
         # Now lets lets get timestamp of every file
         for k, v in files.items():
             if not self.isfile(k):
@@ -1802,71 +3159,54 @@ class Config(object):
         """ This parse is used after the initial parse() command is run.
 
         It is only needed if you want extended meta information about hosts or other objects
+
+        Every host gets meta['hostgroup_list'] and meta['service_list'], and
+        every service gets meta['service_members']. Hosts and services are
+        matched through dicts keyed by host_name, so this takes time in
+        proportion to the size of the configuration.
         """
         # Do the initial parsing
         self.parse()
 
-        # First, cycle through the hosts, and append hostgroup information
-        index = 0
-        for host in self.data['all_host']:
-            if host.get("register", None) == "0":
+        # Hosts of every service, and descriptions of services on every host
+        host_services = {}
+        for service in self.data['all_service']:
+            # Find a list of hosts to negate from the final list
+            active_hosts = self._get_active_hosts(service)
+            service['meta']['service_members'] = active_hosts
+            if service.get("register", None) == "0":
+                continue
+            if not "service_description" in service:
                 continue
+            for host_name in set(active_hosts):
+                host_services.setdefault(host_name, []).append(service['service_description'])
+
+        # Cycle through the hosts, and append hostgroup and service information
+        hosts_by_name = {}
+        for host in self.data['all_host']:
             if not "host_name" in host:
                 continue
-            if not "hostgroup_list" in self.data['all_host'][index]['meta']:
-                self.data['all_host'][index]['meta']['hostgroup_list'] = []
+            hosts_by_name.setdefault(host['host_name'], []).append(host)
+            if host.get("register", None) == "0":
+                continue
+            hostgroup_list = host['meta'].setdefault('hostgroup_list', [])
 
             # Append any hostgroups that are directly listed in the host definition
             if "hostgroups" in host:
                 for hostgroup_name in self._get_list(host, 'hostgroups'):
-                    if not "hostgroup_list" in self.data['all_host'][index]['meta']:
-                        self.data['all_host'][index]['meta']['hostgroup_list'] = []
-                    if hostgroup_name not in self.data['all_host'][index]['meta']['hostgroup_list']:
-                        self.data['all_host'][index]['meta']['hostgroup_list'].append(hostgroup_name)
+                    if hostgroup_name not in hostgroup_list:
+                        hostgroup_list.append(hostgroup_name)
 
             # Append any services which reference this host
-            service_list = []
-            for service in self.data['all_service']:
-                if service.get("register", None) == "0":
-                    continue
-                if not "service_description" in service:
-                    continue
-                if host['host_name'] in self._get_active_hosts(service):
-                    service_list.append(service['service_description'])
-            self.data['all_host'][index]['meta']['service_list'] = service_list
-
-            # Increment count
-            index += 1
+            host['meta']['service_list'] = list(host_services.get(host['host_name'], ()))
 
         # Loop through all hostgroups, appending them to their respective hosts
         for hostgroup in self.data['all_hostgroup']:
             for member in self._get_list(hostgroup, 'members'):
-                index = 0
-                for host in self.data['all_host']:
-                    if not "host_name" in host:
-                        continue
-
-                    # Skip members that do not match
-                    if host['host_name'] == member:
-
-                        # Create the meta var if it doesn' exist
-                        if not "hostgroup_list" in self.data['all_host'][index]['meta']:
-                            self.data['all_host'][index]['meta']['hostgroup_list'] = []
-
-                        if hostgroup['hostgroup_name'] not in self.data['all_host'][index]['meta']['hostgroup_list']:
-                            self.data['all_host'][index]['meta']['hostgroup_list'].append(hostgroup['hostgroup_name'])
-
-                    # Increment count
-                    index += 1
-
-        # Expand service membership
-        index = 0
-        for service in self.data['all_service']:
-            # Find a list of hosts to negate from the final list
-            self.data['all_service'][index]['meta']['service_members'] = self._get_active_hosts(service)
-
-            # Increment count
-            index += 1
+                for host in hosts_by_name.get(member, ()):
+                    hostgroup_list = host['meta'].setdefault('hostgroup_list', [])
+                    if hostgroup['hostgroup_name'] not in hostgroup_list:
+                        hostgroup_list.append(hostgroup['hostgroup_name'])
 
     def _get_active_hosts(self, item):
         """ Given an object, return a list of active hosts.
@@ -1882,20 +3222,20 @@ class Config(object):
             List of all the active hosts for `item`
         """
         # First, generate the negation list
-        negate_hosts = []
+        negate_hosts = set()
 
         # Hostgroups
         if "hostgroup_name" in item:
             for hostgroup_name in self._get_list(item, 'hostgroup_name'):
                 if hostgroup_name[0] == "!":
                     hostgroup_obj = self.get_hostgroup(hostgroup_name[1:])
-                    negate_hosts.extend(self._get_list(hostgroup_obj, 'members'))
+                    negate_hosts.update(self._get_list(hostgroup_obj, 'members'))
 
         # Host Names
         if "host_name" in item:
             for host_name in self._get_list(item, 'host_name'):
                 if host_name[0] == "!":
-                    negate_hosts.append(host_name[1:])
+                    negate_hosts.add(host_name[1:])
 
         # Now get hosts that are actually listed
         active_hosts = []
@@ -1913,12 +3253,7 @@ class Config(object):
                     active_hosts.append(host_name)
 
         # Combine the lists
-        return_hosts = []
-        for active_host in active_hosts:
-            if active_host not in negate_hosts:
-                return_hosts.append(active_host)
-
-        return return_hosts
+        return [i for i in active_hosts if i not in negate_hosts]
 
     def get_cfg_dirs(self):
         """ Parses the main config file for configuration directories
@@ -1969,6 +3304,7 @@ class Config(object):
                 config_value = self.abspath(config_value)
                 directories = []
                 raw_file_list = []
+                seen = set()
                 directories.append(config_value)
                 # Walk through every subdirectory and add to our list
                 while directories:
@@ -1983,7 +3319,8 @@ class Config(object):
                             item = os.readlink(item)
                         if self.isdir(item):
                             directories.append(item)
-                        if raw_file_list.count(item) < 1:
+                        if item not in seen:
+                            seen.add(item)
                             raw_file_list.append(item)
                 for raw_file in raw_file_list:
                     if raw_file.endswith('.cfg'):
@@ -1993,6 +3330,36 @@ class Config(object):
 
         return cfg_files
 
+    def _get_watched_cfg_dirs(self):
+        """ Return a list of every cfg_dir directory, and every directory below them
+
+        Returns:
+
+            List of directories where new cfg files would be picked up by get_cfg_files()
+        """
+        result = []
+        seen = set()
+        for config_object, config_value in self.maincfg_values:
+            if config_object != "cfg_dir":
+                continue
+            directories = [self.abspath(config_value)]
+            while directories:
+                current_directory = directories.pop(0)
+                if current_directory in seen:
+                    continue
+                seen.add(current_directory)
+                # A cfg_dir that does not exist yet is watched too, in case it is created
+                result.append(current_directory)
+                if not self.isdir(current_directory):
+                    continue
+                for item in self.listdir(current_directory):
+                    item = os.path.join(current_directory, item.strip())
+                    if self.islink(item):
+                        item = os.path.join(current_directory, os.readlink(item))
+                    if self.isdir(item):
+                        directories.append(item)
+        return result
+
     def abspath(self, path):
         """ Return the absolute path of a given relative path.
 
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Module for noticing changes to configuration files without stat()ing all of them.
+
+:py:class:`pynag.Parsers.config_parser.Config` uses a watcher to answer
+needs_reparse() cheaply. A watcher only says whether files *may* have
+changed. When it does, Config compares timestamps of every file as usual.
+"""
+
+from __future__ import absolute_import
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+import time
+
+import six
+
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class PollingWatcher(object):
+
+    """ Says that files may have changed at most once every interval seconds
+
+    Changes are noticed up to interval seconds late, but needs_reparse()
+    does not stat() anything in between.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.changed = False
+        self._checked = time.time()
+
+    def watch(self, files, directories):
+        """ Start watching files, and directories for new files. Forgets earlier changes. """
+        self.reset()
+
+    def reset(self):
+        """ Forget earlier changes, called after files were found to be unchanged """
+        self.changed = False
+        self._checked = time.time()
+
+    def has_changed(self):
+        """ Returns True if files may have changed since last watch() or reset() """
+        return self.changed or time.time() - self._checked >= self.interval
+
+    def close(self):
+        """ Release any resources held by the watcher """
+
+
+class InotifyWatcher(PollingWatcher):
+
+    """ Notices changes with the Linux inotify API
+
+    Directories that contain the watched files are watched, so files that
+    are replaced with rename() are noticed too. Changes to other files in
+    those directories are ignored, except for new .cfg files in cfg_dir
+    directories. Symbolic links are watched together with the files they
+    point to.
+
+    Directories that can not be watched, because they do not exist yet or
+    we are out of watches, are tried again on every reset(). Until then
+    the files in them are compared with os.stat() on every has_changed().
+
+    Raises:
+
+        OSError if inotify is not available
+    """
+
+    def __init__(self):
+        super(InotifyWatcher, self).__init__(interval=None)
+        libc = _get_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.files = set()
+        self.directories = set()  # cfg_dir directories, where new .cfg files matter
+        self._watches = {}  # watch descriptor -> directories, more than one if they are the same inode
+        self._descriptors = {}  # directory -> watch descriptor
+        self._unwatched = set()  # directories that could not be watched
+        self._signatures = {}  # path -> _get_signature(path), for files and directories that are not watched
+
+    def watch(self, files, directories):
+        """ Start watching files, and directories for new files. Forgets earlier changes. """
+        self.files = set()
+        for filename in files:
+            filename = os.path.normpath(filename)
+            self.files.add(filename)
+            self.files.add(os.path.realpath(filename))
+        self.directories = set()
+        for directory in directories:
+            directory = os.path.normpath(directory)
+            self.directories.add(directory)
+            self.directories.add(os.path.realpath(directory))
+        wanted = set(os.path.dirname(i) for i in self.files).union(self.directories)
+        for directory in set(self._descriptors).difference(wanted):
+            self._remove_watch(directory)
+        self._unwatched = wanted.difference(self._descriptors)
+        self.reset()
+
+    def reset(self):
+        """ Forget earlier changes, called after files were found to be unchanged """
+        self._read_events()
+        self.changed = False
+        for directory in list(self._unwatched):
+            if self._add_watch(directory):
+                self._unwatched.discard(directory)
+        self._signatures = dict((i, _get_signature(i)) for i in self._get_unwatched_paths())
+
+    def has_changed(self):
+        """ Returns True if files may have changed since last watch() or reset() """
+        if not self.changed:
+            self._read_events()
+        if not self.changed:
+            for path, signature in self._signatures.items():
+                if _get_signature(path) != signature:
+                    self.changed = True
+                    break
+        return self.changed
+
+    def _get_unwatched_paths(self):
+        """ Returns every file or directory that has to be compared with os.stat() """
+        if not self._unwatched:
+            return []
+        paths = list(self._unwatched)
+        paths += [i for i in self.files if os.path.dirname(i) in self._unwatched]
+        return paths
+
+    def _add_watch(self, directory):
+        """ Start watching directory, returns False if that is not possible """
+        path = directory.encode(sys.getfilesystemencoding()) if isinstance(directory, six.text_type) else directory
+        wd = self._libc.inotify_add_watch(self._fd, path, _WATCH_MASK)
+        if wd < 0:
+            return False
+        self._watches.setdefault(wd, set()).add(directory)
+        self._descriptors[directory] = wd
+        return True
+
+    def _remove_watch(self, directory):
+        """ Stop watching directory """
+        wd = self._descriptors.pop(directory)
+        directories = self._watches.get(wd, set())
+        directories.discard(directory)
+        if not directories:
+            self._watches.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self):
+        """ Read every pending event, and set self.changed if any of them is relevant """
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError:
+                if sys.exc_info()[1].errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if not data:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_IGNORED:
+                    # The directory is gone, try to watch it again on reset()
+                    for directory in self._watches.pop(wd, ()):
+                        self._descriptors.pop(directory, None)
+                        self._unwatched.add(directory)
+                if not self.changed and self._is_relevant(wd, mask, name):
+                    self.changed = True
+
+    def _is_relevant(self, wd, mask, name):
+        """ Returns True if an event could mean that configuration has changed """
+        if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            return True
+        for directory in self._watches.get(wd, ()):
+            if isinstance(directory, bytes):
+                filename = os.path.join(directory, name)
+            else:
+                filename = os.path.join(directory, name.decode(sys.getfilesystemencoding(), 'replace'))
+            if filename in self.files:
+                return True
+            if directory in self.directories and (mask & IN_ISDIR or filename.endswith('.cfg')):
+                return True
+        return False
+
+    def close(self):
+        """ Release the inotify file descriptor """
+        if self._fd is not None and self._fd >= 0:
+            os.close(self._fd)
+        self._fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _get_signature(path):
+    """ Returns what os.stat() says about path that changes when it is modified, or None if it does not exist """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+_libc = []
+
+
+def _get_libc():
+    """ Returns libc with inotify functions, or None if it does not have them """
+    if not _libc:
+        libc = None
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1.argtypes = [ctypes.c_int]
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            except (OSError, AttributeError):
+                libc = None
+        _libc.append(libc)
+    return _libc[0]
+
+
+def get_watcher(kind, poll_interval=1.0):
+    """ Returns a watcher for Config(watch=kind)
+
+    Args:
+
+        kind (str): 'inotify', 'poll', or 'auto' for inotify where it is
+        available and polling elsewhere
+
+        poll_interval (float): seconds between checks of a polling watcher
+
+    Returns:
+
+        InotifyWatcher or PollingWatcher
+
+    Raises:
+
+        ValueError if kind is unknown, OSError if kind is 'inotify' and
+        inotify is not available
+    """
+    if kind not in ('auto', 'inotify', 'poll'):
+        raise ValueError("Unknown watch %r, expected 'auto', 'inotify' or 'poll'" % (kind,))
+    if kind in ('auto', 'inotify'):
+        try:
+            return InotifyWatcher()
+        except OSError:
+            if kind == 'inotify':
+                raise
+    return PollingWatcher(poll_interval)
@@ -446,6 +446,23 @@ def grep(objects, **kwargs):
 
     """
 
+    matching_objects = objects
+    for k, v in grep_search_terms(**kwargs):
+        expression = grep_expression(k, v)
+        matching_objects = list(filter(expression, matching_objects))
+    return matching_objects
+
+
+def grep_search_terms(**kwargs):
+    """ Returns a list of (key, value) searches that grep() does for **kwargs
+
+    Example:
+
+        >>> grep_search_terms(host_name=['a', 'b'])
+        [('host_name', 'a'), ('host_name', 'b')]
+        >>> grep_search_terms(host_name__in=['a', 'b'])
+        [('host_name__in', ['a', 'b'])]
+    """
     # Input comes to us as a key/value dict.
     # We will flatten this out into a tuble, because if value
     # is a list, it means the calling function is doing multible search on
@@ -458,58 +475,73 @@ def grep(objects, **kwargs):
                 search.append((k, i))
         else:
             search.append((k, v))
-    matching_objects = objects
-    for k, v in search:
-        #v = str(v)
-        v_str = str(v)
-        if k.endswith('__contains'):
-            k = k[:-len('__contains')]
-            expression = lambda x: x.get(k) and v_str in str(x.get(k))
-        elif k.endswith('__notcontains'):
-            k = k[:-len('__notcontains')]
-            expression = lambda x: not v_str in str(x.get(k))
-        elif k.endswith('__startswith'):
-            k = k[:-len('__startswith')]
-            expression = lambda x: str(x.get(k)).startswith(v_str)
-        elif k.endswith('__notstartswith'):
-            k = k[:-len('__notstartswith')]
-            expression = lambda x: not str(x.get(k)).startswith(v_str)
-        elif k.endswith('__endswith'):
-            k = k[:-len('__endswith')]
-            expression = lambda x: str(x.get(k)).endswith(v_str)
-        elif k.endswith('__notendswith'):
-            k = k[:-len('__notendswith')]
-            expression = lambda x: not str(x.get(k)).endswith(v_str)
-        elif k.endswith('__exists'):
-            k = k[:-len('__exists')]
-            expression = lambda x: str(k in x) == v_str
-        elif k.endswith('__isnot'):
-            k = k[:-len('__isnot')]
-            expression = lambda x: v_str != str(x.get(k))
-        elif k.endswith('__regex'):
-            k = k[:-len('__regex')]
-            regex = re.compile(str(v))
-            expression = lambda x: regex.search(str(x.get(k)))
-        elif k.endswith('__in'):
-            k = k[:-len('__in')]
-            expression = lambda x: str(x.get(k)) in v
-        elif k.endswith('__notin'):
-            k = k[:-len('__notin')]
-            expression = lambda x: str(x.get(k)) not in v
-        elif k.endswith('__has_field'):
-            k = k[:-len('__has_field')]
-            expression = lambda x: v_str in AttributeList(x.get(k)).fields
-        elif k == 'register' and str(v) == '1':
-            # in case of register attribute None is the same as "1"
-            expression = lambda x: x.get(k) in (v, None)
-        elif k in ('search', 'q'):
-            expression = lambda x: v_str in str(x)
-        else:
-            # If all else fails, assume they are asking for exact match
-            v_is_str = isinstance(v, str)
-            expression = lambda obj: (lambda objval: str(objval) == v_str or (v_is_str and isinstance(objval, list) and v in objval))(obj.get(k))
-        matching_objects = list(filter(expression, matching_objects))
-    return matching_objects
+    return search
+
+
+def grep_expression(k, v):
+    """ Returns a function that tells if one object matches a grep() search
+
+    Arguments:
+
+        k (str): Search key, e.g. 'host_name' or 'host_name__contains'
+
+        v: Search value
+
+    Example:
+
+        >>> expression = grep_expression('host_name__startswith', 'example')
+        >>> expression({'host_name': 'examplehost'})
+        True
+    """
+    #v = str(v)
+    v_str = str(v)
+    if k.endswith('__contains'):
+        k = k[:-len('__contains')]
+        expression = lambda x: x.get(k) and v_str in str(x.get(k))
+    elif k.endswith('__notcontains'):
+        k = k[:-len('__notcontains')]
+        expression = lambda x: not v_str in str(x.get(k))
+    elif k.endswith('__startswith'):
+        k = k[:-len('__startswith')]
+        expression = lambda x: str(x.get(k)).startswith(v_str)
+    elif k.endswith('__notstartswith'):
+        k = k[:-len('__notstartswith')]
+        expression = lambda x: not str(x.get(k)).startswith(v_str)
+    elif k.endswith('__endswith'):
+        k = k[:-len('__endswith')]
+        expression = lambda x: str(x.get(k)).endswith(v_str)
+    elif k.endswith('__notendswith'):
+        k = k[:-len('__notendswith')]
+        expression = lambda x: not str(x.get(k)).endswith(v_str)
+    elif k.endswith('__exists'):
+        k = k[:-len('__exists')]
+        expression = lambda x: str(k in x) == v_str
+    elif k.endswith('__isnot'):
+        k = k[:-len('__isnot')]
+        expression = lambda x: v_str != str(x.get(k))
+    elif k.endswith('__regex'):
+        k = k[:-len('__regex')]
+        regex = re.compile(str(v))
+        expression = lambda x: regex.search(str(x.get(k)))
+    elif k.endswith('__in'):
+        k = k[:-len('__in')]
+        expression = lambda x: str(x.get(k)) in v
+    elif k.endswith('__notin'):
+        k = k[:-len('__notin')]
+        expression = lambda x: str(x.get(k)) not in v
+    elif k.endswith('__has_field'):
+        k = k[:-len('__has_field')]
+        expression = lambda x: v_str in AttributeList(x.get(k)).fields
+    elif k == 'register' and str(v) == '1':
+        # in case of register attribute None is the same as "1"
+        expression = lambda x: x.get(k) in (v, None)
+    elif k in ('search', 'q'):
+        expression = lambda x: v_str in str(x)
+    else:
+        # If all else fails, assume they are asking for exact match
+        v_is_str = isinstance(v, str)
+        expression = lambda obj: (lambda objval: str(objval) == v_str or (v_is_str and isinstance(objval, list) and v in objval))(obj.get(k))
+    return expression
 
 
 def grep_to_livestatus(*args, **kwargs):
@@ -678,6 +710,8 @@ send_nsca = nsca.send_nsca
 cache_only = decorators.cache_only
 rlock = decorators.rlock
 synchronized = decorators.synchronized
+ReadWriteLock = decorators.ReadWriteLock
+shared_lock = decorators.shared_lock
 
 runCommand = run_command
 defaultdict = DefaultDict
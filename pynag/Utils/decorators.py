@@ -2,11 +2,184 @@
 
 from __future__ import absolute_import
 import threading
+import time
+
+from six.moves import _thread
+
+_get_ident = _thread.get_ident
+
+
+class ReadWriteLock(object):
+    """ Reentrant lock that many threads can hold shared, or one thread exclusively
+
+    acquire() and release() take the exclusive lock, with the same
+    arguments as a threading.RLock. The shared lock is available as
+    ``lock.shared``, and is meant for code that only reads. Threads that
+    wait for the exclusive lock go before new shared holders, so readers
+    can not starve writers.
+
+    A thread that holds the exclusive lock can take the shared lock too.
+    A thread that only holds the shared lock can take the exclusive lock,
+    but it lets go of the shared lock while it waits, so that two threads
+    doing that do not wait for each other forever. Other threads may change
+    things in the meantime. Once the exclusive lock is released, the thread
+    holds the shared lock again.
+
+    Example:
+        >>> lock = ReadWriteLock()
+        >>> with lock.shared:
+        ...     with lock.shared:
+        ...         pass
+        >>> with lock:
+        ...     with lock.shared:
+        ...         pass
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # Protects everything below
+        self._condition = threading.Condition(self._lock)
+        self._readers = {}  # thread id -> number of times it holds the shared lock
+        self._writer = None  # thread id that holds the exclusive lock
+        self._writer_count = 0  # number of times the writer holds the exclusive lock
+        self._waiting_writers = 0
+        self._writer_shared = 0  # how many times the writer held the shared lock before it took the exclusive one
+        self.shared = _SharedLock(self)
+
+    def acquire(self, blocking=True, timeout=-1):
+        """ Take the exclusive lock, wait until no other thread holds the lock
+
+        Args:
+
+            blocking: If False, return False at once instead of waiting
+
+            timeout: Seconds to wait at most, -1 waits forever
+
+        Returns:
+
+            True if the lock was taken, False otherwise
+        """
+        me = _get_ident()
+        with self._lock:
+            if self._writer == me:
+                self._writer_count += 1
+                return True
+            # Upgrade from the shared lock by letting go of it first
+            shared_count = self._readers.pop(me, 0)
+            self._waiting_writers += 1
+            try:
+                acquired = self._wait(lambda: self._writer is None and not self._readers, blocking, timeout)
+            finally:
+                self._waiting_writers -= 1
+            if not acquired:
+                if shared_count:
+                    self._wait(lambda: self._writer is None, True, -1)
+                    self._readers[me] = shared_count
+                # Threads that wait for the shared lock may have waited for us
+                self._condition.notify_all()
+                return False
+            self._writer = me
+            self._writer_count = 1
+            self._writer_shared = shared_count
+        return True
+
+    def release(self):
+        """ Release the exclusive lock """
+        with self._lock:
+            if self._writer != _get_ident():
+                raise RuntimeError("Can not release an exclusive lock that is not held")
+            self._writer_count -= 1
+            if self._writer_count == 0:
+                if self._writer_shared:
+                    # Back to the shared lock we had before
+                    self._readers[self._writer] = self._writer_shared
+                    self._writer_shared = 0
+                self._writer = None
+                self._condition.notify_all()
+
+    def acquire_shared(self, blocking=True, timeout=-1):
+        """ Take the shared lock, wait while another thread holds or waits for the exclusive lock
+
+        Takes the same arguments as acquire()
+        """
+        me = _get_ident()
+        with self._lock:
+            readers = self._readers
+            if me in readers:
+                readers[me] += 1
+                return True
+            if self._writer != me:
+                if not self._wait(lambda: self._writer is None and not self._waiting_writers, blocking, timeout):
+                    return False
+            readers[me] = 1
+        return True
+
+    def _wait(self, predicate, blocking, timeout):
+        """ Wait on self._condition until predicate() is true, self._lock must be held
+
+        Returns:
+
+            False if blocking is False or timeout ran out before predicate() became true
+        """
+        if predicate():
+            return True
+        if not blocking:
+            return False
+        if timeout is None or timeout < 0:
+            while not predicate():
+                self._condition.wait()
+            return True
+        deadline = time.time() + timeout
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._condition.wait(remaining)
+        return True
+
+    def release_shared(self):
+        """ Release the shared lock """
+        me = _get_ident()
+        with self._lock:
+            count = self._readers.get(me)
+            if not count:
+                raise RuntimeError("Can not release a shared lock that is not held")
+            if count > 1:
+                self._readers[me] = count - 1
+            else:
+                del self._readers[me]
+                if self._waiting_writers and not self._readers:
+                    self._condition.notify_all()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class _SharedLock(object):
+    """ The shared side of a ReadWriteLock, with the same interface as a lock """
+
+    def __init__(self, lock):
+        self.acquire = lock.acquire_shared
+        self.release = lock.release_shared
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def shared_lock(lock):
+    """ Returns the shared lock of a ReadWriteLock, other locks are returned as they are """
+    return getattr(lock, 'shared', lock)
+
 
 rlock = threading.RLock()
 
 
-def synchronized(lock):
+def synchronized(lock, shared=False):
     """ Synchronization decorator
 
     Use this to make a multi-threaded method synchronized and thread-safe.
@@ -14,14 +187,27 @@ def synchronized(lock):
     Use the decorator like so::
 
         @pynag.Utils.synchronized(pynag.Utils.rlock)
+
+    lock can also be a function, which is called with the same arguments
+    as the decorated function and returns the lock to use, for example
+    a lock that belongs to the instance::
+
+        @pynag.Utils.synchronized(lambda self, *args, **kwargs: self.lock)
+
+    With shared=True, methods that only read take the shared lock of a
+    ReadWriteLock, so they can run at the same time in several threads.
+    Other kinds of locks are taken as usual.
     """
     def wrap(f):
         def newFunction(*args, **kw):
-            lock.acquire()
+            l = lock(*args, **kw) if callable(lock) else lock
+            if shared:
+                l = shared_lock(l)
+            l.acquire()
             try:
                 return f(*args, **kw)
             finally:
-                lock.release()
+                l.release()
         newFunction.__name__ = f.__name__
         newFunction.__module__ = f.__module__
         return newFunction
@@ -0,0 +1,372 @@
+#!/usr/bin/python
+# This is not part of pynag's unit tests. It measures how long some
+# performance sensitive operations take on large generated configurations.
+#
+# Usage: python tests/benchmarks.py [benchmark_name ...]
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+# Make sure we import from working tree
+pynagbase = os.path.dirname(os.path.realpath(__file__ + "/.."))
+sys.path.insert(0, pynagbase)
+
+import pynag.Model
+import pynag.Parsers
+import pynag.Utils
+
+
+def generate_config(hosts=1000, services_per_host=10):
+    """ Returns a string with a nagios configuration of the given size """
+    result = []
+    result.append("# Generated by pynag benchmarks\n")
+    result.append("define host {\n\tname\t\tgeneric-host\n\tregister\t0\n\tmax_check_attempts\t3\n}\n\n")
+    result.append("define service {\n\tname\t\tgeneric-service\n\tregister\t0\n\tmax_check_attempts\t3\n}\n\n")
+    for i in range(hosts):
+        result.append("define host {\n")
+        result.append("\tuse                 generic-host\n")
+        result.append("\thost_name           host%s\n" % i)
+        result.append("\taddress             127.0.0.%s ; inline comment\n" % (i % 255))
+        result.append("\thostgroups          group%s\n" % (i % 10))
+        result.append("}\n\n")
+        for j in range(services_per_host):
+            result.append("define service {\n")
+            result.append("\tuse                 generic-service\n")
+            result.append("\thost_name           host%s\n" % i)
+            result.append("\tservice_description service%s\n" % j)
+            result.append("\tcheck_command       check_dummy!0!$HOSTNAME$\n")
+            result.append("}\n\n")
+    return ''.join(result)
+
+
+def bench(name, function, repeat=3):
+    """ Run function a few times and print the best time """
+    best = min(timeit.repeat(function, number=1, repeat=repeat))
+    print("%-50s %8.3fs" % (name, best))
+    return best
+
+
+def benchmark_parse_string():
+    """ Line based parser vs. the regex tokenizer in Config.parse_string() """
+    config = pynag.Parsers.config(cfg_file='/dev/null')
+    string = generate_config(hosts=2000)
+    assert config._parse_string_lines(string) == config._parse_string_regex(string)
+    objects = len(config.parse_string(string))
+    print("parse_string() on %s objects, %s bytes" % (objects, len(string)))
+    slow = bench("  line based", lambda: config._parse_string_lines(string))
+    fast = bench("  regex tokenizer", lambda: config._parse_string_regex(string))
+    print("  speedup: %.1fx" % (slow / fast))
+
+
+def benchmark_filter():
+    """ Indexed ObjectFetcher.filter() vs. a linear pynag.Utils.grep() """
+    tempdir = tempfile.mkdtemp()
+    try:
+        objects_file = os.path.join(tempdir, 'objects.cfg')
+        cfg_file = os.path.join(tempdir, 'nagios.cfg')
+        with open(objects_file, 'w') as f:
+            f.write(generate_config(hosts=2000))
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_file=%s\n" % objects_file)
+        pynag.Model.cfg_file = cfg_file
+        pynag.Model.config = None
+        services = pynag.Model.Service.objects.all
+        print("filter(host_name=...) on %s services" % len(services))
+        slow = bench("  pynag.Utils.grep", lambda: pynag.Utils.grep(services, host_name='host1000'))
+        bench("  first filter() with index build", lambda: pynag.Model.Service.objects.filter(host_name='host1000'), repeat=1)
+        fast = bench("  filter() with index", lambda: pynag.Model.Service.objects.filter(host_name='host1000'))
+        print("  speedup: %.1fx" % (slow / fast))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def benchmark_memory():
+    """ Memory used by parsed objects and by the Model (needs python 3.4+) """
+    import gc
+    import tracemalloc
+    tempdir = tempfile.mkdtemp()
+    try:
+        objects_file = os.path.join(tempdir, 'objects.cfg')
+        cfg_file = os.path.join(tempdir, 'nagios.cfg')
+        with open(objects_file, 'w') as f:
+            f.write(generate_config(hosts=2000))
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_file=%s\n" % objects_file)
+
+        gc.collect()
+        tracemalloc.start()
+        config = pynag.Parsers.config(cfg_file=cfg_file)
+        config.parse()
+        gc.collect()
+        parsed = tracemalloc.get_traced_memory()[0]
+        objects = len(config.pre_object_list)
+
+        pynag.Model.cfg_file = cfg_file
+        pynag.Model.config = config
+        pynag.Model.ObjectDefinition.objects.reload_cache()
+        gc.collect()
+        model = tracemalloc.get_traced_memory()[0] - parsed
+        tracemalloc.stop()
+
+        print("memory used by %s objects" % objects)
+        print("  %-48s %8.1fMB %6d bytes/object" % ("Parsers.config", parsed / 1e6, parsed / objects))
+        print("  %-48s %8.1fMB %6d bytes/object" % ("Model on top of that", model / 1e6, model / objects))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def benchmark_subgroups():
+    """ RelationGraph vs. ObjectRelations._get_subgroups() on nested hostgroups """
+    shapes = [
+        ("tree of", lambda i: i // 3),
+        ("chain of", lambda i: i - 1),
+    ]
+    for shape, parent in shapes:
+        groups = pynag.Utils.defaultdict(set)
+        hosts = pynag.Utils.defaultdict(set)
+        for i in range(1, 2000):
+            groups['group%s' % parent(i)].add('group%s' % i)
+            hosts['group%s' % i].update('host%s' % j for j in range(i * 10, i * 10 + 10))
+        parents = list(groups)
+
+        def per_group():
+            result = {}
+            for group in parents:
+                members = set(hosts[group])
+                for subgroup in pynag.Model.ObjectRelations._get_subgroups(group, groups):
+                    members.update(hosts[subgroup])
+                result[group] = members
+            return result
+
+        def relation_graph():
+            graph = pynag.Model.RelationGraph(groups)
+            graph.closure()
+            members = graph.propagate(hosts)
+            return dict((group, members[group]) for group in parents)
+
+        assert per_group() == relation_graph()
+        print("subgroups and members of a %s %s hostgroups" % (shape, len(parents)))
+        slow = bench("  _get_subgroups() per group", per_group)
+        fast = bench("  RelationGraph", relation_graph)
+        print("  speedup: %.1fx" % (slow / fast))
+
+
+def benchmark_regex():
+    """ ObjectRelations._expand_regex() with a new RegexMatcher vs. one kept between reloads """
+    pynag.Model.config = pynag.Parsers.config(cfg_file='/dev/null')
+    host_names = ['host%s' % i for i in range(20000)]
+    hostgroup_hosts = dict(('group%s' % i, set(['host%s.*' % i])) for i in range(200))
+    hostgroup_hosts.update(('group%s' % i, set(['host%s.*' % (i % 200)])) for i in range(200, 400))
+    matcher = pynag.Model.RegexMatcher(host_names)
+
+    def expand(matcher=None):
+        dictionary = dict((k, set(v)) for k, v in hostgroup_hosts.items())
+        pynag.Model.ObjectRelations._expand_regex(dictionary, host_names, matcher)
+
+    print("_expand_regex() with %s regex hostgroups over %s hosts" % (len(hostgroup_hosts), len(host_names)))
+    slow = bench("  new RegexMatcher", expand)
+    bench("  first reload with kept RegexMatcher", lambda: expand(matcher), repeat=1)
+    host_names.append('host42new')
+    matcher.update(host_names)
+    fast = bench("  next reloads with kept RegexMatcher", lambda: expand(matcher))
+    print("  speedup: %.1fx" % (slow / fast))
+
+
+def benchmark_needs_reparse():
+    """ Config.needs_reparse() with stat() of every file vs. a watcher """
+    tempdir = tempfile.mkdtemp()
+    try:
+        objects_dir = os.path.join(tempdir, 'objects')
+        os.mkdir(objects_dir)
+        for i in range(500):
+            with open(os.path.join(objects_dir, 'host%s.cfg' % i), 'w') as f:
+                f.write(generate_config(hosts=1, services_per_host=2))
+        cfg_file = os.path.join(tempdir, 'nagios.cfg')
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_dir=%s\n" % objects_dir)
+        print("needs_reparse() x1000 with 500 files in cfg_dir")
+        results = {}
+        for watch in (None, 'poll', 'auto'):
+            config = pynag.Parsers.config(cfg_file=cfg_file, watch=watch)
+            config.parse()
+            assert not config.needs_reparse()
+            results[watch] = bench("  watch=%s" % watch, lambda: [config.needs_reparse() for i in range(1000)])
+        print("  speedup: %.1fx" % (results[None] / results['auto']))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def benchmark_attributes():
+    """ ObjectDefinition attribute access, keys() and grep() with the attribute cache """
+    config = pynag.Parsers.config(cfg_file='/dev/null')
+    items = config.parse_string(generate_config(hosts=1000, services_per_host=5))
+    for item in items:
+        config._apply_template(item)
+    services = [pynag.Model.Service(item=item) for item in items if item['meta']['object_type'] == 'service']
+    keys = ['host_name', 'service_description', 'max_check_attempts', 'register', 'notes']
+
+    def access():
+        for service in services:
+            for key in keys:
+                service[key]
+            service.keys()
+            'notes' in service
+
+    def clear_cache():
+        for service in services:
+            service._attributes = None
+
+    print("5 lookups, keys() and 'in' on %s services" % len(services))
+    slow = bench("  building the cache every time", lambda: (clear_cache(), access()))
+    fast = bench("  cached", access)
+    print("  speedup: %.1fx" % (slow / fast))
+    bench("  grep(host_name=..., max_check_attempts=3)", lambda: pynag.Utils.grep(services, host_name='host10', max_check_attempts='3'))
+
+
+def benchmark_effective_command_line():
+    """ get_effective_command_line() for every service """
+    tempdir = tempfile.mkdtemp()
+    try:
+        objects_file = os.path.join(tempdir, 'objects.cfg')
+        resource_file = os.path.join(tempdir, 'resource.cfg')
+        cfg_file = os.path.join(tempdir, 'nagios.cfg')
+        with open(objects_file, 'w') as f:
+            f.write(generate_config(hosts=2000))
+            f.write("define command {\n\tcommand_name\tcheck_dummy\n")
+            f.write("\tcommand_line\t$USER1$/check_dummy -H $HOSTADDRESS$ -n $HOSTNAME$ $ARG1$ '$ARG2$' '$SERVICEDESC$'\n}\n")
+        with open(resource_file, 'w') as f:
+            f.write("$USER1$=/usr/lib/nagios/plugins\n")
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_file=%s\nresource_file=%s\n" % (objects_file, resource_file))
+        pynag.Model.cfg_file = cfg_file
+        pynag.Model.config = None
+        services = pynag.Model.Service.objects.all
+        print("get_effective_command_line() for %s services" % len(services))
+        bench("  all services", lambda: [i.get_effective_command_line() for i in services])
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def benchmark_command_line_export():
+    """ iter_effective_command_lines() vs. get_effective_command_line() for every service and host """
+    tempdir = tempfile.mkdtemp()
+    try:
+        objects_file = os.path.join(tempdir, 'objects.cfg')
+        cfg_file = os.path.join(tempdir, 'nagios.cfg')
+        with open(objects_file, 'w') as f:
+            f.write(generate_config(hosts=4000, services_per_host=0))
+            for i in range(10):
+                f.write("define hostgroup {\n\thostgroup_name\tgroup%s\n}\n" % i)
+                for j in range(10):
+                    f.write("define service {\n\tuse\tgeneric-service\n\thostgroup_name\tgroup%s\n" % i)
+                    f.write("\tservice_description\tservice%s\n\tcheck_command\tcheck_dummy!%s!$HOSTNAME$\n}\n" % (j, j))
+            f.write("define command {\n\tcommand_name\tcheck_dummy\n")
+            f.write("\tcommand_line\tcheck_dummy -H $HOSTADDRESS$ $ARG1$ '$ARG2$' '$SERVICEDESC$'\n}\n")
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_file=%s\n" % objects_file)
+        pynag.Model.cfg_file = cfg_file
+        pynag.Model.config = None
+
+        def per_object():
+            result = []
+            for service in pynag.Model.Service.objects.all:
+                if not service.is_registered():
+                    continue
+                for host in service.get_effective_hosts():
+                    result.append(service.get_effective_command_line(host_name=host.host_name))
+            return result
+
+        services = len(pynag.Model.Service.objects.all)
+        pairs = len(list(pynag.Model.iter_effective_command_lines()))
+        print("effective command lines of %s services on hostgroups, %s pairs" % (services, pairs))
+        slow = bench("  get_effective_command_line() per host", per_object)
+        fast = bench("  iter_effective_command_lines()", lambda: list(pynag.Model.iter_effective_command_lines()))
+        bench("  iter_effective_command_lines(processes=4)",
+              lambda: list(pynag.Model.iter_effective_command_lines(processes=4)))
+        print("  speedup: %.1fx" % (slow / fast))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def benchmark_host_services():
+    """ Host.get_effective_services() for every host, with services on nested hostgroups """
+    tempdir = tempfile.mkdtemp()
+    try:
+        objects_file = os.path.join(tempdir, 'objects.cfg')
+        cfg_file = os.path.join(tempdir, 'nagios.cfg')
+        with open(objects_file, 'w') as f:
+            f.write(generate_config(hosts=2000, services_per_host=5))
+            # group0 .. group9 are members of all0 and all1, which are members of everything
+            for i in range(10):
+                f.write("define hostgroup {\n\thostgroup_name\tgroup%s\n}\n" % i)
+            for name, members in (('all0', 'group0,group1,group2,group3,group4,group5,group6,group7,group8,group9'),
+                                  ('all1', 'group0,group1,group2,group3,group4,group5,group6,group7,group8,group9'),
+                                  ('everything', 'all0,all1')):
+                f.write("define hostgroup {\n\thostgroup_name\t%s\n\thostgroup_members\t%s\n}\n" % (name, members))
+            for group in ['group%s' % i for i in range(10)] + ['all0', 'all1', 'everything', 'all0,all1']:
+                for j in range(5):
+                    f.write("define service {\n\tuse\tgeneric-service\n\thostgroup_name\t%s\n" % group)
+                    f.write("\tservice_description\t%s_service%s\n}\n" % (group.replace(",", "_"), j))
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_file=%s\n" % objects_file)
+        pynag.Model.cfg_file = cfg_file
+        pynag.Model.config = None
+        hosts = pynag.Model.Host.objects.all
+        services = sum(len(i.get_effective_services()) for i in hosts)
+        print("get_effective_services() for %s hosts, %s services" % (len(hosts), services))
+        bench("  all hosts", lambda: [i.get_effective_services() for i in hosts])
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def benchmark_extended_parse():
+    """ Config.extended_parse() on growing configurations, on top of parse() """
+    for hosts in (1000, 10000, 50000):
+        tempdir = tempfile.mkdtemp()
+        try:
+            objects_file = os.path.join(tempdir, 'objects.cfg')
+            cfg_file = os.path.join(tempdir, 'nagios.cfg')
+            with open(objects_file, 'w') as f:
+                f.write(generate_config(hosts=hosts, services_per_host=2))
+                for i in range(10):
+                    members = ','.join('host%s' % j for j in range(i, hosts, 10))
+                    f.write("define hostgroup {\n\thostgroup_name\tgroup%s\n\tmembers\t%s\n}\n" % (i, members))
+                    f.write("define service {\n\tuse\tgeneric-service\n\thostgroup_name\tgroup%s\n" % i)
+                    f.write("\thost_name\t!host%s\n\tservice_description\tgroup_service\n}\n" % i)
+            with open(cfg_file, 'w') as f:
+                f.write("cfg_file=%s\n" % objects_file)
+            config = pynag.Parsers.config(cfg_file=cfg_file)
+            print("extended_parse() with %s hosts, %s services" % (hosts, hosts * 2 + 10))
+            parse = bench("  parse()", config.parse, repeat=1)
+            extended = bench("  extended_parse()", config.extended_parse, repeat=1)
+            print("  extended metadata: %.3fs" % (extended - parse))
+        finally:
+            shutil.rmtree(tempdir)
+
+
+benchmarks = [
+    benchmark_parse_string,
+    benchmark_filter,
+    benchmark_memory,
+    benchmark_subgroups,
+    benchmark_regex,
+    benchmark_needs_reparse,
+    benchmark_attributes,
+    benchmark_effective_command_line,
+    benchmark_command_line_export,
+    benchmark_host_services,
+    benchmark_extended_parse,
+]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for benchmark in benchmarks:
+        if names and benchmark.__name__ not in names:
+            continue
+        benchmark()
@@ -13,6 +13,8 @@ import os
 import string
 import random
 import mock
+import subprocess
+import threading
 import time
 
 import pynag.Model
@@ -202,6 +204,30 @@ class TestMacroResolving(unittest.TestCase):
         actual_command_line = self.macroservice.get_effective_command_line()
         self.assertEqual(expected_command_line, actual_command_line)
 
+    def test_get_effective_command_line_follows_changes(self):
+        """ Macros are cached per object until its attributes change """
+        command_line = self.macroservice.get_effective_command_line()
+        self.assertEqual(command_line, self.macroservice.get_effective_command_line())
+        self.macrohost.address = 'newaddress'
+        self.macroservice['__macro1'] = 'changed'
+        command_line = self.macroservice.get_effective_command_line()
+        self.assertTrue("-H 'newaddress'" in command_line)
+        self.assertTrue("arg1='changed'" in command_line)
+        self.macroservice.check_command = 'only_arg!$USER1$'
+        self.assertEqual('/path/to/user1', self.macroservice.get_macro('$ARG1$'))
+        self.assertEqual(None, self.environment.config.get_resource('$USER99$'))
+
+    def test_iter_effective_command_lines(self):
+        results = list(pynag.Model.iter_effective_command_lines())
+        macroservice = [i for i in results if i[1] == 'macroservice']
+        expected = [
+            (host_name, 'macroservice', self.macroservice.get_effective_command_line(host_name=host_name))
+            for host_name in ('macrohost', 'macrohost2')
+        ]
+        self.assertEqual(expected, macroservice)
+        self.assertNotEqual(expected[0][2], expected[1][2])
+        self.assertEqual(results, list(pynag.Model.iter_effective_command_lines(processes=2)))
+
     def test_service_get_macro_returns_empty_on_nonexistant_macro(self):
         self.assertEqual('', self.macroservice.get_macro('$INVALID_MACRO$'))
         self.assertEqual('', self.macroservice.get_macro('$HOST_INVALID$'))
@@ -271,6 +297,188 @@ class Model(unittest.TestCase):
         self.assertEqual([group], service2.get_effective_servicegroups())
         self.assertEqual(sorted([service1, service2]), sorted(group.get_effective_services()))
 
+    def test_reload_cache_incremental(self):
+        """ Objects from unchanged files are reused when the cache is reloaded """
+        self.environment.config.incremental = True
+        cfg_file = os.path.join(tests_dir, 'testconfigs/servicegroups.cfg')
+        self.environment.import_config(cfg_file)
+        group = pynag.Model.Servicegroup.objects.get_by_shortname('group-2')
+        service = pynag.Model.Service.objects.get_by_shortname('node-1/cpu')
+
+        host = pynag.Model.Host(host_name='incremental_host', hostgroups='incremental_group')
+        host.save()
+        with mock.patch.object(pynag.Model.ObjectRelations, 'collect', wraps=pynag.Model.ObjectRelations.collect) as collect:
+            host = pynag.Model.Host.objects.get_by_shortname('incremental_host')
+            self.assertEqual(1, collect.call_count)
+        self.assertEqual('incremental_group', host.hostgroups)
+        self.assertTrue(group is pynag.Model.Servicegroup.objects.get_by_shortname('group-2'))
+        self.assertEqual([group], service.get_effective_servicegroups())
+
+        # Relations should be the same as if everything was created from scratch
+        def get_relations():
+            relations = {}
+            for k in pynag.Model.ObjectRelations._context_defaults:
+                v = getattr(pynag.Model.ObjectRelations, k)
+                if isinstance(v, pynag.Model.defaultdict):
+                    relations[k] = dict((key, value) for key, value in v.items() if value)
+            return relations
+        incremental = get_relations()
+        pynag.Model.ObjectFetcher._cached_objects = []
+        pynag.Model.Host.objects.reload_cache()
+        self.assertEqual(get_relations(), incremental)
+        self.assertEqual(set(['incremental_host']), incremental['hostgroup_hosts']['incremental_group'])
+
+    def test_reload_cache_reuses_global_config(self):
+        """ The global config is kept between reloads when it found nagios.cfg by itself """
+        cfg_file = self.environment.config.cfg_file
+        pynag.Model.cfg_file = None
+        pynag.Model.config = None
+        with mock.patch.object(pynag.Parsers.config_parser.Config, 'guess_cfg_file', return_value=cfg_file):
+            pynag.Model.Host.objects.reload_cache()
+        config = pynag.Model.config
+        self.assertEqual(cfg_file, config.cfg_file)
+        self.assertTrue(config.incremental)
+
+        pynag.Model.Host(host_name='global_config_host').save()
+        self.assertTrue(pynag.Model.Host.objects.get_by_shortname('global_config_host'))
+        self.assertTrue(config is pynag.Model.config)
+
+    def test_reload_cache_in_shared_lock(self):
+        """ A reload from inside a shared read upgrades the lock of the global context """
+        lock = pynag.Model.get_context().lock
+        self.assertTrue(isinstance(lock, pynag.Utils.ReadWriteLock))
+        pynag.Model.Host.objects.get_all()
+        with pynag.Utils.shared_lock(lock):
+            with open(os.path.join(self.environment.objects_dir, 'shared.cfg'), 'w') as f:
+                f.write("define host {\nhost_name shared_lock_host\n}\n")
+            self.assertTrue(pynag.Model.Host.objects.needs_reload())
+            host = pynag.Model.Host.objects.get_by_shortname('shared_lock_host')
+            self.assertEqual('shared_lock_host', host.host_name)
+        self.assertEqual({}, lock._readers)
+
+    def test_model_context(self):
+        """ Several configurations in one process, each in its own ModelContext """
+        other = pynag.Utils.misc.FakeNagiosEnvironment()
+        other.create_minimal_environment()
+        self.addCleanup(other.terminate)
+        context = pynag.Model.ModelContext(config=other.get_config(), pynag_directory=other.objects_dir)
+        self.assertTrue(pynag.Model.get_context() is not context)
+
+        with context:
+            self.assertTrue(pynag.Model.get_context() is context)
+            pynag.Model.Host(host_name='context_host').save()
+            host = pynag.Model.Host.objects.get_by_shortname('context_host')
+            self.assertTrue(host.get_filename().startswith(other.objects_dir))
+        self.assertEqual([], pynag.Model.Host.objects.filter(host_name='context_host'))
+        pynag.Model.Host(host_name='global_host').save()
+        self.assertEqual(1, len(pynag.Model.Host.objects.filter(host_name='global_host')))
+
+        # Other threads do not see the context, but can enter it themselves
+        results = {}
+
+        def worker(name, context):
+            with context:
+                results[name] = [i.host_name for i in pynag.Model.Host.objects.filter(host_name__in=['context_host', 'global_host'])]
+            results[name + '_after'] = pynag.Model.get_context()
+        threads = [
+            threading.Thread(target=worker, args=('context', context)),
+            threading.Thread(target=worker, args=('global', pynag.Model.get_context())),
+        ]
+        with context:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(['context_host'], results['context'])
+        self.assertEqual(['global_host'], results['global'])
+        self.assertTrue(results['context_after'] is pynag.Model.get_context())
+
+    def test_filter_indexes(self):
+        """ ObjectFetcher.filter() should find the same objects as pynag.Utils.grep() """
+        self.environment.import_config(os.path.join(tests_dir, 'dataset01/nagios/conf.d'))
+        searches = [
+            {'host_name': 'ok_host'},
+            {'host_name': 'does_not_exist'},
+            {'host_name': None},
+            {'register': '0'},
+            {'register': '1', 'host_name__startswith': 'ok'},
+            {'host_name__in': ['ok_host', 'localhost']},
+            {'host_name__in': 'ok_host'},
+            {'contact_groups__has_field': 'admins'},
+            {'host_name__startswith': 'h', 'service_description__contains': 'a'},
+            {'host_name__isnot': None, 'service_description': ['ok service 1', 'ok service 2']},
+            {'name__exists': True, 'use__has_field': 'generic-service'},
+            {'service_description__regex': '^ok', 'host_name': 'ok_host'},
+            {'search': 'ok'},
+        ]
+        for object_type in (None, 'host', 'service', 'contact'):
+            fetcher = pynag.Model.ObjectFetcher(object_type)
+            for search in searches:
+                expected = pynag.Utils.grep(fetcher.all, **search)
+                self.assertEqual(expected, fetcher.filter(**search), search)
+                self.assertEqual(expected, fetcher.filter(**search), search)
+
+        # Changes that have not been saved yet are searched too
+        host = pynag.Model.Host.objects.filter(host_name='ok_host')[0]
+        host['host_name'] = 'renamed_host'
+        self.assertEqual([], pynag.Model.Host.objects.filter(host_name='ok_host'))
+        self.assertEqual([host], pynag.Model.Host.objects.filter(host_name='renamed_host'))
+
+    def test_queryset(self):
+        """ Test chaining, slicing and short-circuiting of QuerySet """
+        for i in range(5):
+            pynag.Model.Host(host_name='queryset%s' % i, notes=str(i % 2), register=str(i % 2)).save()
+        hosts = pynag.Model.Host.objects.query(host_name__startswith='queryset')
+        expected = pynag.Utils.grep(pynag.Model.Host.objects.all, host_name__startswith='queryset')
+        self.assertTrue(isinstance(pynag.Model.Host.objects.filter(host_name__startswith='queryset'), list))
+        self.assertEqual(expected, pynag.Model.Host.objects.filter(host_name__startswith='queryset'))
+        even = [host for host in expected if host.notes == '0']
+        odd = [host for host in expected if host.notes == '1']
+        self.assertEqual(5, len(expected))
+
+        with mock.patch.object(pynag.Model.QuerySet, '_get_results', wraps=hosts._get_results) as get_results:
+            self.assertEqual(5, hosts.count())
+            self.assertTrue(hosts.exists())
+            self.assertEqual(expected[0], hosts.first())
+            self.assertEqual(expected[1], hosts[1])
+            self.assertEqual(expected[1:3], hosts[1:3])
+            self.assertFalse(get_results.called)
+
+        self.assertEqual(expected, list(hosts))
+        self.assertEqual(expected[-1], hosts[-1])
+        self.assertEqual(3, len(even))
+        self.assertEqual(even, list(hosts.filter(notes='0')))
+        self.assertEqual(odd, list(hosts.exclude(notes='0')))
+        self.assertEqual(odd, list(hosts.exclude(register='0', notes='0')))
+        self.assertEqual(odd + even, hosts.exclude(notes='0') + hosts.filter(notes='0'))
+
+        nothing = hosts.filter(host_name='does_not_exist')
+        self.assertFalse(nothing)
+        self.assertEqual(None, nothing.first())
+        self.assertEqual(0, nothing.count())
+        self.assertEqual([], nothing)
+        self.assertRaises(IndexError, lambda: nothing[0])
+
+    def test_get_id(self):
+        """ Object ids only depend on the configuration, not on hash randomization """
+        host = pynag.Model.Host.objects.get_by_shortname('ok_host')
+        ids = set(i.get_id() for i in pynag.Model.ObjectDefinition.objects.all)
+        self.assertEqual(len(pynag.Model.ObjectDefinition.objects.all), len(ids))
+
+        code = "import sys; sys.path.insert(0, %r); import pynag.Model; pynag.Model.cfg_file = %r; " \
+               "print(pynag.Model.Host.objects.get_by_shortname('ok_host').get_id())"
+        code = code % (pynagbase, pynag.Model.cfg_file)
+        for seed in ('1', '2'):
+            environ = os.environ.copy()
+            environ['PYTHONHASHSEED'] = seed
+            process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, env=environ)
+            stdout, stderr = process.communicate()
+            self.assertEqual(host.get_id(), stdout.decode().strip())
+
+        host.set_attribute('notes', 'new notes')
+        host.save()
+        self.assertFalse(pynag.Model.Host.objects.get_by_shortname('ok_host').get_id() in ids)
+
     def test_rename(self):
         """ Generic test of Model.*.rename()
         """
@@ -391,6 +599,41 @@ class Model(unittest.TestCase):
         self.assertEqual(macro, s['__TEST_MACRO'])
         self.assertEqual(check_command, s.get_attribute('check_command'))
 
+    def test_attribute_cache(self):
+        """ Cached effective attributes follow changes, save() and reload_object() """
+        template = pynag.Model.Host(name='cache-template', register='0', notes='from template')
+        template.save()
+        pynag.Model.Host(name='other-template', register='0').save()
+        host = pynag.Model.Host(host_name='cache_host', use='cache-template')
+        host.save()
+        host = pynag.Model.Host.objects.get_by_shortname('cache_host')
+        self.assertEqual('from template', host['notes'])
+        self.assertTrue('notes' in host)
+        self.assertFalse('action_url' in host)
+        self.assertEqual(None, host['action_url'])
+        self.assertEqual('1', host['register'])
+        keys = host.keys()
+        self.assertEqual(['meta', 'id', 'shortname', 'effective_command_line'], keys[:4])
+        self.assertEqual(len(keys), len(set(keys)))
+
+        host['action_url'] = 'http://localhost/'
+        host['notes'] = 'changed'
+        self.assertEqual('changed', host['notes'])
+        self.assertTrue('action_url' in host)
+        self.assertEqual(['action_url', 'notes'], host.keys()[4:6])
+
+        host.save()
+        self.assertEqual('changed', host['notes'])
+        self.assertEqual('http://localhost/', host['action_url'])
+        host['notes'] = None
+        host.save()
+        self.assertEqual('from template', host['notes'])
+
+        host.use = 'other-template'
+        host.reload_object()
+        self.assertEqual(None, host['notes'])
+        self.assertFalse('notes' in host)
+
     def test_suggested_fileName(self):
         """ Test get_suggested_filename feature in pynag.Model
         """
@@ -551,6 +794,29 @@ class Model(unittest.TestCase):
         # Hostgroup.get_effective_hosts() should match the same regex:
         self.assertEqual(hosts, prod_servers.get_effective_hosts())
 
+        # Regex results are kept between reloads, but must include new hosts
+        pynag.Model.Host(host_name='prod-api-3', use='linux-server').save()
+        pynag.Model.ObjectDefinition.objects.reload_cache()
+        prod_api3 = pynag.Model.Host.objects.get_by_shortname('prod-api-3')
+        prod_servers = pynag.Model.Hostgroup.objects.get_by_shortname('prod-servers')
+        self.assertTrue(prod_api3 in prod_servers.get_effective_hosts())
+        self.assertFalse(dev_api2 in prod_servers.get_effective_hosts())
+
+    def test_regex_matcher(self):
+        """ RegexMatcher forgets patterns that are no longer used """
+        matcher = pynag.Model.RegexMatcher(['prod-1', 'dev-1'])
+        self.assertEqual(set(['prod-1']), matcher.match('prod-.*'))
+        self.assertEqual(set(['dev-1']), matcher.match('dev-.*'))
+
+        matcher.update(['prod-1', 'prod-2', 'dev-1'])
+        self.assertEqual(set(['prod-1', 'prod-2']), matcher.match('prod-.*'))
+        self.assertEqual(['dev-.*', 'prod-.*'], sorted(matcher._matches))
+
+        # dev-.* was not matched since the last update
+        matcher.update(['prod-1', 'prod-2', 'dev-1'])
+        self.assertEqual(['prod-.*'], sorted(matcher._matches))
+        self.assertEqual(set(['dev-1']), matcher.match('dev-.*'))
+
     def test_rewrite(self):
         """ Test usage on ObjectDefinition.rewrite() """
         h = pynag.Model.Host()
@@ -1102,6 +1368,37 @@ class Model(unittest.TestCase):
 
         self.assertEqual(production_service.get_effective_hostgroups(), [production_servers])
 
+    def test_host_effective_services(self):
+        """ Services via host_name, nested hostgroups and exclusions are listed once per host """
+        pynag.Model.Hostgroup(hostgroup_name='parent_group', hostgroup_members='child_group').save()
+        pynag.Model.Hostgroup(hostgroup_name='child_group').save()
+        pynag.Model.Host(host_name='host_a', hostgroups='child_group').save()
+        pynag.Model.Host(host_name='host_b', hostgroups='child_group').save()
+        pynag.Model.Host(host_name='host_c').save()
+        pynag.Model.Service(host_name='host_a', hostgroup_name='parent_group', service_description='both').save()
+        pynag.Model.Service(hostgroup_name='parent_group', host_name='!host_b', service_description='not_b').save()
+        pynag.Model.Service(host_name='*', hostgroup_name='!child_group', service_description='not_group').save()
+
+        get_services = lambda x: sorted(i.service_description for i in pynag.Model.Host.objects.get_by_shortname(x).get_effective_services())
+        self.assertEqual(['both', 'not_b'], get_services('host_a'))
+        self.assertEqual(['both'], get_services('host_b'))
+        self.assertEqual(['not_group'], get_services('host_c'))
+        exported = [(i[0], i[1]) for i in pynag.Model.iter_effective_command_lines()]
+        self.assertEqual(
+            [('host_a', 'both'), ('host_a', 'not_b'), ('host_b', 'both'), ('host_c', 'not_group')],
+            sorted(i for i in exported if i[0] in ('host_a', 'host_b', 'host_c')))
+
+        # Exclusions are kept apart from the other relations
+        relations = pynag.Model.ObjectRelations
+        for dictionary in (relations.host_services, relations.hostgroup_services):
+            self.assertEqual([], [i for i in dictionary if i.startswith('!')])
+        for dictionary in (relations.service_hosts, relations.service_hostgroups):
+            self.assertEqual([], [i for names in dictionary.values() for i in names if i.startswith('!')])
+        not_b = pynag.Model.Service.objects.filter(service_description='not_b')[0]
+        self.assertEqual(set([not_b.get_id()]), relations.excluded_host_services['host_b'])
+        not_group = pynag.Model.Service.objects.filter(service_description='not_group')[0]
+        self.assertEqual(set([not_group.get_id()]), relations.excluded_hostgroup_services['child_group'])
+
     def test_host_delete_that_shares_service(self):
         """ Try deleting a host and all services, but services are in use by another host """
         pynag.Model.Host(host_name='host_a').save()
@@ -1225,6 +1522,31 @@ class ObjectRelations(unittest.TestCase):
         members_of_everything_expected = set(['users', 'operators', 'sysadmins', 'network-admins', 'admins', 'nonadmins', 'database-admins'])
         self.assertEqual(members_of_everything_actual, members_of_everything_expected)
 
+    def test_relation_graph(self):
+        c = pynag.Utils.defaultdict(set)
+        c['everything'] = set(['admins', 'nonadmins', 'operators'])
+        c['nonadmins'] = set(['users'])
+        c['admins'] = set(['sysadmins', 'network-admins'])
+        c['sysadmins'] = set(['admins'])
+        c['loop'] = set(['loop'])
+        graph = pynag.Model.RelationGraph(c)
+        closure = graph.closure()
+        for group in list(c.keys()):
+            self.assertEqual(closure[group], pynag.Model.ObjectRelations._get_subgroups(group, c))
+        self.assertEqual(closure['users'], set())
+
+        members = graph.propagate({'users': set(['bob']), 'sysadmins': set(['alice']), 'loop': set(['eve'])})
+        self.assertEqual(members['everything'], set(['bob', 'alice']))
+        self.assertEqual(members['admins'], set(['alice']))
+        self.assertEqual(members['loop'], set(['eve']))
+        self.assertEqual(members['operators'], set())
+
+    def test_relation_graph_deep_nesting(self):
+        c = dict(('group%s' % i, ['group%s' % (i + 1)]) for i in range(5000))
+        closure = pynag.Model.RelationGraph(c).closure()
+        self.assertEqual(len(closure['group0']), 5000)
+        self.assertEqual(closure['group5000'], set())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 __author__ = 'palli'
 
+import errno
 import os
 import sys
 
@@ -44,6 +45,538 @@ class Config(unittest.TestCase):
         self.config.parse()
         self.assertTrue(len(self.config.data) > 0, "pynag.Parsers.config.parse() ran and afterwards we see no objects. Empty configuration?")
 
+    def test_extended_parse(self):
+        """ Test hostgroup_list, service_list and service_members from extended_parse() """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\nname ext-template\nhostgroups ext_group1\nregister 0\n}\n")
+            f.write("define host {\nhost_name ext_host1\nuse ext-template\n}\n")
+            f.write("define host {\nhost_name ext_template_host\nregister 0\n}\n")
+            f.write("define host {\nhost_name ext_host2\nhostgroups ext_group2\n}\n")
+            f.write("define hostgroup {\nhostgroup_name ext_group1\nmembers ext_host2\n}\n")
+            f.write("define hostgroup {\nhostgroup_name ext_group2\nmembers ext_host1,ext_host2\n}\n")
+            f.write("define service {\nhost_name ext_host1,ext_host2\nservice_description both\n}\n")
+            f.write("define service {\nhostgroup_name ext_group2\nhost_name !ext_host2\nservice_description not_host2\n}\n")
+            f.write("define service {\nhostgroup_name ext_group2,!ext_group1\nservice_description not_group1\n}\n")
+            f.write("define service {\nhost_name ext_host1\nservice_description template\nregister 0\n}\n")
+        c = self.config
+        c.extended_parse()
+        host1 = c.get_host('ext_host1')
+        host2 = c.get_host('ext_host2')
+        self.assertEqual(['ext_group1', 'ext_group2'], host1['meta']['hostgroup_list'])
+        self.assertEqual(['ext_group2', 'ext_group1'], host2['meta']['hostgroup_list'])
+        self.assertEqual(['both', 'not_host2', 'not_group1'], host1['meta']['service_list'])
+        self.assertEqual(['both'], host2['meta']['service_list'])
+        self.assertFalse('service_list' in c.get_host('ext_template_host')['meta'])
+        service_members = dict((i.get('service_description'), i['meta']['service_members']) for i in c.data['all_service'])
+        self.assertEqual(['ext_host1', 'ext_host2'], service_members['both'])
+        self.assertEqual(['ext_host1'], service_members['not_host2'])
+        self.assertEqual(['ext_host1'], service_members['not_group1'])
+        self.assertEqual(['ext_host1'], service_members['template'])
+
+    def test_parse_incremental(self):
+        """ Test config.parse() with incremental=True """
+        templates_file = self.environment.objects_dir + "/templates.cfg"
+        hosts_file = self.environment.objects_dir + "/hosts.cfg"
+        with open(templates_file, 'w') as f:
+            f.write("define host {\nname parent-template\nnotes parent\nregister 0\n}\n")
+            f.write("define host {\nname child-template\nuse parent-template\nregister 0\n}\n")
+        with open(hosts_file, 'w') as f:
+            f.write("define host {\nhost_name incremental_host\nuse child-template\n}\n")
+        c = self.config
+        c.incremental = True
+        c.parse()
+        ok_host = c.get_host('ok_host')
+        self.assertEqual('parent', c.get_host('incremental_host')['notes'])
+
+        # Change a template, inheritance should be reapplied to everything using it
+        template = c.get_object('host', 'parent-template', user_key='name')
+        c.item_edit_field(template, 'notes', 'changed')
+        self.assertTrue(c.needs_reparse())
+        c.parse()
+        self.assertFalse(c.needs_reparse())
+        self.assertEqual('changed', c.get_host('incremental_host')['notes'])
+        self.assertEqual('changed', c.get_object('host', 'child-template', user_key='name')['notes'])
+
+        # Add a new file and remove another one
+        new_item = c.get_new_item('host', filename=self.objects_file)
+        new_item['host_name'] = 'new_incremental_host'
+        new_item['use'] = 'child-template'
+        c.item_add(new_item, filename=self.objects_file)
+        os.remove(hosts_file)
+        c.parse()
+        self.assertEqual(None, c.get_host('incremental_host'))
+        self.assertEqual('changed', c.get_host('new_incremental_host')['notes'])
+
+        # Objects from unchanged files are left alone
+        self.assertTrue(ok_host is c.get_host('ok_host'))
+
+        # And the end result should be the same as a full parse
+        def assert_same_as_full_parse():
+            full = pynag.Parsers.config(cfg_file=c.cfg_file)
+            full.parse()
+            self.assertEqual(full.data, c.data)
+            self.assertEqual(full.cfg_files, c.cfg_files)
+            self.assertEqual(sorted(map(str, full.errors)), sorted(map(str, c.errors)))
+        assert_same_as_full_parse()
+
+        # Templates with the same name in several files
+        first_file = self.environment.objects_dir + "/duplicate1.cfg"
+        second_file = self.environment.objects_dir + "/duplicate2.cfg"
+        with open(first_file, 'w') as f:
+            f.write("define host {\nname duplicate-template\nnotes first\nregister 0\n}\n")
+            f.write("define host {\nhost_name duplicate_host\nuse duplicate-template\n}\n")
+        with open(second_file, 'w') as f:
+            f.write("define host {\nname duplicate-template\nnotes second\nregister 0\n}\n")
+        c.parse()
+        assert_same_as_full_parse()
+        os.remove(second_file)
+        c.parse()
+        assert_same_as_full_parse()
+        self.assertEqual('first', c.get_host('duplicate_host')['notes'])
+
+        # Circular use=
+        with open(templates_file, 'w') as f:
+            f.write("define host {\nname parent-template\nuse child-template\nnotes parent\nregister 0\n}\n")
+            f.write("define host {\nname child-template\nuse parent-template\nregister 0\n}\n")
+        c.parse()
+        assert_same_as_full_parse()
+        with open(templates_file, 'a') as f:
+            f.write("define host {\nname other-template\nregister 0\n}\n")
+        c.parse()
+        assert_same_as_full_parse()
+
+        # Errors of templates in unchanged files are not reported twice
+        with open(templates_file, 'w') as f:
+            f.write("define host {\nname broken-template\nuse missing-template\nregister 0\n}\n")
+        with open(hosts_file, 'w') as f:
+            f.write("define host {\nhost_name broken_host\nuse broken-template\n}\n")
+        c.parse()
+        for i in range(3):
+            with open(hosts_file, 'a') as f:
+                f.write("define host {\nhost_name broken_host%s\nuse broken-template\n}\n" % i)
+            c.parse()
+            assert_same_as_full_parse()
+
+    def test_parse_cache(self):
+        """ Test config.parse() with a cache_file """
+        cache_file = os.path.join(self.tempdir, 'objects.cache.pickle')
+        c = pynag.Parsers.config(cfg_file=self.config.cfg_file, cache_file=cache_file)
+        c.parse()
+        self.assertTrue(os.path.isfile(cache_file))
+
+        # Nothing has changed, so a new parser should not need to read any object files
+        cached = pynag.Parsers.config(cfg_file=self.config.cfg_file, cache_file=cache_file)
+        with mock.patch.object(cached, 'parse_file') as parse_file:
+            cached.parse()
+            self.assertFalse(parse_file.called)
+        self.assertEqual(c.data, cached.data)
+        self.assertEqual(c.errors, cached.errors)
+
+        # Changing a configuration file invalidates the cache
+        with open(self.objects_file, 'a') as f:
+            f.write("define host {\nhost_name cache_host\n}\n")
+        cached.parse()
+        self.assertTrue(cached.get_host('cache_host'))
+
+        # Corrupt caches are ignored
+        with open(cache_file, 'w') as f:
+            f.write('garbage')
+        c.parse()
+        self.assertTrue(c.get_host('cache_host'))
+
+    def test_parse_processes(self):
+        """ Test config.parse() with a pool of worker processes """
+        for i in range(5):
+            with open(self.environment.objects_dir + "/hosts%s.cfg" % i, 'w') as f:
+                f.write("define host {\nhost_name host%s\nuse generic-host\n}\n" % i)
+        self.config.parse()
+        c = pynag.Parsers.config(cfg_file=self.config.cfg_file, processes=2)
+        c.parse()
+        self.assertEqual(self.config.cfg_files, c.cfg_files)
+        self.assertEqual(self.config.data, c.data)
+        self.assertEqual(self.config.errors, c.errors)
+
+    def test_parse_string_regex(self):
+        """ Fast and line based implementations of parse_string() should agree """
+        c = self.config
+        strings = [
+            minimal_config,
+            "define host{\nhost_name a ; comment\n  ;c\n#c\n\n  notes  x y  \n}\n",
+            "define host {host_name x }\nnotes a\n}",
+            "  define host {\n\thost_name\tx\t\n\tempty\t\t\n\t}\n\n# end",
+            "define timeperiod {\ntimeperiod_name t\nalias a b\nmonday 00:00-24:00 ; x\n}\n",
+            "define hostgroup {\nhostgroup_name hg\nmembers a\nmembers b\n}\n",
+            "define service {\ndescription d\nhost_name;x y\nkey ;v\n}\n",
+            "define host {\n}\ndefine host {\n}",
+        ]
+        for root, dirs, files in os.walk(tests_dir):
+            for filename in files:
+                if filename.endswith('.cfg'):
+                    with open(os.path.join(root, filename)) as f:
+                        strings.append(f.read())
+        for string in strings:
+            fast = c._parse_string_regex(string, filename='test.cfg')
+            if fast is None:
+                continue
+            self.assertEqual(c._parse_string_lines(string, filename='test.cfg'), fast)
+
+        # Anything unusual is left to the line based parser
+        self.assertEqual(None, c._parse_string_regex("define host {\nhost_name a\\\n b\n}\n"))
+        self.assertEqual(None, c._parse_string_regex("text outside\ndefine host {\n}\n"))
+        self.assertEqual(None, c._parse_string_regex("define host {\ndefine host {\n}\n"))
+        self.assertEqual(None, c._parse_string_regex("define host {\nhost_name a\n"))
+        self.assertEqual(None, c._parse_string_regex("define host {\r\nhost_name a\r\n}\r\n"))
+
+    def test_lookup_indexes(self):
+        """ Test that get_object() and get_service() find the same items as a linear search """
+        c = self.config
+        c.parse()
+        for service in c['all_service']:
+            found = c.get_service(service.get('host_name'), service.get('service_description'))
+            self.assertEqual(service.get('host_name'), found.get('host_name'))
+            self.assertEqual(service.get('service_description'), found.get('service_description'))
+        for host in c['all_host']:
+            self.assertTrue(c.get_host(host.get('host_name')).get('host_name') == host.get('host_name'))
+            if 'name' in host:
+                self.assertTrue(c.get_host(host['name'], user_key='name') is host)
+        self.assertEqual(None, c.get_host('does_not_exist'))
+        self.assertEqual(None, c.get_service('ok_host', 'does_not_exist'))
+
+        # Indexes must follow changes to self.data
+        new_host = c.get_new_item('host', self.objects_file)
+        new_host['host_name'] = 'index_host'
+        c['all_host'].append(new_host)
+        self.assertTrue(c.get_host('index_host') is new_host)
+        new_host['host_name'] = 'renamed_index_host'
+        self.assertEqual(None, c.get_host('index_host'))
+        c['all_host'] = [new_host]
+        self.assertTrue(c.get_host('renamed_index_host') is new_host)
+
+        # Items renamed in place are found under their new name
+        c.parse()
+        host = c.get_host('ok_host')
+        host['host_name'] = 'renamed'
+        self.assertTrue(c.get_host('renamed') is host)
+        self.assertEqual(None, c.get_host('ok_host'))
+        service = c['all_service'][0]
+        service['service_description'] = 'renamed service'
+        self.assertTrue(c.get_service(service.get('host_name'), 'renamed service') is service)
+
+    def test_commit(self):
+        """ Test config.commit() after config.flag_all_commit() """
+        c = self.config
+        c.parse()
+        hosts = c.get_host('ok_host')['meta']['filename']
+        with mock.patch.object(c, 'write') as write:
+            c.flag_all_commit()
+            c.commit()
+            written = [args[0][0] for args in write.call_args_list]
+        self.assertEqual(sorted(set(written)), sorted(written), "Every file should be written only once")
+        self.assertTrue(hosts in written)
+        for k in c.data.keys():
+            for item in c[k]:
+                self.assertFalse(item['meta']['needs_commit'])
+
+        # Objects should survive a round trip through commit()
+        host = c.get_host('ok_host')
+        host['meta']['needs_commit'] = True
+        c.commit()
+        c.parse()
+        self.assertEqual('ok_host', c.get_host('ok_host')['host_name'])
+        self.assertEqual(len(c._get_items_in_file(hosts)), len(c.parse_file(hosts)))
+
+    def test_transaction(self):
+        """ Test that config.transaction() gives the same result as unbatched changes """
+        with open(self.objects_file, 'w') as f:
+            for i in range(3):
+                f.write("define host {\n  host_name transaction%s\n  address 127.0.0.1\n}\n\n" % i)
+        original = open(self.objects_file).read()
+
+        def make_changes(c):
+            c.parse()
+            host0 = c.get_host('transaction0')
+            c.item_edit_field(host0, 'address', '127.0.0.2')
+            host0['address'] = '127.0.0.2'
+            host0['meta']['defined_attributes']['address'] = '127.0.0.2'
+            c.item_edit_field(host0, 'alias', 'alias0')
+            c.item_remove_field(c.get_host('transaction1'), 'address')
+            c.item_remove(c.get_host('transaction2'))
+            new_item = c.get_new_item('host', self.objects_file)
+            new_item['host_name'] = 'transaction3'
+            c.item_add(new_item, self.objects_file)
+
+        c = self.config
+        make_changes(c)
+        expected = open(self.objects_file).read()
+        with open(self.objects_file, 'w') as f:
+            f.write(original)
+
+        with mock.patch.object(c, 'write', wraps=c.write) as write:
+            with c.transaction():
+                make_changes(c)
+                self.assertEqual(original, open(self.objects_file).read())
+            self.assertEqual(1, write.call_count)
+        self.assertEqual(expected, open(self.objects_file).read())
+
+        # Exceptions roll back the transaction
+        try:
+            with c.transaction():
+                c.item_edit_field(c.get_host('transaction3'), 'address', '127.0.0.3')
+                raise KeyError()
+        except KeyError:
+            pass
+        self.assertEqual(expected, open(self.objects_file).read())
+        self.assertRaises(pynag.Parsers.ParserError, c.commit_transaction)
+
+    def test_locate_item_line_numbers(self):
+        """ Test that edits use line numbers from last parse instead of parsing the file again """
+        with open(self.objects_file, 'w') as f:
+            for i in range(3):
+                f.write("define host {\n  host_name located%s\n  address 127.0.0.1\n}\n\n" % i)
+        c = self.config
+        c.parse()
+        with mock.patch.object(c, 'parse_file', wraps=c.parse_file) as parse_file:
+            host = c.get_host('located0')
+            c.item_edit_field(host, 'alias', 'first')
+            host['alias'] = host['meta']['defined_attributes']['alias'] = 'first'
+            c.item_remove_field(c.get_host('located1'), 'address')
+            c.item_edit_field(c.get_host('located2'), 'address', '127.0.0.2')
+            c.item_edit_field(host, 'notes', 'second')
+            self.assertFalse(parse_file.called)
+
+            # If someone else changes the file, line numbers can not be trusted
+            with open(self.objects_file, 'r+') as f:
+                contents = f.read()
+                f.seek(0)
+                f.write("# Moving things around\n" + contents)
+            host = c.get_host('located2')
+            host['address'] = host['meta']['defined_attributes']['address'] = '127.0.0.2'
+            c.item_edit_field(host, 'notes', 'external')
+            self.assertTrue(parse_file.called)
+
+        c.parse()
+        self.assertEqual('first', c.get_host('located0')['alias'])
+        self.assertEqual('second', c.get_host('located0')['notes'])
+        self.assertFalse('address' in c.get_host('located1'))
+        self.assertEqual('127.0.0.2', c.get_host('located2')['address'])
+        self.assertEqual('external', c.get_host('located2')['notes'])
+
+    def test_write_atomic(self):
+        """ Test that config.write() replaces files instead of truncating them """
+        c = self.config
+        self.assertFalse(c.atomic_writes)
+        c.atomic_writes = True
+        c.fsync = True
+        with open(self.objects_file, 'w') as f:
+            f.write('old contents\n')
+        os.chmod(self.objects_file, 0o640)
+        link = os.path.join(self.tempdir, 'link.cfg')
+        os.symlink(self.objects_file, link)
+        inode = os.stat(self.objects_file).st_ino
+
+        c.write(link, 'new contents\n')
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual('new contents\n', open(self.objects_file).read())
+        self.assertNotEqual(inode, os.stat(self.objects_file).st_ino)
+        self.assertEqual(0o640, os.stat(self.objects_file).st_mode & 0o777)
+        self.assertEqual([], [x for x in os.listdir(self.environment.objects_dir) if x.endswith('.tmp')])
+
+        # Hard links are kept
+        hard_link = os.path.join(self.tempdir, 'hard_link.cfg')
+        os.link(self.objects_file, hard_link)
+        c.write(self.objects_file, 'hard linked\n')
+        self.assertEqual('hard linked\n', open(hard_link).read())
+        os.remove(hard_link)
+
+        # Files we may not create files next to are written in place
+        inode = os.stat(self.objects_file).st_ino
+        real_open = c.open
+
+        def open_no_tmp(filename, *args, **kwargs):
+            if filename.endswith('.tmp'):
+                raise IOError(errno.EACCES, 'Permission denied', filename)
+            return real_open(filename, *args, **kwargs)
+        with mock.patch.object(c, 'open', side_effect=open_no_tmp):
+            c.write(self.objects_file, 'read only directory\n')
+        self.assertEqual('read only directory\n', open(self.objects_file).read())
+        self.assertEqual(inode, os.stat(self.objects_file).st_ino)
+        with mock.patch.object(c, 'open', side_effect=open_no_tmp):
+            self.assertRaises(IOError, c.write, os.path.join(self.tempdir, 'new.cfg'), 'new\n')
+
+        c.atomic_writes = False
+        inode = os.stat(self.objects_file).st_ino
+        c.write(self.objects_file, 'in place\n')
+        self.assertEqual('in place\n', open(self.objects_file).read())
+        self.assertEqual(inode, os.stat(self.objects_file).st_ino)
+
+    def test_write_behind(self):
+        """ Test that config.write_behind() writes every file once """
+        c = self.config
+        c.parse()
+        with mock.patch.object(c, '_write_file', wraps=c._write_file) as write_file:
+            with c.write_behind():
+                for i in range(3):
+                    c._edit_static_file(attribute='pynag_test%s' % i, new_value='value', filename=c.cfg_file)
+                self.assertFalse(write_file.called)
+                self.assertFalse('pynag_test0' in open(c.cfg_file).read())
+            self.assertEqual(1, write_file.call_count)
+        contents = open(c.cfg_file).read()
+        for i in range(3):
+            self.assertTrue('pynag_test%s=value' % i in contents)
+
+        # Buffered writes are discarded when a transaction is rolled back
+        try:
+            with c.transaction():
+                c._edit_static_file(attribute='pynag_test0', new_value='changed', filename=c.cfg_file)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(contents, open(c.cfg_file).read())
+
+    def test_watch(self):
+        """ Test that needs_reparse() only looks at files after a watcher saw a change """
+        try:
+            pynag.Parsers.watchers.InotifyWatcher().close()
+        except OSError:
+            self.skipTest("inotify is not available")
+        c = pynag.Parsers.config_parser.Config(cfg_file=self.config.cfg_file, watch='inotify')
+        c.parse()
+        with mock.patch.object(c, 'get_timestamps', wraps=c.get_timestamps) as get_timestamps:
+            self.assertFalse(c.needs_reparse())
+            # Files that nagios.cfg does not use do not matter
+            with open(os.path.join(self.tempdir, 'nagios.log'), 'w') as f:
+                f.write('log line\n')
+            self.assertFalse(c.needs_reparse())
+            self.assertFalse(get_timestamps.called)
+
+            # A new cfg file in cfg_dir, seen until the next parse()
+            with open(self.objects_file, 'w') as f:
+                f.write("define host {\nhost_name watched_host\n}\n")
+            self.assertTrue(c.needs_reparse())
+            self.assertTrue(c.needs_reparse())
+            c.parse()
+            get_timestamps.reset_mock()
+            self.assertFalse(c.needs_reparse())
+            self.assertFalse(get_timestamps.called)
+
+        # Changes to existing files, also when they are replaced with rename()
+        c.write(self.objects_file, "define host {\nhost_name renamed_host\n}\n")
+        c._is_dirty = False
+        os.utime(self.objects_file, (0, 0))
+        self.assertTrue(c.needs_reparse())
+        c.parse()
+        self.assertEqual(['renamed_host'], [i.get('host_name') for i in c.data['all_host'] if i.get('host_name') == 'renamed_host'])
+
+        # Polling only looks at files once per interval
+        c = pynag.Parsers.config_parser.Config(cfg_file=self.config.cfg_file, watch='poll', poll_interval=3600)
+        c.parse()
+        os.utime(self.objects_file, (1, 1))
+        self.assertFalse(c.needs_reparse())
+        c._watcher.interval = 0
+        self.assertTrue(c.needs_reparse())
+
+    def test_watch_missing_and_symlinked_files(self):
+        """ Files in directories that do not exist yet, and targets of symlinks, are watched too """
+        try:
+            pynag.Parsers.watchers.InotifyWatcher().close()
+        except OSError:
+            self.skipTest("inotify is not available")
+        missing_dir = os.path.join(self.tempdir, 'not_yet')
+        missing_file = os.path.join(missing_dir, 'later.cfg')
+        target_dir = os.path.join(self.tempdir, 'targets')
+        os.mkdir(target_dir)
+        target = os.path.join(target_dir, 'target.cfg')
+        with open(target, 'w') as f:
+            f.write("define host {\nhost_name target_host\n}\n")
+        link_dir = os.path.join(self.tempdir, 'links')
+        os.mkdir(link_dir)
+        link = os.path.join(link_dir, 'link.cfg')
+        os.symlink(target, link)
+        cfg_file = os.path.join(self.tempdir, 'watched_nagios.cfg')
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_file=%s\ncfg_file=%s\n" % (missing_file, link))
+
+        for i, watch in enumerate(('inotify', None)):
+            c = pynag.Parsers.config_parser.Config(cfg_file=cfg_file, watch=watch)
+            c.parse()
+            self.assertFalse(c.needs_reparse())
+            os.mkdir(missing_dir)
+            with open(missing_file, 'w') as f:
+                f.write("define host {\nhost_name later_host\n}\n")
+            self.assertTrue(c.needs_reparse(), "watch=%s" % watch)
+            c.parse()
+            self.assertFalse(c.needs_reparse())
+
+            with open(target, 'a') as f:
+                f.write("define host {\nhost_name another_host\n}\n")
+            os.utime(target, (i, i))
+            self.assertTrue(c.needs_reparse(), "watch=%s" % watch)
+            shutil.rmtree(missing_dir)
+
+    def test_get_resource(self):
+        """ Test that config.get_resource() notices changes to resource files """
+        c = self.config
+        resource_file = os.path.join(self.tempdir, 'resource_test.cfg')
+        with open(resource_file, 'w') as f:
+            f.write("$USER1$=/first\n")
+        c._edit_static_file(attribute='resource_file', new_value=resource_file)
+        c.parse()
+        self.assertEqual('/first', c.get_resource('$USER1$'))
+
+        with open(resource_file, 'w') as f:
+            f.write("$USER1$=/second/path\n")
+        self.assertEqual('/second/path', c.get_resource('$USER1$'))
+
+        c.write(resource_file, "$USER1$=/third\n")
+        self.assertEqual('/third', c.get_resource('$USER1$'))
+
+    def test_apply_template(self):
+        """ Test template inheritance, including multiple and circular use= """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\nname a\nuse b\nnotes a\nregister 0\n}\n")
+            f.write("define host {\nname b\nuse a\nnotes b\nalias b\nregister 0\n}\n")
+            f.write("define host {\nname c\nnotes c\naddress c\nregister 0\n}\n")
+            f.write("define host {\nhost_name template_host\nuse a,c,missing\n}\n")
+        c = self.config
+        c.parse()
+        host = c.get_host('template_host')
+        self.assertEqual('a', host['notes'])
+        self.assertEqual('b', host['alias'])
+        self.assertEqual('c', host['address'])
+        self.assertEqual(sorted(['notes', 'alias', 'address']), sorted(host['meta']['template_fields']))
+        self.assertFalse('name' in host)
+
+        errors = [str(e) for e in c.errors if isinstance(e, pynag.Parsers.ParserError)]
+        self.assertEqual(1, len([e for e in errors if 'Circular use= in host templates: a -> b -> a' in e]))
+        self.assertEqual(1, len([e for e in errors if 'Can not find any host named missing' in e]))
+
+    def test_compact_items(self):
+        """ Items share attribute names and values where possible, but not inherited attributes """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\nname compact-template\nnotes shared notes\nregister 0\n}\n")
+            for i in range(2):
+                f.write("define host {\nhost_name compact%s\nuse compact-template\nalias same alias\n}\n" % i)
+        c = self.config
+        c.parse()
+        host0 = c.get_host('compact0')
+        host1 = c.get_host('compact1')
+        self.assertEqual(host0['meta']['inherited_attributes'], host1['meta']['inherited_attributes'])
+        self.assertTrue(host0['alias'] is host1['alias'])
+        key0 = [k for k in host0 if k == 'alias'][0]
+        key1 = [k for k in host1 if k == 'alias'][0]
+        self.assertTrue(key0 is key1)
+
+        # Modifying inherited attributes of one item must not change what others inherit
+        host0['meta']['inherited_attributes']['notes'] = 'changed notes'
+        self.assertEqual('shared notes', host1['meta']['inherited_attributes']['notes'])
+        self.assertEqual('shared notes', c.item_apply_cache['host']['compact-template']['notes'])
+
+        # Neither must reapplying templates
+        host0['meta']['inherited_attributes'] = {'notes': 'own notes'}
+        c._apply_template(host0)
+        self.assertEqual('own notes', host0['meta']['inherited_attributes']['notes'])
+        self.assertEqual('shared notes', host1['meta']['inherited_attributes']['notes'])
+
     def test_parse_string_backslashes(self):
         """ Test parsing nagios object files with lines that end with backslash
         """
@@ -10,6 +10,7 @@ import unittest2 as unittest
 from mock import patch
 import shutil
 import tempfile
+import threading
 import pynag.Utils as utils
 import pynag.Model
 from pynag.Utils import PynagError
@@ -361,6 +362,97 @@ class testUtils(unittest.TestCase):
         self.assertEqual('(standard input):0\n', result[1])
 
 
+    def test_read_write_lock(self):
+        """ test pynag.Utils.ReadWriteLock """
+        lock = pynag.Utils.ReadWriteLock()
+        events = []
+        readers_inside = threading.Event()
+        writer_waiting = threading.Event()
+
+        def reader():
+            with lock.shared:
+                events.append('reader in')
+                if len(events) == 2:
+                    readers_inside.set()
+                writer_waiting.wait(5)
+                events.append('reader out')
+
+        def writer():
+            readers_inside.wait(5)
+            writer_waiting.set()
+            with lock:
+                events.append('writer')
+
+        threads = [threading.Thread(target=i) for i in (reader, reader, writer)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Both readers held the lock at the same time, the writer waited for them
+        self.assertEqual(['reader in', 'reader in'], events[:2])
+        self.assertEqual('writer', events[-1])
+
+        # The exclusive lock is reentrant and allows shared locks
+        with lock:
+            with lock:
+                with lock.shared:
+                    pass
+
+        # The shared lock can be upgraded, it is held again afterwards
+        with lock.shared:
+            with lock.shared:
+                with lock:
+                    self.assertEqual({}, lock._readers)
+                self.assertEqual(2, list(lock._readers.values())[0])
+        self.assertEqual({}, lock._readers)
+        self.assertRaises(RuntimeError, lock.release)
+
+        # Two threads upgrading at the same time do not wait for each other forever
+        upgraded = []
+        both_inside = threading.Event()
+
+        def upgrade():
+            with lock.shared:
+                upgraded.append(None)
+                if len(upgraded) == 2:
+                    both_inside.set()
+                both_inside.wait(5)
+                with lock:
+                    upgraded.append('upgraded')
+        threads = [threading.Thread(target=upgrade) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(2, upgraded.count('upgraded'))
+        self.assertRaises(RuntimeError, lock.shared.release)
+
+        # acquire() takes the same arguments as with a threading.RLock
+        other_thread = []
+
+        def take_lock():
+            other_thread.append(lock.acquire(False))
+            other_thread.append(lock.acquire(timeout=0.01))
+            other_thread.append(lock.shared.acquire(blocking=False))
+        with lock:
+            thread = threading.Thread(target=take_lock)
+            thread.start()
+            thread.join()
+        self.assertEqual([False, False, False], other_thread)
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+    def test_rlock(self):
+        """ pynag.Utils.rlock is a plain threading.RLock """
+        rlock = pynag.Utils.rlock
+        self.assertTrue(rlock.acquire(False))
+        with pynag.Utils.shared_lock(rlock):
+            with rlock:
+                pass
+        rlock.release()
+
+
 class testFakeNagiosEnvironment(unittest.TestCase):
 
     def setUp(self):
@@ -2,10 +2,20 @@
 # This should go into pynag's unit testing at some point
 # This script tries multithreaded writes to the pynag Model
 # and prints error to screen if any writes fail
+#
+# With "benchmark" as argument it instead measures how many lookups
+# threads get done with a pynag.Utils.ReadWriteLock, compared to a plain
+# threading.RLock that makes every lookup wait for the others.
 
 
 from __future__ import absolute_import
 from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import pynag.Model
 from multiprocessing import Pool
 from multiprocessing.pool import ThreadPool
@@ -18,7 +28,56 @@ def change(host):
     print("Set address", host.address, "to", host.host_name)
 
 
+def lookups(context, seconds):
+    """ Look up hosts and services in context for a number of seconds, returns how many were done """
+    count = 0
+    stop = time.time() + seconds
+    with context:
+        while time.time() < stop:
+            i = count % 1000
+            pynag.Model.Host.objects.get_by_shortname('host%s' % i)
+            len(pynag.Model.Service.objects.filter(host_name='host%s' % i))
+            count += 1
+    return count
+
+
+def benchmark(threads=(1, 2, 4, 8), seconds=2, files=0):
+    """ Prints lookups per second with a shared lock vs. an exclusive one """
+    import benchmarks
+    tempdir = tempfile.mkdtemp()
+    try:
+        # Every lookup checks if any of the files has changed, use files to add more of them
+        objects_dir = os.path.join(tempdir, 'conf.d')
+        os.mkdir(objects_dir)
+        with open(os.path.join(objects_dir, 'objects.cfg'), 'w') as f:
+            f.write(benchmarks.generate_config(hosts=1000))
+        for i in range(files):
+            with open(os.path.join(objects_dir, 'empty%s.cfg' % i), 'w') as f:
+                f.write("# No objects here\n")
+        cfg_file = os.path.join(tempdir, 'nagios.cfg')
+        with open(cfg_file, 'w') as f:
+            f.write("cfg_dir=%s\n" % objects_dir)
+
+        for lock_name in ('ReadWriteLock', 'RLock'):
+            context = pynag.Model.ModelContext(cfg_file=cfg_file)
+            if lock_name == 'RLock':
+                context.lock = threading.RLock()
+            with context:
+                pynag.Model.ObjectDefinition.objects.reload_cache()
+            for number_of_threads in threads:
+                pool = ThreadPool(number_of_threads)
+                counts = pool.map(lambda x: lookups(context, seconds), range(number_of_threads))
+                pool.close()
+                print("%-14s %2s threads %10.0f lookups/s" % (lock_name, number_of_threads, sum(counts) / float(seconds)))
+    finally:
+        shutil.rmtree(tempdir)
+
+
 if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+        sys.exit(0)
+
     hosts = pynag.Model.Host.objects.filter(host_name__startswith="web04")
     for i in hosts:
         i.address = "127.0.0.2"